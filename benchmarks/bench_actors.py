@@ -0,0 +1,79 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Overhead of JobActor dispatch and CollectActor saves. """
+
+from conftest import fill_tasks
+from simcity import Config, JobActor, TaskViewIterator
+from simcity.actors import CollectActor
+from simcity.worker import Worker
+from multiprocessing import Value
+import pytest
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+NUM_TASKS = 200
+
+
+class NoopWorker(Worker):
+    """ Worker that finishes tasks without doing anything. """
+    def process_task(self, task):
+        task.done()
+
+
+@pytest.mark.parametrize('parallelism', [1, 4])
+def test_dispatch_overhead(benchmark, memory_db, directories, parallelism):
+    config = Config()
+    config.add_section('Execution', dict(directories,
+                                         parallelism=parallelism))
+
+    def setup():
+        memory_db.docs.clear()
+        fill_tasks(memory_db, NUM_TASKS)
+        iterator = TaskViewIterator('benchmark_job', memory_db, 'pending')
+        actor = JobActor(iterator, NoopWorker, task_db=memory_db,
+                         job_db=memory_db, parallelism=parallelism,
+                         config=config)
+        return (actor,), {}
+
+    def run(actor):
+        actor.run()
+        assert NUM_TASKS == actor.tasks_processed.value
+
+    benchmark.pedantic(run, setup=setup, rounds=3)
+    benchmark.extra_info['overhead_per_task_ms'] = (
+        1000 * benchmark.stats.stats.mean / NUM_TASKS)
+
+
+def test_collect_throughput(benchmark, memory_db):
+    def setup():
+        memory_db.docs.clear()
+        result_q = Queue()
+        for task in fill_tasks(memory_db, NUM_TASKS):
+            result_q.put(task.lock('benchmark_job').done())
+        result_q.put(None)
+        collector = CollectActor(memory_db, 1, result_q, Value('i', 0))
+        return (collector,), {}
+
+    def run(collector):
+        collector.run()
+        assert NUM_TASKS == collector.tasks_processed.value
+
+    benchmark.pedantic(run, setup=setup, rounds=5)
+    benchmark.extra_info['saves_per_second'] = (
+        NUM_TASKS / benchmark.stats.stats.mean)
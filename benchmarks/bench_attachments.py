@@ -0,0 +1,62 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Attachment upload and download bandwidth against a WebDAV stub. """
+
+from simcity.dav import RestRequests
+import os
+import pytest
+
+SIZE = 32 * 1024 * 1024
+
+
+@pytest.fixture(scope='module')
+def data_file(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('data').join('data.bin'))
+    with open(path, 'wb') as f:
+        f.write(os.urandom(SIZE))
+    return path
+
+
+def bandwidth(benchmark):
+    """ Mean bandwidth in MB/s. """
+    return SIZE / benchmark.stats.stats.mean / 1e6
+
+
+def test_upload(benchmark, dav_server, data_file):
+    dav = RestRequests(dav_server.url)
+
+    def run():
+        with open(data_file, 'rb') as f:
+            dav.put('upload.bin', f, content_length=SIZE)
+
+    benchmark.pedantic(run, rounds=5)
+    benchmark.extra_info['mb_per_second'] = bandwidth(benchmark)
+
+
+@pytest.mark.parametrize('parallelism', [1, 4])
+def test_download(benchmark, dav_server, data_file, tmpdir, parallelism):
+    dav = RestRequests(dav_server.url)
+    with open(data_file, 'rb') as f:
+        dav.put('download.bin', f, content_length=SIZE)
+    target = str(tmpdir.join('download.bin'))
+
+    benchmark.pedantic(dav.download, args=('download.bin', target),
+                       kwargs={'length': SIZE, 'parallelism': parallelism,
+                               'min_part_size': SIZE // 8},
+                       rounds=5)
+    assert SIZE == os.path.getsize(target)
+    benchmark.extra_info['mb_per_second'] = bandwidth(benchmark)
@@ -0,0 +1,57 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Claim throughput of TaskViewIterator against the number of workers. """
+
+from conftest import fill_tasks
+from simcity import TaskViewIterator
+from threading import Thread
+import pytest
+
+NUM_TASKS = 400
+
+
+def claim_all(db, job_id):
+    """ Claim tasks until none are left, retrying on contention. """
+    claimed = 0
+    while True:
+        try:
+            for _ in TaskViewIterator(job_id, db, 'pending'):
+                claimed += 1
+            return claimed
+        except EnvironmentError:
+            pass  # too many conflicts in a row
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4, 8])
+def test_claim_throughput(benchmark, memory_db, workers):
+    def setup():
+        memory_db.docs.clear()
+        fill_tasks(memory_db, NUM_TASKS)
+
+    def run():
+        threads = [Thread(target=claim_all,
+                          args=(memory_db, 'job_{0}'.format(i)))
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    benchmark.pedantic(run, setup=setup, rounds=5)
+    assert 0 == len(memory_db.view('pending'))
+    benchmark.extra_info['claims_per_second'] = (
+        NUM_TASKS / benchmark.stats.stats.mean)
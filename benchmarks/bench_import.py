@@ -0,0 +1,51 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Startup time of the simcity package and script, in a new interpreter. """
+
+import os
+import pytest
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = {
+    'python': 'pass',
+    'import': 'import simcity',
+    'help': ('import sys; sys.argv = ["simcity", "--help"]\n'
+             'from simcity.__main__ import main\n'
+             'try:\n'
+             '    main()\n'
+             'except SystemExit:\n'
+             '    pass'),
+    'summary_imports': ('import simcity, simcity.__main__\n'
+                        'simcity.init, simcity.overview_total'),
+}
+
+
+def run_python(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + env.get('PYTHONPATH', '').split(os.pathsep))
+    subprocess.check_call([sys.executable, '-c', code], env=env,
+                          stdout=subprocess.PIPE)
+
+
+@pytest.mark.parametrize('script', sorted(SCRIPTS))
+def test_startup(benchmark, script):
+    benchmark.pedantic(run_python, args=(SCRIPTS[script],), rounds=10,
+                       warmup_rounds=1)
@@ -0,0 +1,45 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Duration of check and scrub against the database size. """
+
+from conftest import fill_tasks
+from simcity import Job, check_task_status, scrub
+import pytest
+
+
+def fill_in_progress(db, size):
+    db.docs.clear()
+    job = Job({'_id': 'finished_job'}).start().finish()
+    db.save(job)
+    fill_tasks(db, size, lock=1, job='finished_job')
+
+
+@pytest.mark.parametrize('size', [1000, 5000])
+def test_scrub(benchmark, memory_db, size):
+    result = benchmark.pedantic(
+        scrub, args=('in_progress',), kwargs={'age': 0,
+                                              'database': memory_db},
+        setup=lambda: fill_in_progress(memory_db, size), rounds=3)
+    assert (size, size) == result
+
+
+@pytest.mark.parametrize('size', [1000, 5000])
+def test_check_task_status(benchmark, memory_db, size):
+    result = benchmark.pedantic(
+        check_task_status, kwargs={'dry_run': True, 'database': memory_db},
+        setup=lambda: fill_in_progress(memory_db, size), rounds=3)
+    assert size == len(result)
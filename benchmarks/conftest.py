@@ -0,0 +1,57 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import simcity
+from simcity.memorydb import MemoryDB
+from davserver import DavServer
+
+
+def fill_tasks(db, number, **properties):
+    """ Add number pending tasks to db. """
+    tasks = []
+    for i in range(number):
+        task = simcity.Task({'_id': 'task_{0:06d}'.format(i),
+                             'command': 'noop', 'input': {'i': i}})
+        task.update(properties)
+        tasks.append(task)
+    db.save_documents(tasks)
+    return tasks
+
+
+@pytest.fixture
+def memory_db():
+    db = MemoryDB()
+    simcity.management.set_task_database(db)
+    simcity.management.set_job_database(db)
+    simcity.management.set_current_job_id('benchmark_job')
+    return db
+
+
+@pytest.fixture(scope='module')
+def dav_server():
+    server = DavServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def directories(tmpdir):
+    return {
+        'tmp_dir': str(tmpdir.join('tmp')),
+        'input_dir': str(tmpdir.join('in')),
+        'output_dir': str(tmpdir.join('out')),
+    }
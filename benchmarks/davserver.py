@@ -0,0 +1,129 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" In-process WebDAV stub that keeps files in memory. """
+
+from threading import Lock, Thread
+import re
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class DavServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server with PUT, GET (with ranges), HEAD, DELETE and MKCOL. """
+    daemon_threads = True
+
+    def __init__(self, address=('localhost', 0)):
+        HTTPServer.__init__(self, address, DavHandler)
+        self.files = {}
+        self.lock = Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class DavHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_PUT(self):
+        data = self._read_body()
+        with self.server.lock:
+            existed = self.path in self.server.files
+            self.server.files[self.path] = data
+        self._send(204 if existed else 201)
+
+    def do_MKCOL(self):
+        with self.server.lock:
+            existed = self.path in self.server.files
+            self.server.files.setdefault(self.path, None)
+        self._send(405 if existed else 201)
+
+    def do_DELETE(self):
+        with self.server.lock:
+            removed = [p for p in self.server.files
+                       if p == self.path or p.startswith(
+                           self.path.rstrip('/') + '/')]
+            for path in removed:
+                del self.server.files[path]
+        self._send(204 if removed else 404)
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self._send(404)
+            return
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            self._send(200, data, {'Accept-Ranges': 'bytes'})
+            return
+        start = int(match.group(1))
+        end = int(match.group(2)) + 1 if match.group(2) else len(data)
+        if start >= len(data):
+            self._send(416)
+            return
+        self._send(206, data[start:end], {
+            'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                start, min(end, len(data)) - 1, len(data))})
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self._send(404)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
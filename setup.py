@@ -56,6 +56,10 @@ setup(name='simcity',
       extras_require={
           'test': ['pytest', 'coverage', 'pytest-flake8'],
           'xenon': ['pyxenon'],
+          'zstd': ['zstandard'],
+          'async': ['aiohttp; python_version >= "3.5"'],
+          'export': ['pyarrow'],
+          'benchmark': ['pytest-benchmark'],
       },
       entry_points={
           'console_scripts': [
@@ -25,90 +25,122 @@ the job. Output files can be stored in the CouchDB database or on a WebDAV
 server.
 """
 
-from .actors import JobActor
-from .dav import RestRequests
-from .ensemble import ensemble_view
-from .worker import ExecuteWorker
-from .job import (get_job, start_job, queue_job, finish_job, archive_job,
-                  cancel_endless_job)
-from .integration import (overview_total, run_task, submit_if_needed,
-                          submit_while_needed, check_job_status,
-                          check_task_status, scrub)
-from .management import (get_config, init, get_task_database, get_job_database,
-                         get_current_job_id, set_current_job_id,
-                         create, create_views, uses_webdav, get_webdav,
-                         load_config_database)
-from .submit import (submit, Adaptor, OsmiumAdaptor, xenon_support,
-                     SSHAdaptor, kill, status)
-from .task import (add_task, get_task, delete_task,
-                   upload_attachment, download_attachment, delete_attachment)
-from .config import Config, CouchDBConfig, FileConfig
-from .document import Task, Job, Document, User
-from .database import CouchDB
-from .iterator import (ViewIterator, TaskViewIterator, EndlessViewIterator,
-                       PrioritizedViewIterator)
-from .util import parse_parameters
-from .version import __version__, __version_info__
+import importlib
+import sys
+import types
+try:
+    from importlib.util import find_spec
+except ImportError:
+    from pkgutil import find_loader as find_spec
 
-__all__ = [
-    'Adaptor',
-    'add_task',
-    'archive_job',
-    'cancel_endless_job',
-    'check_job_status',
-    'check_task_status',
-    'Config',
-    'CouchDB',
-    'CouchDBConfig',
-    'create',
-    'create_views',
-    'delete_attachment',
-    'delete_task',
-    'Document',
-    'download_attachment',
-    'EndlessViewIterator',
-    'ensemble_view',
-    'ExecuteWorker',
-    'FileConfig',
-    'finish_job',
-    'get_config',
-    'get_current_job_id',
-    'get_job',
-    'get_job_database',
-    'get_task',
-    'get_task_database',
-    'get_webdav',
-    'init',
-    'Job',
-    'JobActor',
-    'kill',
-    'load_config_database',
-    'OsmiumAdaptor',
-    'overview_total',
-    'parse_parameters',
-    'PrioritizedViewIterator',
-    'queue_job',
-    'RestRequests',
-    'run_task',
-    'scrub',
-    'set_current_job_id',
-    'SSHAdaptor',
-    'start_job',
-    'status',
-    'submit',
-    'submit_if_needed',
-    'submit_while_needed',
-    'Task',
-    'TaskViewIterator',
-    'upload_attachment',
-    'User',
-    'uses_webdav',
-    'ViewIterator',
-    'xenon_support',
-    '__version__',
-    '__version_info__',
-]
+# Module of each name that simcity exports. Modules are only imported when
+# one of their names is used, so that scripts start quickly.
+_exports = {
+    'Adaptor': 'submit',
+    'add_task': 'task',
+    'archive_job': 'job',
+    'cancel_endless_job': 'job',
+    'check_job_status': 'integration',
+    'check_task_status': 'integration',
+    'Config': 'config',
+    'CouchDB': 'database',
+    'CouchDBConfig': 'config',
+    'create': 'management',
+    'create_views': 'management',
+    'delete_attachment': 'task',
+    'delete_task': 'task',
+    'Document': 'document',
+    'download_attachment': 'task',
+    'EndlessViewIterator': 'iterator',
+    'ensemble_page': 'ensemble',
+    'ensemble_status': 'ensemble',
+    'ensemble_view': 'ensemble',
+    'ExecuteWorker': 'worker',
+    'FileConfig': 'config',
+    'finish_job': 'job',
+    'get_config': 'management',
+    'get_current_job_id': 'management',
+    'get_job': 'job',
+    'get_job_database': 'management',
+    'get_task': 'task',
+    'get_task_database': 'management',
+    'get_webdav': 'management',
+    'init': 'management',
+    'Job': 'document',
+    'JobActor': 'actors',
+    'kill': 'submit',
+    'load_config_database': 'management',
+    'OsmiumAdaptor': 'submit',
+    'overview_total': 'integration',
+    'parse_parameters': 'util',
+    'PrioritizedViewIterator': 'iterator',
+    'PriorityViewIterator': 'iterator',
+    'PythonWorker': 'worker',
+    'queue_job': 'job',
+    'RestRequests': 'dav',
+    'run_task': 'integration',
+    'scrub': 'integration',
+    'set_current_job_id': 'management',
+    'SSHAdaptor': 'submit',
+    'start_job': 'job',
+    'status': 'submit',
+    'submit': 'submit',
+    'submit_if_needed': 'integration',
+    'submit_while_needed': 'integration',
+    'Task': 'document',
+    'TaskViewIterator': 'iterator',
+    'timing_profile': 'integration',
+    'upload_attachment': 'task',
+    'User': 'document',
+    'uses_webdav': 'management',
+    'ViewIterator': 'iterator',
+    'xenon_support': 'submit',
+    '__version__': 'version',
+    '__version_info__': 'version',
+}
 
-if xenon_support:
-    from .submit import XenonAdaptor  # noqa: F401
+
+def _load(name):
+    """ Import an exported name from its module. """
+    module = importlib.import_module('.' + _exports[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+class _LazyPackage(types.ModuleType):
+    """ Package that imports the module of an exported name, or a submodule,
+    on first use. """
+    def __getattr__(self, name):
+        if name in _exports:
+            return _load(name)
+        if (name.startswith('__') or
+                find_spec(self.__name__ + '.' + name) is None):
+            raise AttributeError("module {0!r} has no attribute {1!r}"
+                                 .format(self.__name__, name))
+        return importlib.import_module('.' + name, self.__name__)
+
+    def __setattr__(self, name, value):
+        # Importing a submodule sets it as an attribute of its package.
+        # Exported names, like the submit function, take precedence.
+        if name in _exports and isinstance(value, types.ModuleType):
+            return
+        super(_LazyPackage, self).__setattr__(name, value)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_exports))
+
+
+__all__ = sorted((name for name in _exports if not name.startswith('__')),
+                 key=str.lower) + ['__version__', '__version_info__']
+
+if sys.version_info >= (3, 5):
+    sys.modules[__name__].__class__ = _LazyPackage
+else:
+    # the class of a module cannot be changed
+    for _name in list(_exports):
+        _load(_name)
+
+_exports['XenonAdaptor'] = 'submit'
+if find_spec('xenon') is not None:
     __all__.append('XenonAdaptor')
@@ -16,23 +16,20 @@
 
 """
 SIM-CITY scripts
+
+Modules that only some subcommands need are imported by those subcommands,
+so that the other subcommands start quickly.
 """
 
 from __future__ import print_function
 import simcity
-from simcity import (PrioritizedViewIterator, TaskViewIterator,
-                     EndlessViewIterator, Config, FileConfig,
-                     load_config_database, submit_while_needed)
 from .util import seconds_to_str, sizeof_fmt
 import argparse
 import getpass
-import couchdb
 import sys
 import json
 import signal
 import traceback
-import yaml
-from tqdm import tqdm
 import os
 from uuid import uuid4
 
@@ -80,10 +77,26 @@ def fill_argument_parser(parser):
         '-p', '--parallelism', default=1,
         help="number of threads the task needs. Use '*' for as many as "
              "available. (default: %(default)s)", )
+    create_parser.add_argument(
+        '-m', '--memory', type=int,
+        help="memory in MB that the task needs")
+    create_parser.add_argument(
+        '-s', '--scratch', type=int,
+        help="scratch space in MB that the task needs")
     create_parser.add_argument(
         '-i', '--input', help="input json file")
+    create_parser.add_argument(
+        '-P', '--priority', type=float, default=0,
+        help="priority of the tasks; tasks with a higher priority are "
+             "processed first by `simcity run -P` (default: %(default)s)")
     create_parser.set_defaults(func=create)
 
+    config_parser = subparsers.add_parser(
+        'config', help="Write the merged configuration to a file, to run "
+                       "jobs without the configuration database")
+    config_parser.add_argument('output', help="INI file to write")
+    config_parser.set_defaults(func=write_config)
+
     delete_parser = subparsers.add_parser(
         'delete', help="Remove all documents in a view")
     delete_group = delete_parser.add_mutually_exclusive_group(required=True)
@@ -96,6 +109,46 @@ def fill_argument_parser(parser):
         '-d', '--design', help="design document in CouchDB", default='Monitor')
     delete_parser.set_defaults(func=delete)
 
+    export_parser = subparsers.add_parser(
+        'export', help="Export the tasks of an ensemble to a Parquet or "
+                       "Arrow file")
+    export_parser.add_argument('name', help="simulator name")
+    export_parser.add_argument('version', help="simulator version")
+    export_parser.add_argument('-e', '--ensemble', help="ensemble name")
+    export_parser.add_argument('-o', '--output', required=True,
+                               help="output file")
+    export_parser.add_argument(
+        '-f', '--format', choices=['parquet', 'arrow'], default='parquet',
+        help="file format (default: %(default)s)")
+    export_parser.add_argument(
+        '-a', '--attachment', action='append', default=[],
+        help="include an attachment as a binary column; may be repeated")
+    export_parser.add_argument(
+        '--max-attachment-size', type=int, default=1024 * 1024,
+        help="maximum attachment size in bytes (default: %(default)s)")
+    export_parser.add_argument(
+        '--row-group-size', type=int, default=10000,
+        help="number of tasks per row group (default: %(default)s)")
+    export_parser.set_defaults(func=export)
+
+    gc_parser = subparsers.add_parser(
+        'gc', help="Delete webdav files of documents that no longer exist")
+    gc_parser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help="only list the files that would be deleted")
+    gc_parser.add_argument(
+        '-p', '--parallelism', type=int, default=8,
+        help="number of parallel delete requests (default: %(default)s)")
+    gc_parser.add_argument(
+        '-c', '--capacity', type=int, default=10000000,
+        help="expected maximum number of documents, which determines the "
+             "memory use (default: %(default)s)")
+    gc_parser.add_argument(
+        '-s', '--skip-files', action='store_true',
+        help="do not look for files of existing tasks that they do not "
+             "refer to, which needs a request per task")
+    gc_parser.set_defaults(func=gc)
+
     get_parser = subparsers.add_parser('get', help='get document')
     get_parser.add_argument('id', help='document ID')
     get_parser.add_argument('-d', '--download',
@@ -112,6 +165,9 @@ def fill_argument_parser(parser):
         help="ONLY set the database views")
     init_parser.add_argument(
         '-u', '--user', help="admin user")
+    init_parser.add_argument(
+        '--no-warm', action='store_true',
+        help="with -v, do not build the view indexes right away")
     init_parser.set_defaults(func=init)
 
     list_parser = subparsers.add_parser('list', help='list documents')
@@ -124,6 +180,56 @@ def fill_argument_parser(parser):
                              help='offset to show items from')
     list_parser.set_defaults(func=list_documents)
 
+    loadtest_parser = subparsers.add_parser(
+        'loadtest', help="Process synthetic tasks with simulated jobs to "
+                         "measure throughput and latency")
+    loadtest_parser.add_argument(
+        '-n', '--tasks', type=int, default=1000,
+        help="number of tasks (default: %(default)s)")
+    loadtest_parser.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help="number of simulated jobs (default: %(default)s)")
+    loadtest_parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help="worker processes per job (default: %(default)s)")
+    loadtest_parser.add_argument(
+        '--processes', action='store_true',
+        help="run each job in a process instead of a thread")
+    loadtest_parser.add_argument(
+        '--input-size', type=int, default=0,
+        help="bytes of input per task (default: %(default)s)")
+    loadtest_parser.add_argument(
+        '--runtime', default='constant:0',
+        help="distribution of task runtimes in seconds: constant:S, "
+             "uniform:LOW,HIGH, exponential:MEAN or lognormal:MU,SIGMA "
+             "(default: %(default)s)")
+    loadtest_parser.add_argument(
+        '--output-files', type=int, default=0,
+        help="output files per task (default: %(default)s)")
+    loadtest_parser.add_argument(
+        '--output-size', type=int, default=0,
+        help="bytes per output file (default: %(default)s)")
+    loadtest_parser.add_argument(
+        '--seed', type=int, help="seed of the runtime distribution")
+    loadtest_parser.add_argument(
+        '--keep', action='store_true',
+        help="keep the synthetic tasks and jobs afterwards")
+    loadtest_target = loadtest_parser.add_mutually_exclusive_group()
+    loadtest_target.add_argument(
+        '--memory', action='store_true',
+        help="use an in-memory database instead of the configured one")
+    loadtest_target.add_argument(
+        '--url', help="CouchDB URL to use instead of the configured one")
+    loadtest_parser.add_argument(
+        '--db', default='simcity_loadtest',
+        help="database name with --url (default: %(default)s)")
+    loadtest_parser.set_defaults(func=loadtest)
+
+    profile_parser = subparsers.add_parser(
+        'profile', help="Show the time that tasks spent in each phase")
+    profile_parser.add_argument('-e', '--ensemble', help="ensemble name")
+    profile_parser.set_defaults(func=profile)
+
     run_parser = subparsers.add_parser('run', help="Execute tasks")
     run_parser.add_argument('-D', '--days', type=int, default=1,
                             help="number of days to execute tasks "
@@ -151,7 +257,18 @@ def fill_argument_parser(parser):
                             help="run until cancelled, even if no "
                                  "new jobs arrive.")
     run_parser.add_argument('-P', '--prioritize', action="store_true",
-                            help="prioritize tasks")
+                            help="process tasks in order of their priority")
+    run_parser.add_argument('-L', '--lease', type=int,
+                            help="lease claimed tasks for this number of "
+                                 "seconds, renewing the lease while they run. "
+                                 "Tasks of crashed jobs can be claimed again "
+                                 "when their lease expires. (default: lease "
+                                 "from the Execution configuration section, "
+                                 "if any)")
+    run_parser.add_argument('--python', action="store_true",
+                            help="call the Python entry_point of tasks inside "
+                                 "the worker processes, instead of starting "
+                                 "a new process per task")
     run_parser.add_argument('job_id', nargs='?', help="JOB ID to assume")
     run_parser.set_defaults(func=run)
 
@@ -192,6 +309,23 @@ def fill_argument_parser(parser):
         help="also start if there are more that MAX jobs running")
     submit_parser.set_defaults(func=submit)
 
+    watch_parser = subparsers.add_parser(
+        'watch', help="Follow the progress of tasks and jobs live")
+    watch_parser.add_argument(
+        '-i', '--interval', type=float, default=2,
+        help="seconds between updates (default: %(default)s)")
+    watch_parser.add_argument(
+        '-w', '--window', type=float, default=60,
+        help="seconds over which throughput is computed "
+             "(default: %(default)s)")
+    watch_parser.set_defaults(func=watch)
+
+
+def _standalone(args):
+    """ Whether a command uses its own database instead of the configured
+    ones, so that simcity does not need to be initialized. """
+    return args.func is loadtest and (args.memory or args.url is not None)
+
 
 def main():
     """ Parse all arguments of the simcity script. """
@@ -204,10 +338,11 @@ def main():
         parser.print_help()
         sys.exit(1)
 
-    if args.func != init:
+    if args.func != init and not _standalone(args):
+        from couchdb.http import ResourceNotFound
         try:
             simcity.init(config=args.config)
-        except couchdb.http.ResourceNotFound:
+        except ResourceNotFound:
             print('Configuration does not correctly specify the databases.')
             sys.exit(1)
 
@@ -232,6 +367,12 @@ def create(args):
                 'arguments': args.arguments,
                 'parallelism': args.parallelism,
             }
+            if args.priority != 0:
+                task['priority'] = args.priority
+            if args.memory is not None:
+                task['memory_mb'] = args.memory
+            if args.scratch is not None:
+                task['scratch_mb'] = args.scratch
             try:
                 with open(args.input) as f:
                     task['input'] = json.load(f)
@@ -246,12 +387,23 @@ def create(args):
                   file=sys.stderr)
 
 
+def write_config(args):
+    """ Write the merged configuration to a file. """
+    simcity.get_config().write(args.output)
+    print("Wrote configuration to {0}; use it with -c {0}"
+          .format(args.output))
+
+
 def delete(args):
     """ Delete documents """
     if args.id is not None:
         try:
             db = simcity.get_task_database()
-            db.delete(db.get(args.id))
+            doc = db.get(args.id)
+            if doc.get('type') == 'task':
+                simcity.delete_task(simcity.Task(doc), database=db)
+            else:
+                db.delete(doc)
         except ValueError:
             try:
                 db = simcity.get_job_database()
@@ -271,8 +423,38 @@ def delete(args):
               (sum(is_deleted), len(is_deleted), args.view))
 
 
+def export(args):
+    """ Export the tasks of an ensemble to a columnar file. """
+    from .export import export_ensemble
+    count = export_ensemble(
+        args.output, args.name, args.version, ensemble=args.ensemble,
+        file_format=args.format, attachments=args.attachment,
+        max_attachment_size=args.max_attachment_size,
+        row_group_size=args.row_group_size)
+    print("Exported {0} tasks to {1}".format(count, args.output))
+
+
+def gc(args):
+    """ Delete webdav files of documents that no longer exist. """
+    from .orphans import delete_orphans, find_orphans
+    orphans = find_orphans(capacity=args.capacity,
+                           check_files=not args.skip_files)
+    if args.dry_run:
+        count = 0
+        for path in orphans:
+            print(path)
+            count += 1
+        print("Found {0} orphaned files and directories".format(count))
+    else:
+        count = delete_orphans(orphans, parallelism=args.parallelism)
+        print("Deleted {0} orphaned files and directories".format(count))
+
+
 def get(args):
     """ Get document and print it """
+    import yaml
+    from tqdm import tqdm
+
     if args.download is not None:
         if not os.path.isdir(args.download):
             os.makedirs(args.download)
@@ -317,6 +499,8 @@ def init(args):
     """
     Create the databases and views
     """
+    import couchdb
+
     if args.user is not None and args.password is None:
         try:
             args.password = getpass.getpass('Password:')
@@ -325,10 +509,10 @@ def init(args):
             sys.exit(1)
 
     if args.view:
-        config = Config()
-        config.configurators.append(FileConfig(args.config))
+        config = simcity.Config()
+        config.add_configurator(simcity.FileConfig(args.config))
         try:
-            config.configurators.append(load_config_database(config))
+            config.add_configurator(simcity.load_config_database(config))
         except KeyError:
             pass
 
@@ -344,7 +528,7 @@ def init(args):
                 })
         try:
             simcity.init(config)
-            simcity.create_views()
+            simcity.create_views(warm=not args.no_warm)
         except couchdb.http.ResourceNotFound:
             print("Database not initialized, run `simcity init` without -v "
                   "flag.")
@@ -446,6 +630,60 @@ def _time_args_to_seconds(args):
     return args.seconds + 60 * (args.minutes + 60 * hours)
 
 
+def loadtest(args):
+    """ Run a load test and print its results. """
+    from .loadtest import format_results, loadtest as run_loadtest
+    from .management import set_job_database, set_task_database
+    from .memorydb import shared_memory_db
+
+    manager = None
+    if args.memory:
+        manager, database = shared_memory_db()
+    elif args.url is not None:
+        database = simcity.CouchDB(url=args.url, db=args.db, create=True)
+    else:
+        database = simcity.get_task_database()
+
+    if args.memory or args.url is not None:
+        set_task_database(database)
+        set_job_database(database)
+        if args.url is not None:
+            simcity.create_views()
+
+    try:
+        results = run_loadtest(
+            database, tasks=args.tasks, jobs=args.jobs, workers=args.workers,
+            processes=args.processes, input_size=args.input_size,
+            runtime=args.runtime, output_files=args.output_files,
+            output_size=args.output_size, seed=args.seed, keep=args.keep)
+    except ValueError as ex:
+        print(ex)
+        sys.exit(1)
+    finally:
+        if manager is not None:
+            manager.shutdown()
+    print(format_results(results))
+
+
+def profile(args):
+    """ Print the time spent in each phase of finished tasks. """
+    phases = ['claim', 'setup', 'stage_in', 'execute', 'upload', 'collect']
+    for ensemble, stats in sorted(simcity.timing_profile(
+            ensemble=args.ensemble).items()):
+        total = sum(phase['sum'] for phase in stats.values())
+        print('Ensemble {0}'.format(ensemble or '(none)'))
+        print('{0:<10} {1:>8} {2:>10} {3:>10} {4:>10} {5:>6}'.format(
+            'phase', 'tasks', 'mean ms', 'min ms', 'max ms', 'share'))
+        names = ([p for p in phases if p in stats] +
+                 sorted(p for p in stats if p not in phases))
+        for name in names:
+            phase = stats[name]
+            print('{0:<10} {1:>8} {2:>10.0f} {3:>10} {4:>10} {5:>6.1%}'
+                  .format(name, phase['count'], phase['mean'], phase['min'],
+                          phase['max'], phase['sum'] / float(total or 1)))
+        print('')
+
+
 def run(args):
     """ Run job to process tasks. """
     if args.job_id is not None:
@@ -457,17 +695,30 @@ def run(args):
 
     db = simcity.get_task_database()
 
+    lease = args.lease
+    if lease is None:
+        try:
+            lease = simcity.get_config().section('Execution').get('lease')
+        except KeyError:
+            pass
+
     if args.prioritize:
-        iterator = PrioritizedViewIterator(job_id, db, 'pending_priority',
-                                           'pending')
+        iterator = simcity.PriorityViewIterator(
+            job_id, db, 'pending_by_priority', lease=lease)
     else:
-        iterator = TaskViewIterator(job_id, db, 'pending')
+        iterator = simcity.TaskViewIterator(job_id, db, 'pending',
+                                            lease=lease)
 
     if args.endless:
-        iterator = EndlessViewIterator(job_id, iterator,
-                                       stop_callback=_is_cancelled)
+        iterator = simcity.EndlessViewIterator(job_id, iterator,
+                                               stop_callback=_is_cancelled)
+
+    if args.python:
+        worker_cls = simcity.PythonWorker
+    else:
+        worker_cls = simcity.ExecuteWorker
 
-    actor = simcity.JobActor(iterator, simcity.ExecuteWorker)
+    actor = simcity.JobActor(iterator, worker_cls)
 
     for sig_name in ['HUP', 'INT', 'QUIT', 'ABRT', 'TERM']:
         try:
@@ -528,6 +779,21 @@ def summary(args):
     print(20 * '=')
 
 
+def watch(args):
+    """ Print live progress of tasks and jobs until interrupted. """
+    from .watch import watch as watch_progress
+
+    def show(monitor):
+        print(20 * '=')
+        print(monitor.format())
+        sys.stdout.flush()
+
+    try:
+        watch_progress(show, interval=args.interval, window=args.window)
+    except KeyboardInterrupt:
+        pass
+
+
 def check(args):
     """
     Checks the consistency of the database
@@ -562,7 +828,8 @@ def check(args):
     if args.host is None:
         print("No host provided, not starting additional jobs")
     else:
-        jobs = submit_while_needed(args.host, args.max, dry_run=args.dry_run)
+        jobs = simcity.submit_while_needed(args.host, args.max,
+                                           dry_run=args.dry_run)
         if len(jobs) == 0:
             print("Enough jobs running. Will not start any new jobs")
         else:
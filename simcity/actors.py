@@ -19,13 +19,18 @@
 from __future__ import print_function
 
 import simcity
-from .util import Timer
+from .document import Task
+from .durations import TaskDurations
+from .metrics import job_metrics, task_command
+from .util import Timer, node_memory_mb
 from couchdb.http import ResourceConflict
 try:
     from Queue import Empty as QueueEmpty
 except ImportError:
     from queue import Empty as QueueEmpty
 from multiprocessing import cpu_count, Process, Manager
+from threading import Thread, Event
+import time
 
 
 class JobActor(object):
@@ -63,48 +68,295 @@ class JobActor(object):
         self.manager = Manager()
         self.task_q = self.manager.Queue()
         self.result_q = self.manager.Queue()
-        self.queued_semaphore = self.manager.Semaphore(self.parallelism)
-        self.workers = [worker_cls(i, self.config, self.task_q, self.result_q,
-                                   self.queued_semaphore)
+        self.resources = ResourcePool(self.manager, self.node_capacity())
+        self.backfill = max(1, int(self.config.get('backfill', 2)))
+        self.active_tasks = self.manager.dict()
+        self.metrics, self.exporter = job_metrics(self.config, self.manager)
+        self.workers = [self.create_worker(i)
                         for i in range(self.parallelism)]
 
         self.tasks_processed = self.manager.Value('i', 0)
+        self.running_tasks = self.manager.dict()
+        # tasks claimed by this job that are not finished or released yet,
+        # including those waiting in the backlog
+        self.claimed_tasks = self.manager.dict()
+        self.durations = TaskDurations.load(self.job_db,
+                                            new=self.manager.dict())
+        self.max_rejections = int(self.config.get('max_rejections', 10))
         self.job = None
         self.collector = CollectActor(
             self.task_db, self.parallelism, self.result_q,
-            self.tasks_processed)
+            self.tasks_processed, self.running_tasks, self.durations,
+            metrics=self.metrics, claimed_tasks=self.claimed_tasks)
+
+        lease = getattr(iterator, 'lease', None)
+        if lease is None:
+            self.lease_renewer = None
+        else:
+            self.lease_renewer = LeaseRenewer(
+                self.task_db, self.claimed_tasks, lease)
+
+        self._skipped = {}
+        self._rejected = set()
+        self._repeated = 0
+        self._last_rejected = None
+
+    def create_worker(self, number):
+        """ Create a worker process with given number. """
+        return self.worker_cls(number, self.config, self.task_q,
+                               self.result_q, self.resources,
+                               active_tasks=self.active_tasks,
+                               metrics=self.metrics)
+
+    def respawn_workers(self):
+        """ Replace worker processes that have crashed.
+
+        The task that a crashed worker was processing is marked as failed and
+        its resources are released. """
+        for i, worker in enumerate(self.workers):
+            if worker.is_alive() or worker.exitcode in (None, 0):
+                continue
+
+            print("Worker {0} crashed with exit code {1}; restarting"
+                  .format(worker.number, worker.exitcode))
+            task = self.active_tasks.pop(worker.number, None)
+            if task is not None:
+                task.error("Worker {0} crashed with exit code {1}"
+                           .format(worker.number, worker.exitcode))
+                self.resources.release_task(task)
+                self.result_q.put(task)
+
+            self.workers[i] = self.create_worker(worker.number)
+            self.workers[i].start()
+
+    def wait_idle(self):
+        """ Wait until all started tasks have finished. """
+        while True:
+            releases = self.resources.releases()
+            if self.resources.is_idle():
+                return
+            self.respawn_workers()
+            self.resources.wait(releases, timeout=1.0)
+
+    def node_capacity(self):
+        """ Resources available to the tasks of this job.
+
+        The number of cpus is the parallelism of the job. The memory is read
+        from the memory_mb configuration value, otherwise from /proc/meminfo.
+        Scratch space is only limited if the scratch_mb configuration value is
+        set.
+        """
+        capacity = {'cpus': self.parallelism}
+        memory_mb = self.config.get('memory_mb')
+        if memory_mb is None:
+            memory_mb = node_memory_mb()
+        if memory_mb is not None:
+            capacity['memory_mb'] = int(memory_mb)
+        scratch_mb = self.config.get('scratch_mb')
+        if scratch_mb is not None:
+            capacity['scratch_mb'] = int(scratch_mb)
+        return capacity
 
     def run(self, maxtime=None, avg_time_factor=0.0):
         """Run method of the actor, executes the application code by iterating
         over the available tasks in CouchDB.
+
+        Claimed tasks are started as soon as their resources are available
+        on the node. While the oldest claimed task waits for resources, up to
+        backfill - 1 further tasks are claimed and started if they fit in the
+        remaining resources. Once the oldest task has been passed over
+        backfill times, no other tasks are started before it.
+
+        If maxtime is given, a task is only started if it is expected to
+        finish in time. The expected duration is based on earlier tasks with
+        the same command and ensemble, multiplied by avg_time_factor. Tasks
+        that are expected to take too long are released again, so that
+        shorter tasks are preferred as the deadline nears. Without duration
+        statistics, the average time per task of the current job is used.
         """
-        time = Timer()
+        timer = Timer()
         self.prepare_env()
         self.collector.start()
 
         for w in self.workers:
             w.start()
-        try:
-            for task in self.iterator:
-                self.set_task_parallelism(task)
-
-                for _ in range(task['parallelism']):
-                    self.queued_semaphore.acquire()
+        if self.lease_renewer is not None:
+            self.lease_renewer.start()
 
-                processed = self.tasks_processed.value
-                if maxtime is not None and processed > 0:
-                    will_elapse = ((avg_time_factor + processed) *
-                                   time.elapsed() / processed)
-                    if will_elapse > maxtime:
-                        break
+        backlog = []
+        try:
+            for task in self.claim_tasks():
+                if not self.set_task_resources(task):
+                    self.claimed_tasks.pop(task.id, None)
+                    continue
 
-                self.task_q.put(task)
+                backlog.append(task)
+                has_time = self.dispatch(backlog, maxtime, avg_time_factor,
+                                         timer)
+                self.metrics.set('simcity_backlog_tasks', len(backlog))
+                while has_time and len(backlog) >= self.backfill:
+                    has_time = self.wait_and_dispatch(
+                        backlog, maxtime, avg_time_factor, timer)
+                if not has_time:
+                    break
+            else:
+                while len(backlog) > 0 and self.wait_and_dispatch(
+                        backlog, maxtime, avg_time_factor, timer):
+                    pass
 
-            for _ in range(self.parallelism):
-                self.queued_semaphore.acquire()
+            self.wait_idle()
         finally:
+            self.release_tasks(backlog)
             self.cleanup_env()
 
+    def claim_tasks(self):
+        """ Iterate over the tasks of the iterator, recording the time it
+        took to claim each task. Claimed tasks are registered in
+        claimed_tasks, so that their lease is renewed until they are
+        finished or released, also while they wait in the backlog. """
+        iterator = iter(self.iterator)
+        while True:
+            timer = Timer()
+            try:
+                task = next(iterator)
+            except StopIteration:
+                return
+            elapsed = timer.elapsed()
+            self.claimed_tasks[task.id] = task['lock']
+            task.record_timing('claim', elapsed)
+            self.metrics.observe('simcity_phase_seconds', elapsed,
+                                 phase='claim', command=task_command(task))
+            yield task
+
+    def dispatch(self, backlog, maxtime, avg_time_factor, timer):
+        """ Start the tasks in the backlog that fit in the available
+        resources. Tasks are removed from the backlog when started.
+        @return: False if there is not enough time left to start tasks.
+        """
+        if len(backlog) == 0:
+            return True
+
+        head = backlog[0]
+        for task in list(backlog):
+            if (task is not head and
+                    self._skipped.get(head.id, 0) >= self.backfill):
+                break  # the oldest task has a reservation
+
+            has_time = self.has_time(task, maxtime, avg_time_factor, timer)
+            if has_time is None:
+                return False
+            elif not has_time:
+                # this type of task takes too long, try others
+                backlog.remove(task)
+                self.release_tasks([task])
+                if self.reject(task):
+                    return False
+                continue
+
+            if self.resources.try_acquire(task['resources']):
+                self._rejected.clear()
+                self._repeated = 0
+                self._last_rejected = None
+                backlog.remove(task)
+                self.start_task(task)
+                if task is head:
+                    self._skipped.pop(head.id, None)
+                elif head in backlog:
+                    self._skipped[head.id] = self._skipped.get(head.id, 0) + 1
+        return True
+
+    def reject(self, task):
+        """ Record that a task was released because it is not expected to
+        finish in time.
+
+        A released task may be claimed again by this job. Only distinct tasks
+        count towards max_rejections, unless the same task is rejected
+        max_rejections times in a row, which means that no other task is
+        pending.
+        @return: True if the job should stop claiming tasks.
+        """
+        if task.id == self._last_rejected:
+            self._repeated += 1
+        else:
+            self._repeated = 1
+            self._last_rejected = task.id
+        self._rejected.add(task.id)
+        return (len(self._rejected) >= self.max_rejections or
+                self._repeated >= self.max_rejections)
+
+    def wait_and_dispatch(self, backlog, maxtime, avg_time_factor, timer):
+        """ Wait until resources are released, if no tasks can be started
+        right away, and start tasks from the backlog.
+        @return: False if there is not enough time left to start tasks.
+        """
+        released = self.resources.releases()
+        size = len(backlog)
+        has_time = self.dispatch(backlog, maxtime, avg_time_factor, timer)
+        if has_time and len(backlog) == size:
+            self.respawn_workers()
+            self.resources.wait(released, timeout=1.0)
+        return has_time
+
+    def has_time(self, task, maxtime, avg_time_factor, timer):
+        """ Whether a task is expected to finish within maxtime.
+
+        @return: True if the task is expected to finish in time, False if
+            tasks of its class are expected to take too long and None if any
+            task is expected to take too long.
+        """
+        if maxtime is None:
+            return True
+
+        predicted = self.durations.predict(task)
+        if predicted is not None:
+            return timer.elapsed() + avg_time_factor * predicted <= maxtime
+
+        processed = self.tasks_processed.value
+        if processed > 0:
+            will_elapse = ((avg_time_factor + processed) *
+                           timer.elapsed() / processed)
+            if will_elapse > maxtime:
+                return None
+        return True
+
+    def start_task(self, task):
+        """ Queue a task for processing by a worker. """
+        self.running_tasks[task.id] = task['lock']
+        self.metrics.set('simcity_running_tasks', len(self.running_tasks))
+        self.task_q.put(task)
+
+    def release_tasks(self, tasks):
+        """ Make claimed tasks that were not started available again. """
+        while len(tasks) > 0:
+            task = tasks.pop()
+            try:
+                save_task(task.release(), self.task_db)
+            except Exception as ex:
+                print("Failed to release task {0}: {1}".format(task.id, ex))
+            self.claimed_tasks.pop(task.id, None)
+
+    def set_task_resources(self, task):
+        """ Determine the resources that a task needs and set them in the
+        resources property. Tasks that need more resources than the node has
+        are marked as failed.
+        @return: whether the task can be run on this node.
+        """
+        if 'parallelism' not in task and 'cpus' in task:
+            task['parallelism'] = task['cpus']
+        self.set_task_parallelism(task)
+        task['resources'] = {
+            'cpus': task['parallelism'],
+            'memory_mb': int(task.get('memory_mb', 0)),
+            'scratch_mb': int(task.get('scratch_mb', 0)),
+        }
+        if self.resources.fits(task['resources']):
+            return True
+
+        task.error("Task needs more resources ({0}) than the node has ({1})"
+                   .format(task['resources'], self.resources.capacity))
+        save_task(task, self.task_db)
+        return False
+
     def set_task_parallelism(self, task):
         """ Determine the preferred parallelism of a task and set it
         in the parallelism property. """
@@ -121,6 +373,9 @@ class JobActor(object):
         database. """
         self.job = simcity.start_job(
             database=self.job_db, properties={'parallelism': self.parallelism})
+        if self.exporter is not None:
+            self.metrics.labels['job'] = self.job.id
+            self.exporter.start()
 
     def cleanup_env(self):
         """ Cleans up the current job by registering it as finished. """
@@ -133,19 +388,98 @@ class JobActor(object):
         for w in self.workers:
             w.join()
         self.collector.join()
+        if self.lease_renewer is not None:
+            self.lease_renewer.stop()
+        if self.exporter is not None:
+            self.exporter.stop()
 
         self.job['tasks_processed'] = self.tasks_processed.value
         simcity.finish_job(self.job, database=self.job_db)
+        try:
+            self.durations.save(self.job_db)
+        except Exception as ex:
+            print("Failed to save task durations: {0}".format(ex))
+
+
+class ResourcePool(object):
+    """
+    Node resources that are shared by the tasks of a JobActor.
+
+    Resources are given as a dict, with for example keys cpus, memory_mb and
+    scratch_mb. Resources that are not in the capacity are not limited. The
+    pool can be used from multiple processes.
+    """
+    def __init__(self, manager, capacity):
+        """
+        @param manager: multiprocessing.Manager to share the pool with
+        @param capacity: dict with the amount of each resource of the node
+        """
+        self.capacity = dict(capacity)
+        self.available = manager.dict(self.capacity)
+        self.released = manager.Value('i', 0)
+        self.condition = manager.Condition()
+
+    def fits(self, request, available=None):
+        """ Whether the requested resources fit in the available resources,
+        or, if available is None, in the capacity of the node. """
+        if available is None:
+            available = self.capacity
+        return all(request.get(key, 0) <= value
+                   for key, value in available.items())
+
+    def try_acquire(self, request):
+        """ Acquire the requested resources if they are available.
+        @return: whether the resources were acquired. """
+        with self.condition:
+            available = self.available.copy()
+            if not self.fits(request, available):
+                return False
+            for key in self.capacity:
+                self.available[key] = available[key] - request.get(key, 0)
+            return True
+
+    def release(self, request):
+        """ Release previously acquired resources. """
+        with self.condition:
+            for key in self.capacity:
+                self.available[key] += request.get(key, 0)
+            self.released.value += 1
+            self.condition.notify_all()
+
+    def release_task(self, task):
+        """ Release the resources acquired for a task. """
+        self.release(task['resources'])
+
+    def releases(self):
+        """ Number of times resources were released. """
+        return self.released.value
+
+    def wait(self, releases, timeout=None):
+        """ Wait for resources to be released, if they were not released
+        since releases() returned given value. """
+        with self.condition:
+            if self.released.value == releases:
+                self.condition.wait(timeout)
+
+    def is_idle(self):
+        """ Whether all resources are available. """
+        return self.available.copy() == self.capacity
 
 
 class CollectActor(Process):
     """ Collects finished tasks from the JobActor """
-    def __init__(self, task_db, parallelism, result_q, tasks_processed):
+    def __init__(self, task_db, parallelism, result_q, tasks_processed,
+                 running_tasks=None, durations=None, metrics=None,
+                 claimed_tasks=None):
         super(CollectActor, self).__init__()
+        self.metrics = metrics
         self.result_q = result_q
         self.task_db = task_db
         self.is_done = False
         self.tasks_processed = tasks_processed
+        self.running_tasks = running_tasks
+        self.claimed_tasks = claimed_tasks
+        self.durations = durations
         self.parallelism = parallelism
         self.workers_done = 0
 
@@ -161,23 +495,106 @@ class CollectActor(Process):
                     self.workers_done += 1
                     continue
 
-                save_task(task, self.task_db)
+                finished_at = task.pop('finished_at', None)
+                if finished_at is not None:
+                    task.record_timing('collect', time.time() - finished_at)
+                if self.metrics is None:
+                    save_task(task, self.task_db)
+                else:
+                    self.save_with_metrics(task)
+                if self.running_tasks is not None:
+                    self.running_tasks.pop(task.id, None)
+                    if self.metrics is not None:
+                        self.metrics.set('simcity_running_tasks',
+                                         len(self.running_tasks))
+                if self.claimed_tasks is not None:
+                    self.claimed_tasks.pop(task.id, None)
+                if (self.durations is not None and not task.has_error() and
+                        'runtime' in task):
+                    self.durations.add(task, task['runtime'])
                 self.tasks_processed.value += 1
             except QueueEmpty:
                 pass
             except EOFError:
                 self.workers_done = self.parallelism
 
+    def save_with_metrics(self, task):
+        """ Save a task, recording the duration, conflicts and result. """
+        command = task_command(task)
+        with self.metrics.time('simcity_phase_seconds', phase='save',
+                               command=command):
+            conflicts = save_task(task, self.task_db)
+        if conflicts > 0:
+            self.metrics.inc('simcity_save_conflicts', conflicts,
+                             command=command)
+        self.metrics.inc('simcity_tasks', command=command,
+                         status='error' if task.has_error() else 'done')
+
+
+class LeaseRenewer(Thread):
+    """
+    Periodically renews the lease of the tasks that a job has claimed, both
+    running and waiting to start, so that they are not claimed by other
+    jobs. If the job crashes, the renewal
+    stops and the leases expire.
+    """
+    def __init__(self, task_db, running_tasks, lease, interval=None):
+        """
+        @param task_db: task database
+        @param running_tasks: dict-like with the IDs of the tasks that are
+            claimed and not finished as keys, and their lock as values.
+        @param lease: number of seconds to renew the lease with
+        @param interval: seconds between renewals, by default a third of the
+            lease.
+        """
+        super(LeaseRenewer, self).__init__()
+        self.daemon = True
+        self.task_db = task_db
+        self.running_tasks = running_tasks
+        self.lease = int(lease)
+        if interval is None:
+            interval = self.lease / 3.0
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        """ Renew leases until stopped. """
+        self.task_db = self.task_db.copy()
+        while not self.stopped.wait(self.interval):
+            self.renew()
+
+    def renew(self):
+        """ Renew the leases of all claimed tasks once. """
+        for task_id in list(self.running_tasks.keys()):
+            try:
+                task = Task(self.task_db.get(task_id))
+                # only renew tasks that are still locked by this job
+                if (task['done'] == 0 and
+                        task['lock'] == self.running_tasks[task_id]):
+                    self.task_db.save(task.renew_lease(self.lease))
+            except (ResourceConflict, KeyError, ValueError):
+                pass  # task was finished in the mean time
+            except Exception as ex:
+                print("Failed to renew lease of task {0}: {1}"
+                      .format(task_id, ex))
+
+    def stop(self):
+        """ Stop renewing leases. """
+        self.stopped.set()
+        self.join()
+
 
 def save_task(task, task_db):
-    """ Save task to database. """
-    saved = False
-    while not saved:
+    """ Save task to database.
+    @return: number of conflicts that were resolved """
+    conflicts = 0
+    while True:
         try:
             task_db.save(task)
-            saved = True
+            return conflicts
         except ResourceConflict:
             # simply overwrite changes - model results are more
             # important
+            conflicts += 1
             new_task = task_db.get(task.id)
             task['_rev'] = new_task.rev
@@ -0,0 +1,558 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asynchronous CouchDB and WebDAV clients, for controllers that need to make
+many requests concurrently.
+
+The clients have the same methods as CouchDB and RestRequests, but as
+coroutines. They share a limited number of connections per client. This
+module requires Python 3.5 or later and aiohttp, installed with the 'async'
+extra.
+"""
+
+from .database import (design_document, find_query, find_row, MANGO_VIEWS,
+                       MONITOR_DESIGN_DOC, QUERY_BACKENDS)
+from .document import Document, Job, Task
+from .management import get_config
+from .submit import status, Adaptor
+from .task import _blob_path, _webdav_id_to_path
+from .util import get_truthy, seconds
+from couchdb.http import ResourceConflict
+import asyncio
+import json
+import time
+from urllib.parse import quote
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def _check_aiohttp():
+    """ Raise an EnvironmentError if aiohttp is not installed. """
+    if aiohttp is None:
+        raise EnvironmentError('The asynchronous clients require aiohttp; '
+                               'install simcity[async]')
+
+
+def _verify(acceptable_statuses, response, message):
+    """
+    Verify that the request gave an acceptable status and raise an IOError
+    otherwise.
+    """
+    if response.status not in acceptable_statuses:
+        header_str = '\n'.join('{0}: {1}'.format(k.lower(), v)
+                               for k, v in response.headers.items())
+        raise IOError('{0}: HTTP status code {1}\nHeaders:\n{2}'
+                      .format(message, response.status, header_str))
+
+
+class ViewRow(object):
+    """ Row of a CouchDB view, with id, key, value and optionally doc. """
+    def __init__(self, row):
+        self.id = row.get('id')
+        self.key = row.get('key')
+        self.value = row.get('value')
+        self.doc = row.get('doc')
+
+
+class AsyncCouchDB(object):
+    """
+    Asynchronous CouchDB client with the same semantics as CouchDB.
+
+    Use it as an async context manager, or call close() when done.
+    """
+    def __init__(self, url="http://localhost:5984", db="test",
+                 username=None, password="", ssl_verification=True,
+                 limit=100, query_backend='view'):
+        """
+        @param url: the location where the CouchDB instance is located,
+            including the port at which it's listening.
+        @param db: the database to use.
+        @param limit: maximum number of concurrent connections
+        @param query_backend: 'view' to query map views, or 'mango' to
+            answer the views of MANGO_VIEWS with _find queries
+        """
+        _check_aiohttp()
+        if query_backend not in QUERY_BACKENDS:
+            raise ValueError('Query backend {0} is not one of {1}'
+                             .format(query_backend, ', '.join(QUERY_BACKENDS)))
+        self.query_backend = query_backend
+        if not url.endswith('/'):
+            url += '/'
+        self.url = url + db
+        self.auth = None
+        if username is not None:
+            self.auth = aiohttp.BasicAuth(username, password)
+        self.ssl = None if ssl_verification else False
+        self.limit = limit
+        self._session = None
+
+    @property
+    def session(self):
+        """ The HTTP session, created on first use. """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, ssl=self.ssl)
+            self._session = aiohttp.ClientSession(
+                connector=connector, auth=self.auth,
+                headers={'Accept': 'application/json'})
+        return self._session
+
+    async def close(self):
+        """ Close all connections. """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _doc_url(self, doc_id):
+        if doc_id.startswith('_design/'):
+            return self.url + '/_design/' + quote(doc_id[8:], safe='')
+        return self.url + '/' + quote(doc_id, safe='')
+
+    async def get(self, id):
+        """
+        Get the Document with given ID.
+        @raise ValueError: if the document does not exist.
+        """
+        async with self.session.get(self._doc_url(id)) as response:
+            if response.status == 404:
+                raise ValueError(id + " is not a document ID in the database")
+            _verify((200,), response, 'Failed to get document ' + id)
+            return Document(await response.json())
+
+    async def save(self, doc):
+        """
+        Save a Document to the database.
+        @raise couchdb.http.ResourceConflict: when document exists with
+            different revision or was deleted.
+        """
+        if '_id' in doc:
+            request = self.session.put(self._doc_url(doc['_id']), json=doc)
+        else:
+            request = self.session.post(self.url, json=doc)
+        async with request as response:
+            result = await response.json()
+            if response.status == 409:
+                raise ResourceConflict((result.get('error'),
+                                        result.get('reason')))
+            _verify((201, 202), response, 'Failed to save document')
+        doc['_id'] = result['id']
+        doc['_rev'] = result['rev']
+        return doc
+
+    async def delete(self, doc):
+        """
+        Delete a Document from the database. It must have a current _id and
+        _rev.
+        @raise couchdb.http.ResourceConflict: if the document was updated in
+            the database.
+        """
+        async with self.session.delete(
+                self._doc_url(doc['_id']),
+                params={'rev': doc['_rev']}) as response:
+            if response.status == 409:
+                result = await response.json()
+                raise ResourceConflict((result.get('error'),
+                                        result.get('reason')))
+            _verify((200, 202), response,
+                    'Failed to delete document ' + doc['_id'])
+
+    async def save_documents(self, docs):
+        """
+        Save a sequence of Documents to the database in a single request.
+        @return: a sequence of booleans indicating whether each document was
+            saved; saved documents get their new _rev.
+        """
+        async with self.session.post(self.url + '/_bulk_docs',
+                                     json={'docs': list(docs)}) as response:
+            _verify((201,), response, 'Failed to save documents')
+            results = await response.json()
+
+        saved = []
+        for doc, result in zip(docs, results):
+            if 'error' in result:
+                saved.append(False)
+            else:
+                doc['_id'] = result['id']
+                doc['_rev'] = result['rev']
+                saved.append(True)
+        return saved
+
+    async def delete_documents(self, docs):
+        """
+        Delete a sequence of Documents concurrently.
+        @return: a list of booleans indicating whether the respective
+            Document was deleted.
+        """
+        results = await asyncio.gather(*[self.delete(doc) for doc in docs],
+                                       return_exceptions=True)
+        return [not isinstance(result, Exception) for result in results]
+
+    async def find(self, selector, fields=None, limit=None, bookmark=None):
+        """
+        Query documents with a Mango selector, like CouchDB.find.
+        @return: tuple of the list of documents and the bookmark of the next
+            page.
+        """
+        query = {'selector': selector}
+        if fields is not None:
+            query['fields'] = fields
+        if limit is not None:
+            query['limit'] = limit
+        if bookmark is not None:
+            query['bookmark'] = bookmark
+        async with self.session.post(self.url + '/_find',
+                                     json=query) as response:
+            _verify((200,), response, 'Failed to find documents')
+            result = await response.json()
+        return result['docs'], result.get('bookmark')
+
+    async def view(self, view, design_doc="Monitor", **view_params):
+        """
+        Get the rows of a view. With the mango query backend, the views of
+        MANGO_VIEWS are queried with find instead, like CouchDB.view.
+        @param design_doc: design document of the view, see
+            simcity.database.design_document
+        @return: list of ViewRow objects
+        """
+        if (self.query_backend == 'mango' and view in MANGO_VIEWS and
+                design_doc == MONITOR_DESIGN_DOC):
+            return await self._find_rows(view, **view_params)
+        params = {}
+        for key, value in view_params.items():
+            if key in ('key', 'keys', 'startkey', 'endkey', 'start_key',
+                       'end_key') or isinstance(value, bool):
+                value = json.dumps(value)
+            params[key] = str(value)
+        url = '{0}/_design/{1}/_view/{2}'.format(
+            self.url, design_document(view, design_doc), view)
+        async with self.session.get(url, params=params) as response:
+            _verify((200,), response, 'Failed to get view ' + view)
+            result = await response.json()
+        return [ViewRow(row) for row in result['rows']]
+
+    async def _find_rows(self, view, include_docs=False, batch_size=1000,
+                         **view_params):
+        """ Rows of a view of MANGO_VIEWS, like database.find_rows. """
+        selector, fields = find_query(view, include_docs, **view_params)
+        rows = []
+        bookmark = None
+        while True:
+            docs, bookmark = await self.find(selector, fields=fields,
+                                             limit=batch_size,
+                                             bookmark=bookmark)
+            rows.extend(ViewRow(find_row(view, doc, include_docs))
+                        for doc in docs)
+            if len(docs) < batch_size:
+                return rows
+
+    async def get_from_view(self, view, **view_params):
+        """ Get the Documents of all rows in a view, concurrently. """
+        rows = await self.view(view, **view_params)
+        results = await asyncio.gather(*[self.get(row.id) for row in rows],
+                                       return_exceptions=True)
+        return [doc for doc in results if isinstance(doc, Document)]
+
+
+class AsyncRestRequests(object):
+    """
+    Asynchronous REST and WebDAV requests with a base URL, with the same
+    semantics as RestRequests.
+    """
+    def __init__(self, base_url, auth=None, limit=100, ssl_verification=True):
+        """
+        @param base_url: base url of the service
+        @param auth: (username, password) tuple
+        @param limit: maximum number of concurrent connections
+        """
+        _check_aiohttp()
+        self.base_url = base_url.rstrip('/')
+        self.auth = None if auth is None else aiohttp.BasicAuth(*auth)
+        self.ssl = None if ssl_verification else False
+        self.limit = limit
+        self._session = None
+
+    @property
+    def session(self):
+        """ The HTTP session, created on first use. """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, ssl=self.ssl)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  auth=self.auth)
+        return self._session
+
+    async def close(self):
+        """ Close all connections. """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def exists(self, path):
+        """ Whether the path exists. """
+        async with self.session.head(self.path_to_url(path),
+                                     allow_redirects=True) as response:
+            return response.status == 200
+
+    async def put(self, path, data, content_type=None):
+        """ Put bytes or a file object. """
+        headers = None
+        if content_type is not None:
+            headers = {'content-type': content_type}
+        async with self.session.put(self.path_to_url(path), data=data,
+                                    headers=headers) as response:
+            _verify((201, 204), response,
+                    'Failed to upload file {0}'.format(path))
+
+    async def mkdir(self, path, ignore_existing=False):
+        """
+        Make a new directory. Set ignore_existing to not throw an error if
+        the directory already exists.
+        """
+        async with self.session.request(
+                'MKCOL', self.path_to_url(path)) as response:
+            acceptable_status = (201, 405) if ignore_existing else (201,)
+            _verify(acceptable_status, response,
+                    'Failed to create directory {0}'.format(path))
+
+    async def delete(self, path, ignore_not_existing=False):
+        """
+        Recursively delete a path. Set ignore_not_existing to not throw an
+        error if given path does not exist.
+        """
+        async with self.session.delete(self.path_to_url(path)) as response:
+            acceptable_status = (204, 404) if ignore_not_existing else (204,)
+            _verify(acceptable_status, response,
+                    'Failed to delete {0}'.format(path))
+
+    async def get(self, path):
+        """ Get path contents as bytes. """
+        async with self.session.get(self.path_to_url(path)) as response:
+            _verify((200,), response, 'Failed to get file {0}'.format(path))
+            return await response.read()
+
+    async def download(self, path, file_path, chunk_size=1024 * 1024):
+        """ Download path to file_path. """
+        async with self.session.get(self.path_to_url(path)) as response:
+            _verify((200,), response, 'Failed to get file {0}'.format(path))
+            with open(file_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+
+    def path_to_url(self, path):
+        """ Given a path relative to the base_url, returns the full URL."""
+        return '{0}/{1}'.format(self.base_url, path.lstrip('/'))
+
+    def url_to_path(self, url):
+        """
+        Given an URL prefixed with the base_url, return the relative path.
+        """
+        if not url.startswith(self.base_url):
+            raise ValueError('URL {0} cannot be translated to webdav at {1}'
+                             .format(url, self.base_url))
+        return url[len(self.base_url):].lstrip('/')
+
+
+def get_async_database(name='task-db', limit=100):
+    """ Create an AsyncCouchDB for a database in the configuration, such as
+    task-db or job-db. """
+    cfg = get_config().section(name)
+    return AsyncCouchDB(
+        url=cfg['url'], db=cfg['database'], username=cfg.get('username'),
+        password=cfg.get('password', ''),
+        ssl_verification=get_truthy(cfg.get('ssl_verification', False)),
+        limit=limit, query_backend=cfg.get('query_backend', 'view'))
+
+
+def get_async_webdav(limit=100):
+    """ Create an AsyncRestRequests for the configured webdav. """
+    cfg = get_config().section('webdav')
+    auth = None
+    if 'username' in cfg:
+        auth = (cfg['username'], cfg['password'])
+    return AsyncRestRequests(cfg['url'], auth=auth, limit=limit)
+
+
+async def check_job_status(database, dry_run=False):
+    """
+    Check the current job status of jobs that the database considers active,
+    like integration.check_job_status, with concurrent requests.
+    @param database: AsyncCouchDB job database
+    @return: list of jobs that are archived
+    """
+    rows = await database.view('active_jobs')
+    docs = await asyncio.gather(*[database.get(row.id) for row in rows])
+    jobs = [Job(doc) for doc in docs if doc.get('type') == 'job']
+
+    loop = asyncio.get_event_loop()
+    job_status = await loop.run_in_executor(None, status, jobs)
+
+    five_days = 5 * 24 * 60 * 60
+    archived = [job for stat, job in zip(job_status, jobs)
+                if (stat is None and seconds() - job['queue'] > five_days) or
+                stat == Adaptor.DONE]
+    if not dry_run:
+        await asyncio.gather(*[database.save(job.archive())
+                               for job in archived])
+    return archived
+
+
+async def check_task_status(database, job_database=None, dry_run=False):
+    """
+    Check the task status of in_progress tasks against the status of their
+    job, like integration.check_task_status, with concurrent requests.
+    @param database: AsyncCouchDB task database
+    @param job_database: AsyncCouchDB job database, if different
+    @return: list of tasks whose job is done
+    """
+    if job_database is None:
+        job_database = database
+
+    new_tasks = []
+    has_failed_saves = True
+    while has_failed_saves:
+        has_failed_saves = False
+        rows = await database.view('in_progress')
+        tasks = [Task(doc) for doc in await asyncio.gather(
+            *[database.get(row.id) for row in rows])]
+        job_ids = set(task['job'] for task in tasks if 'job' in task)
+        jobs = await asyncio.gather(*[job_database.get(job_id)
+                                      for job_id in job_ids],
+                                    return_exceptions=True)
+        done_jobs = set(job.id for job in jobs
+                        if isinstance(job, Document) and Job(job).is_done())
+        finished = [task for task in tasks if task['job'] in done_jobs]
+
+        if dry_run:
+            new_tasks.extend(finished)
+            continue
+
+        results = await asyncio.gather(
+            *[database.save(task) for task in finished],
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, ResourceConflict):
+                has_failed_saves = True
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                new_tasks.append(result)
+    return new_tasks
+
+
+async def scrub(view, database, age=24 * 60 * 60):
+    """
+    Unlock tasks or archive jobs in a view that started at least age seconds
+    ago, like integration.scrub, with concurrent requests.
+    @param database: AsyncCouchDB task or job database
+    @return: tuple of the number of documents updated and the number of
+        documents in the view
+    """
+    task_views = ['in_progress', 'error']
+    job_views = ['pending_jobs', 'running_jobs', 'finished_jobs']
+    if view in task_views:
+        is_task, age_var = True, 'lock'
+    elif view in job_views:
+        is_task, age_var = False, 'start'
+    else:
+        raise ValueError('View "%s" not one of "%s"' % (view, str(task_views +
+                                                                  job_views)))
+
+    min_t = int(time.time()) - age
+    rows = await database.view(view)
+    selected = [row.id for row in rows
+                if age <= 0 or row.value[age_var] < min_t]
+    docs = await asyncio.gather(*[database.get(doc_id)
+                                  for doc_id in selected])
+    if is_task:
+        updates = [Task(doc).scrub() for doc in docs]
+    else:
+        updates = [Job(doc).archive() for doc in docs]
+
+    if len(updates) > 0:
+        await database.save_documents(updates)
+    return len(updates), len(rows)
+
+
+async def _update_blob_references(database, digest, change):
+    """ Change the reference count of a blob, like
+    task._update_blob_references.
+    @return: the blob document
+    """
+    doc_id = 'blob_' + digest
+    while True:
+        try:
+            doc = await database.get(doc_id)
+        except ValueError:
+            doc = Document({'_id': doc_id, 'type': 'blob', 'refs': 0})
+
+        doc['refs'] = max(0, doc.get('refs', 0) + change)
+        try:
+            if doc['refs'] > 0:
+                await database.save(doc)
+            elif '_rev' in doc:
+                await database.delete(doc)
+            return doc
+        except ResourceConflict:
+            pass  # updated by another task, try again
+
+
+async def _delete_blob(database, dav, file_info):
+    """ Remove a reference to a blob, and delete it if it was the last. """
+    digest = file_info['sha256']
+    blob = await _update_blob_references(database, digest, -1)
+    if blob['refs'] == 0:
+        path = _blob_path(digest)[0]
+        await dav.delete(path, ignore_not_existing=True)
+        if 'segments' in file_info:
+            await dav.delete(path + '.segments', ignore_not_existing=True)
+
+
+async def delete_tasks(database, dav, tasks):
+    """ Delete tasks and their webdav files concurrently, like
+    task.delete_task. Content-addressed files are only deleted when no other
+    task refers to them.
+    @param database: AsyncCouchDB task database
+    @param dav: AsyncRestRequests webdav connection, or None if the tasks
+        have no webdav files
+    @return: list of booleans indicating whether each task was deleted.
+    """
+    async def delete_task(task):
+        await database.delete(task)
+        files = task.get('files', {})
+        if len(files) > 0:
+            for file_info in files.values():
+                if 'sha256' in file_info:
+                    await _delete_blob(database, dav, file_info)
+            await dav.delete(_webdav_id_to_path(task.id)[1],
+                             ignore_not_existing=True)
+
+    results = await asyncio.gather(*[delete_task(task) for task in tasks],
+                                   return_exceptions=True)
+    return [not isinstance(result, Exception) for result in results]
@@ -0,0 +1,235 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Node-local cache of downloaded attachments. """
+
+from .management import get_config
+from .util import expandfilename
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+
+# ioctl request to clone a file on copy-on-write filesystems (Linux FICLONE)
+FICLONE = 0x40049409
+
+_caches = {}
+
+
+class AttachmentCache(object):
+    """
+    Least-recently-used cache of files on the local disk.
+
+    Files are stored under a key, for example the URL and ETag of a webdav
+    file or the digest of a CouchDB attachment. Multiple worker processes can
+    share the cache: each key is locked with a file lock while it is
+    downloaded or read, so that a file is downloaded only once. When the
+    cache exceeds its maximum size, the least recently used files are
+    removed, together with their lock files.
+
+    Cached files are read-only. They are materialized by a reflink if the
+    filesystem supports it, by a hard link otherwise, and copied only if
+    both fail, for example because the target is on another filesystem.
+    """
+    def __init__(self, directory, max_size_mb=10240):
+        """
+        @param directory: directory to store the cache in
+        @param max_size_mb: maximum size of the cache in MB
+        """
+        self.directory = directory
+        self.max_size = int(float(max_size_mb) * 1024 * 1024)
+        self.data_dir = os.path.join(directory, 'data')
+        self.lock_dir = os.path.join(directory, 'locks')
+        for d in (self.data_dir, self.lock_dir):
+            try:
+                os.makedirs(d)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+
+    @staticmethod
+    def key(*parts):
+        """ Cache key made from given parts. """
+        value = u'|'.join(u'{0}'.format(p) for p in parts)
+        return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """ Path of the cached file with given key. """
+        return os.path.join(self.data_dir, key)
+
+    def fetch(self, key, file_path, download):
+        """
+        Put the cached file with given key at file_path, downloading it first
+        if it is not cached yet.
+        @param download: function that downloads the file to a given path
+        """
+        with self._locked(key):
+            self._store(key, download)
+            materialize(self.path(key), file_path)
+        self.evict(keep=key)
+
+    def read(self, key, download):
+        """
+        Read the cached file with given key as bytes, downloading it first if
+        it is not cached yet.
+        @param download: function that downloads the file to a given path
+        """
+        with self._locked(key):
+            self._store(key, download)
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        self.evict(keep=key)
+        return data
+
+    def _store(self, key, download):
+        """ Download a file into the cache if it is not present yet, and mark
+        it as recently used. Call with the key locked. """
+        path = self.path(key)
+        if os.path.exists(path):
+            os.utime(path, None)
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix='.part')
+        os.close(fd)
+        try:
+            download(tmp_path)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def size(self):
+        """ Total size of the cached files in bytes. """
+        return sum(os.path.getsize(path) for _, path in self._entries())
+
+    def _entries(self):
+        """ (key, path) of all cached files. """
+        for key in os.listdir(self.data_dir):
+            if not key.endswith('.part'):
+                yield key, os.path.join(self.data_dir, key)
+
+    def evict(self, keep=None):
+        """ Remove least recently used files until the cache is no larger than
+        its maximum size. Files that are in use are not removed.
+        @param keep: key of a file that should not be removed
+        """
+        entries = []
+        total = 0
+        for key, path in self._entries():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            entries.append((st.st_mtime, st.st_size, key))
+            total += st.st_size
+
+        entries.sort()
+        for mtime, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            with self._locked(key, blocking=False) as locked:
+                if locked:
+                    try:
+                        os.remove(self.path(key))
+                        total -= size
+                        os.remove(self._lock_path(key))
+                    except OSError:
+                        pass
+
+    def _lock_path(self, key):
+        return os.path.join(self.lock_dir, key)
+
+    @contextmanager
+    def _locked(self, key, blocking=True):
+        """ Lock a key for all processes on the node.
+        Yields whether the lock was acquired. Lock files are removed when
+        their file is evicted, so a lock is only acquired on a lock file that
+        is still in place. """
+        path = self._lock_path(key)
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        while True:
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f.fileno(), flags)
+            except IOError as ex:
+                f.close()
+                if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except OSError:
+                pass  # removed while waiting for the lock
+            f.close()
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            f.close()
+
+
+def materialize(source, target):
+    """ Make the file source available at target, sharing its data on disk if
+    possible: by reflink, then by hard link, and otherwise by copying. """
+    if os.path.lexists(target):
+        os.remove(target)
+
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except (IOError, OSError):
+                pass  # reflinks not supported
+    os.remove(target)
+
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def get_attachment_cache():
+    """ The attachment cache as configured by cache_dir and cache_size_mb in
+    the Execution configuration section.
+    @return: AttachmentCache or None if no cache is configured.
+    """
+    try:
+        exec_cfg = get_config().section('Execution')
+    except (EnvironmentError, KeyError):
+        return None
+
+    if 'cache_dir' not in exec_cfg:
+        return None
+
+    directory = expandfilename(exec_cfg['cache_dir'])
+    max_size_mb = exec_cfg.get('cache_size_mb', 10240)
+    cache_key = (directory, max_size_mb)
+    if cache_key not in _caches:
+        _caches[cache_key] = AttachmentCache(directory, max_size_mb)
+    return _caches[cache_key]
@@ -0,0 +1,111 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Compression of attachments before they are stored. """
+
+import gzip
+import io
+import shutil
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODINGS = ('gzip', 'zstd')
+
+SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/vnd.geo+json',
+    'application/xml',
+    'application/javascript',
+    'application/x-yaml',
+)
+
+
+def is_compressible(content_type):
+    """ Whether files of given content type are worth compressing. """
+    if content_type is None:
+        return False
+    content_type = content_type.split(';')[0].strip()
+    return (content_type.startswith('text/') or
+            content_type.endswith('+xml') or
+            content_type in COMPRESSIBLE_TYPES)
+
+
+def check_encoding(encoding):
+    """ Raise a ValueError if the encoding is not supported. """
+    if encoding not in ENCODINGS:
+        raise ValueError('Compression {0} is not one of {1}'
+                         .format(encoding, ', '.join(ENCODINGS)))
+    if encoding == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression requires the zstandard package')
+
+
+def compress_file(f, encoding):
+    """
+    Compress the contents of a file object into a temporary file.
+
+    Compression is deterministic, so that equal files have equal compressed
+    contents.
+    @return: tuple of the temporary file, positioned at the start, and its
+        length in bytes.
+    """
+    check_encoding(encoding)
+    out = tempfile.TemporaryFile()
+    try:
+        if encoding == 'gzip':
+            with gzip.GzipFile(filename='', mode='wb', fileobj=out,
+                               mtime=0) as gz:
+                shutil.copyfileobj(f, gz)
+        else:
+            zstandard.ZstdCompressor().copy_stream(f, out)
+        length = out.tell()
+        out.seek(0)
+        return out, length
+    except BaseException:
+        out.close()
+        raise
+
+
+def decompress_file(source, target, encoding):
+    """ Decompress file path source to file path target. """
+    check_encoding(encoding)
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            if encoding == 'gzip':
+                with gzip.GzipFile(fileobj=src, mode='rb') as gz:
+                    shutil.copyfileobj(gz, dst)
+            else:
+                zstandard.ZstdDecompressor().copy_stream(src, dst)
+
+
+def decompress_data(data, encoding):
+    """ Decompress bytes data. """
+    check_encoding(encoding)
+    if encoding == 'gzip':
+        with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as gz:
+            return gz.read()
+    else:
+        out = io.BytesIO()
+        zstandard.ZstdDecompressor().copy_stream(io.BytesIO(data), out)
+        return out.getvalue()
@@ -22,6 +22,7 @@ except ImportError:
 from .util import expandfilenames
 from .database import CouchDB
 import os
+import time
 
 
 class Config(object):
@@ -31,12 +32,39 @@ class Config(object):
     A list of additional configurators contains the actual configuration. Later
     configurators in the list will overwrite those of earlier ones.
     Configurators must implement the section() and sections() methods.
+
+    Sections read from the configurators are cached. Configurators that can
+    change, like CouchDBConfig, implement a poll_changes() method that returns
+    whether the cache must be invalidated. Call invalidate() after changing
+    the configurators list directly.
     """
     def __init__(self, configurators=None):
         if configurators is None:
             configurators = []
         self.configurators = configurators
         self._sections = {}
+        self._cache = {}
+        self._section_names = None
+
+    def add_configurator(self, configurator):
+        """ Add a configurator, overriding the values of earlier ones. """
+        self.configurators.append(configurator)
+        self.invalidate()
+
+    def invalidate(self):
+        """ Clear the cached sections, so they are read again. """
+        self._cache = {}
+        self._section_names = None
+
+    def _poll_changes(self):
+        """ Invalidate the cache if a configurator has changed. """
+        changed = False
+        for cfg in self.configurators:
+            poll = getattr(cfg, 'poll_changes', None)
+            if poll is not None and poll():
+                changed = True
+        if changed:
+            self.invalidate()
 
     def add_section(self, name, keyvalue):
         """
@@ -49,20 +77,37 @@ class Config(object):
         keyvalue : dict
             keys with values of the section
         """
-        self._sections[name] = dict_value_expandvar(keyvalue)
+        self._sections[name] = keyvalue
+        self._section_names = None
 
     def section(self, name):
         """ Get the dict of key-values of config section.
         @param name: section name. Use 'DEFAULT' for default (unnamed) section.
         @raise KeyError: if section does not exist
         """
-        values = {}
-        for cfg in self.configurators:
-            try:
-                values.update(cfg.section(name))
-            except KeyError:
-                pass
+        self._poll_changes()
+        try:
+            merged = self._cache[name]
+        except KeyError:
+            merged = self._merged_section(name)
+            self._cache[name] = merged
+
+        values = dict(merged)
+        try:
+            values.update(dict_value_expandvar(dict(self._sections[name])))
+        except KeyError:
+            if len(values) == 0:
+                raise  # otherwise, it was found in one of the sub-configs.
+
+        return values
 
+    def raw_section(self, name):
+        """ Get the dict of key-values of config section, without expanding
+        environment variables.
+        @param name: section name
+        @raise KeyError: if section does not exist
+        """
+        values = self._merged_section(name, raw=True)
         try:
             values.update(self._sections[name])
         except KeyError:
@@ -71,13 +116,52 @@ class Config(object):
 
         return values
 
+    def _merged_section(self, name, raw=False):
+        """ Read a section from all configurators. Configurators without a
+        raw_section method give their expanded values if raw is set. """
+        values = {}
+        for cfg in self.configurators:
+            section = cfg.section
+            if raw:
+                section = getattr(cfg, 'raw_section', cfg.section)
+            try:
+                values.update(section(name))
+            except KeyError:
+                pass
+        return values
+
     def sections(self):
         """ The set of configured section names. """
-        sections = set(self._sections.keys())
-        for cfg in self.configurators:
-            sections |= cfg.sections()
+        self._poll_changes()
+        if self._section_names is None:
+            sections = set(self._sections.keys())
+            for cfg in self.configurators:
+                sections |= cfg.sections()
+            self._section_names = frozenset(sections)
 
-        return sections
+        return set(self._section_names)
+
+    def write(self, filename, exclude=('config-db',)):
+        """
+        Write all merged sections to an INI file, for example to run jobs on
+        nodes that cannot reach the configuration database. Environment
+        variables are written unexpanded, so that they are expanded on the
+        node that reads the file. A new file is only readable by the user,
+        since it may contain passwords.
+        @param exclude: names of sections not to write. By default this
+            excludes the configuration database, so that the file is used
+            on its own.
+        """
+        parser = RawConfigParser()
+        for name in sorted(self.sections()):
+            if name in exclude or name == 'DEFAULT':
+                continue
+            parser.add_section(name)
+            for key, value in sorted(self.raw_section(name).items()):
+                parser.set(name, key, str(value))
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            parser.write(f)
 
 
 class FileConfig(object):
@@ -108,8 +192,13 @@ class FileConfig(object):
         @param name: str name of the config section
         @return: dict of key-values
         """
+        return dict_value_expandvar(self.raw_section(name))
+
+    def raw_section(self, name):
+        """ Get key-values of a config section, without expanding
+        environment variables. """
         try:
-            return dict_value_expandvar(dict(self.parser.items(name)))
+            return dict(self.parser.items(name))
         except NoSectionError:
             raise KeyError()
 
@@ -126,9 +215,12 @@ class CouchDBConfig(object):
     divided into sections, where the first entries fall in the DEFAULT section.
     Within each section, entries are stored as key-value pairs with unique
     keys.
+
+    Sections are read once. The changes feed of the database is checked at
+    most every refresh_interval seconds, to read changed sections again.
     """
     def __init__(self, database, sections_view='_all_docs',
-                 sections_design_docs='Settings'):
+                 sections_design_docs='Settings', refresh_interval=60):
         """
         Initialize the database connection.
 
@@ -137,21 +229,41 @@ class CouchDBConfig(object):
         database: CouchDB object
         sections_view: view name that lists all sections
         sections_design_docs: design document of sections_view
+        refresh_interval: minimum number of seconds between checks for
+            changed sections, or None to never check.
         """
         self.db = database
         self.sections_view = sections_view
         self.sections_design_docs = sections_design_docs
+        if refresh_interval is not None:
+            refresh_interval = float(refresh_interval)
+        self.refresh_interval = refresh_interval
+        self._cache = {}
+        self._seq = None
+        self._checked = 0
 
     def section(self, name):
         """ Get key-values of a config section.
         @param name: str name of the config section
         @return: dict of key-values """
+        return dict_value_expandvar(self.raw_section(name))
+
+    def raw_section(self, name):
+        """ Get key-values of a config section, without expanding
+        environment variables. """
+        self._start_tracking()
         try:
-            value = self.db.get(name)
-        except ValueError:
-            raise KeyError()
+            value = self._cache[name]
+        except KeyError:
+            try:
+                value = self.db.get(name)['settings']
+            except ValueError:
+                value = None
+            self._cache[name] = value
 
-        return dict_value_expandvar(value['settings'])
+        if value is None:
+            raise KeyError(name)
+        return dict(value)
 
     def sections(self):
         """ The set of configured section names. """
@@ -159,6 +271,28 @@ class CouchDBConfig(object):
                                     design_doc=self.sections_design_docs)
         return frozenset([doc.id for doc in all_settings])
 
+    def _start_tracking(self):
+        """ Note the update sequence before anything is cached. """
+        if self._seq is None and self.refresh_interval is not None:
+            _, self._seq = self.db.changes_since()
+            self._checked = time.time()
+
+    def poll_changes(self):
+        """ Check the changes feed, if refresh_interval has passed since the
+        last check, and forget changed sections.
+        @return: whether any document has changed. """
+        if (self._seq is None or
+                time.time() - self._checked < self.refresh_interval):
+            return False
+
+        changed, self._seq = self.db.changes_since(self._seq)
+        self._checked = time.time()
+        if len(changed) == 0:
+            return False
+        for name in changed:
+            self._cache.pop(name, None)
+        return True
+
     @classmethod
     def from_url(cls, url, database, user=None, password=None, **kwargs):
         """ Create a CouchDBConfig from a CouchDB URL and database name.
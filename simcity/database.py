@@ -21,8 +21,143 @@ from .document import Document
 import random
 import sys
 import couchdb
+from couchdb.client import Row
 from couchdb.design import ViewDefinition
 from couchdb.http import ResourceConflict
+from textwrap import dedent
+
+
+# Design documents of the simcity views. CouchDB builds the indexes of all
+# views in a design document together, so the views that jobs need to claim
+# tasks are kept apart from the reporting and job views.
+MONITOR_DESIGN_DOC = 'Monitor'
+VIEW_DESIGN_DOCS = {
+    'pending': 'Claim',
+    'pending_priority': 'Claim',
+    'pending_by_priority': 'Claim',
+    'leases': 'Claim',
+    'pending_jobs': 'Jobs',
+    'running_jobs': 'Jobs',
+    'finished_jobs': 'Jobs',
+    'archived_jobs': 'Jobs',
+    'active_jobs': 'Jobs',
+}
+
+
+def design_document(view, design_doc=MONITOR_DESIGN_DOC):
+    """ Design document that contains a view. The simcity views are
+    requested with the Monitor design document, and are found in the design
+    document of VIEW_DESIGN_DOCS if they are listed there. """
+    if design_doc == MONITOR_DESIGN_DOC:
+        return VIEW_DESIGN_DOCS.get(view, MONITOR_DESIGN_DOC)
+    return design_doc
+
+
+# Mango selectors of the simcity views that select documents on their
+# fields, with the document fields that make up the view value, or the
+# single field that is the value. The mango query backend answers these
+# views with _find queries instead of map views.
+_TASK_FIELDS = ['lock', 'done']
+_JOB_FIELDS = ['queue', 'start', 'done']
+MANGO_VIEWS = {
+    'pending': ({'type': 'task', 'lock': 0}, _TASK_FIELDS),
+    'in_progress': ({'type': 'task', 'lock': {'$gt': 0}, 'done': 0},
+                    _TASK_FIELDS),
+    'done': ({'type': 'task', 'lock': {'$gt': 0}, 'done': {'$gt': 0}},
+             _TASK_FIELDS),
+    'error': ({'type': 'task', 'lock': -1}, 'error'),
+    'pending_jobs': ({'type': 'job', 'start': 0, 'archive': 0}, _JOB_FIELDS),
+    'running_jobs': ({'type': 'job', 'start': {'$gt': 0}, 'done': 0,
+                      'archive': 0}, _JOB_FIELDS),
+    'finished_jobs': ({'type': 'job', 'done': {'$gt': 0}}, _JOB_FIELDS),
+    'archived_jobs': ({'type': 'job', 'archive': {'$gt': 0}}, _JOB_FIELDS),
+    'active_jobs': ({'type': 'job', 'archive': 0}, _JOB_FIELDS),
+}
+# JSON indexes of the mango query backend. CouchDB only uses an index if the
+# selector has all of its fields, so the task-ensemble index serves queries
+# with an additional ensemble selector.
+MANGO_INDEXES = {
+    'task-lock': ['type', 'lock'],
+    'task-status': ['type', 'lock', 'done'],
+    'task-ensemble': ['type', 'ensemble', 'lock'],
+    'job-archive': ['type', 'archive'],
+    'job-done': ['type', 'done'],
+}
+QUERY_BACKENDS = ('view', 'mango')
+
+
+class FindResults(list):
+    """ Rows of a view that was queried with _find. Like the view results
+    of couchdb-python, the rows are also available as the rows property. """
+    @property
+    def rows(self):
+        return self
+
+
+def find_rows(database, view, limit=None, skip=0, include_docs=False,
+              selector=None, batch_size=1000, **view_params):
+    """
+    Rows of a view of MANGO_VIEWS, queried with the find method of a
+    database instead of the map view. The rows are keyed by document ID
+    like those of the map view, but they are in index order and the map
+    view parameters other than limit, skip and include_docs are not
+    supported. Pages of batch_size rows are requested with bookmarks.
+
+    :param selector: additional Mango selector, for example
+                     {'ensemble': 'myensemble'}
+    :return: FindResults
+    :raise ValueError: if other view parameters are given
+    """
+    selector, fields = find_query(view, include_docs, selector,
+                                  **view_params)
+    rows = FindResults()
+    bookmark = None
+    while limit is None or len(rows) < limit:
+        size = batch_size if limit is None else min(batch_size,
+                                                    limit - len(rows))
+        docs, bookmark = database.find(
+            selector, fields=fields, limit=size,
+            skip=skip if bookmark is None else 0, bookmark=bookmark)
+        rows.extend(Row(find_row(view, doc, include_docs)) for doc in docs)
+        if len(docs) < size:
+            break
+    return rows
+
+
+def find_query(view, include_docs=False, selector=None, **view_params):
+    """
+    Mango selector and fields of a view of MANGO_VIEWS, see find_rows.
+
+    :return: tuple of the selector and the fields to request, or None for
+             all fields.
+    :raise ValueError: if view parameters other than limit and skip are
+                       given
+    """
+    if view_params:
+        raise ValueError('Parameters {0} of view {1} are not supported by '
+                         'the mango query backend'
+                         .format(', '.join(sorted(view_params)), view))
+    view_selector, value = MANGO_VIEWS[view]
+    if selector:
+        view_selector = dict(selector, **view_selector)
+    fields = None
+    if not include_docs:
+        fields = ['_id'] + (value if isinstance(value, list) else [value])
+    return view_selector, fields
+
+
+def find_row(view, doc, include_docs=False):
+    """ View row of a document found with find_query, as a dict with id,
+    key, value and optionally doc. """
+    value = MANGO_VIEWS[view][1]
+    if isinstance(value, list):
+        row_value = dict((field, doc.get(field)) for field in value)
+    else:
+        row_value = doc.get(value)
+    row = {'id': doc['_id'], 'key': doc['_id'], 'value': row_value}
+    if include_docs:
+        row['doc'] = doc
+    return row
 
 
 class CouchDB(object):
@@ -32,19 +167,27 @@ class CouchDB(object):
 
     def __init__(self, url="http://localhost:5984", db="test",
                  username=None, password="", ssl_verification=True,
-                 create=False):
+                 create=False, query_backend='view'):
         """Create a CouchClient object.
         :param url: the location where the CouchDB instance is located,
                     including the port at which it's listening.
                     Default: http://localhost:5984
         :param db: the database to use. Default: test.
+        :param query_backend: 'view' to query map views, or 'mango' to
+                    answer the views of MANGO_VIEWS with _find queries,
+                    which needs CouchDB 2.0 or later.
         """
+        if query_backend not in QUERY_BACKENDS:
+            raise ValueError('Query backend {0} is not one of {1}'
+                             .format(query_backend, ', '.join(QUERY_BACKENDS)))
+        self.query_backend = query_backend
         server = couchdb.Server(url)
         if username is not None:
             server.resource.credentials = (username, password)
         if not ssl_verification:
             server.resource.session.disable_ssl_verification()
 
+        self.server = server
         if create:
             self.db = server.create(db)
         else:
@@ -65,7 +208,8 @@ class CouchDB(object):
         return CouchDB(
             url=resource.url[:-len(self.db.name) - 1], db=self.db.name,
             username=username, password=password,
-            ssl_verification=resource.session._disable_ssl_verification)
+            ssl_verification=resource.session._disable_ssl_verification,
+            query_backend=self.query_backend)
 
     def __getitem__(self, idx):
         return self.db[idx]
@@ -98,6 +242,48 @@ class CouchDB(object):
             raise ValueError(id + " is not a document ID in the database")
         return Document(data)
 
+    def all_ids(self, batch_size=10000):
+        """
+        Iterate over the IDs of all documents in the database, including
+        design documents, fetching batch_size IDs at a time.
+        """
+        for row in self.db.iterview('_all_docs', batch_size):
+            yield row.id
+
+    def changes(self, since='now', heartbeat=30000, include_docs=True,
+                **params):
+        """
+        Follow the continuous changes feed of the database.
+
+        :param since: update sequence to start from; 'now' only returns
+                      changes made after the call.
+        :param heartbeat: milliseconds between heartbeats that keep the
+                          connection open while there are no changes.
+        :param include_docs: include the changed documents
+        :return: iterator over change dicts with id, seq and optionally doc
+                 and deleted keys.
+        """
+        for change in self.db.changes(feed='continuous', since=since,
+                                      heartbeat=heartbeat,
+                                      include_docs=include_docs, **params):
+            if 'id' in change:
+                yield change
+
+    def changes_since(self, since=None):
+        """
+        Documents changed since an update sequence, without waiting for
+        new changes.
+
+        :param since: update sequence, or None to only get the current one.
+        :return: tuple of the set of changed document IDs and the current
+                 update sequence.
+        """
+        if since is None:
+            return set(), self.db.info()['update_seq']
+        result = self.db.changes(since=since)
+        return (set(change['id'] for change in result['results']),
+                result['last_seq'])
+
     def get_single_from_view(self, view, window_size=1, **view_params):
         """
         Get a document from the specified view.
@@ -117,12 +303,20 @@ class CouchDB(object):
         """
         Get the data from a view
 
+        With the mango query backend, the views of MANGO_VIEWS are queried
+        with find_rows instead, which also takes a selector parameter.
+
         :param view: name of the view
+        :param design_doc: design document of the view, see design_document
         :param view_params: the parameters that should be added to the view
         request. Optional.
         :return: iterator over the view; the rows property contains the rows.
         """
-        return self.db.view(design_doc + '/' + view, **view_params)
+        if (self.query_backend == 'mango' and view in MANGO_VIEWS and
+                design_doc == MONITOR_DESIGN_DOC):
+            return find_rows(self, view, **view_params)
+        return self.db.view(design_document(view, design_doc) + '/' + view,
+                            **view_params)
 
     def save(self, doc):
         """
@@ -173,9 +367,117 @@ class CouchDB(object):
         :param reduce_fun: string of the javascript reduce function (optional)
         """
         definition = ViewDefinition(
-            design_doc, view, map_fun, reduce_fun, *args, **kwargs)
+            design_document(view, design_doc), view, map_fun, reduce_fun,
+            *args, **kwargs)
         definition.sync(self.db)
 
+    def update_design_document(self, design_doc, views, remove=(),
+                               language='javascript'):
+        """
+        Add views to a design document with a single write.
+
+        Views that are already in the design document and not given are kept.
+        If all given views are already stored with the same definition, the
+        design document is not written, so that its indexes are not rebuilt.
+        :param design_doc: name of the design document, without _design/
+        :param views: dict of view names to dicts with a map and optionally a
+                      reduce function
+        :param remove: names of views to remove from the design document
+        :return: whether the design document was written
+        """
+        doc_id = '_design/' + design_doc
+        doc = self.db.get(doc_id)
+        if doc is None:
+            doc = {'_id': doc_id, 'language': language, 'views': {}}
+
+        new_views = dict(doc.get('views', {}))
+        for name, definition in views.items():
+            # normalize the code like couchdb.design.ViewDefinition does
+            new_views[name] = dict((key, dedent(value.lstrip('\n')))
+                                   for key, value in definition.items()
+                                   if value is not None)
+        for name in remove:
+            new_views.pop(name, None)
+        if new_views == doc.get('views'):
+            return False
+
+        doc['views'] = new_views
+        self.db.save(doc)
+        return True
+
+    def find(self, selector, fields=None, sort=None, limit=None, skip=0,
+             bookmark=None, use_index=None):
+        """
+        Query documents with a Mango selector, with the _find request of
+        CouchDB 2.0 or later.
+
+        :param fields: fields of the documents to return, or None for all
+        :param sort: list of fields or {field: 'asc' or 'desc'} dicts
+        :param limit: maximum number of documents; CouchDB returns 25 if
+                      not given
+        :param bookmark: bookmark returned by a previous query with the same
+                         selector, to get the next page of documents
+        :param use_index: design document of the index to use
+        :return: tuple of the list of documents and the bookmark of the next
+                 page.
+        """
+        query = {'selector': selector}
+        if fields is not None:
+            query['fields'] = fields
+        if sort is not None:
+            query['sort'] = sort
+        if limit is not None:
+            query['limit'] = limit
+        if skip > 0:
+            query['skip'] = skip
+        if bookmark is not None:
+            query['bookmark'] = bookmark
+        if use_index is not None:
+            query['use_index'] = use_index
+        _, _, result = self.db.resource.post_json('_find', body=query)
+        return result['docs'], result.get('bookmark')
+
+    def create_indexes(self):
+        """
+        Create the JSON indexes of MANGO_INDEXES, each in its own design
+        document, so that they are built independently. Existing indexes
+        are kept.
+
+        :return: sorted list of the names of the indexes that were created
+        """
+        created = []
+        for name, fields in sorted(MANGO_INDEXES.items()):
+            _, _, result = self.db.resource.post_json('_index', body={
+                'index': {'fields': fields},
+                'ddoc': 'simcity-' + name,
+                'name': name,
+                'type': 'json',
+            })
+            if result.get('result') == 'created':
+                created.append(name)
+        return created
+
+    def indexing_progress(self, design_doc):
+        """
+        Progress of building the indexes of a design document.
+
+        :return: percentage of the changes indexed, or None if the indexes
+                 are not being built.
+        """
+        try:
+            tasks = self.server.tasks()
+        except couchdb.http.Unauthorized:
+            return None  # only admins may list active tasks
+
+        progress = [task.get('progress', 0) for task in tasks
+                    if task.get('type') == 'indexer' and
+                    task.get('database', '').split('/')[-1].split('.')[0] ==
+                    self.db.name and
+                    task.get('design_document') == '_design/' + design_doc]
+        if len(progress) == 0:
+            return None
+        return sum(progress) / float(len(progress))
+
     def delete(self, doc):
         """
         Delete a Document from the database
@@ -19,7 +19,26 @@ Basic WebDAV implementation
 Reason this exists: easywebdav is not Python 3 compatible, webdavclient is
 flaky and not compatible with (at least) Beehub.
 """
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+import json
+import os
 import requests
+import shutil
+
+try:
+    from urllib.parse import unquote, urlparse
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlparse
+
+DAV_NS = '{DAV:}'
+PROPFIND_BODY = (b'<?xml version="1.0" encoding="utf-8"?>'
+                 b'<propfind xmlns="DAV:"><prop>'
+                 b'<resourcetype/><getcontentlength/><getetag/>'
+                 b'<getlastmodified/>'
+                 b'</prop></propfind>')
+SYNC_MANIFEST = '.dav_sync.json'
 
 
 def verify(acceptable_statuses, response, message):
@@ -30,8 +49,62 @@ def verify(acceptable_statuses, response, message):
     if response.status_code not in acceptable_statuses:
         header_str = '\n'.join(['{0}: {1}'.format(k, v)
                                 for k, v in response.headers.lower_items()])
-        raise IOError('{0}: HTTP status code {1}\nHeaders:\n{2}'
-                      .format(message, response.status_code, header_str))
+        error = IOError('{0}: HTTP status code {1}\nHeaders:\n{2}'
+                        .format(message, response.status_code, header_str))
+        error.status_code = response.status_code
+        raise error
+
+
+def _parse_propfind_response(elem, base_path):
+    """ Parse a single response element of a PROPFIND multistatus reply.
+    @return: dict with path, is_dir, length, etag and modified or None if the
+        response has no successful properties.
+    """
+    href = elem.findtext(DAV_NS + 'href')
+    if href is None:
+        return None
+    href_path = unquote(urlparse(href).path)
+    if href_path.startswith(base_path):
+        href_path = href_path[len(base_path):]
+
+    item = {'path': href_path.strip('/'), 'is_dir': False, 'length': None,
+            'etag': None, 'modified': None}
+    found = False
+    for propstat in elem.findall(DAV_NS + 'propstat'):
+        status = propstat.findtext(DAV_NS + 'status') or ''
+        if ' 200 ' not in status + ' ':
+            continue
+        prop = propstat.find(DAV_NS + 'prop')
+        if prop is None:
+            continue
+        found = True
+        resourcetype = prop.find(DAV_NS + 'resourcetype')
+        if (resourcetype is not None and
+                resourcetype.find(DAV_NS + 'collection') is not None):
+            item['is_dir'] = True
+        length = prop.findtext(DAV_NS + 'getcontentlength')
+        if length:
+            item['length'] = int(length)
+        item['etag'] = prop.findtext(DAV_NS + 'getetag') or item['etag']
+        item['modified'] = (prop.findtext(DAV_NS + 'getlastmodified') or
+                            item['modified'])
+    return item if found else None
+
+
+def _join(path, name):
+    """ Join webdav path components, ignoring empty ones. """
+    return '/'.join(p for p in (path, name) if p)
+
+
+def _makedirs(path):
+    """ Create a directory and its parents, if they do not exist. """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def segment_path(path, number):
+    """ Path of a segment of a file that is uploaded in segments. """
+    return '{0}.segments/{1:05d}'.format(path, number)
 
 
 class RestRequests(object):
@@ -87,6 +160,50 @@ class RestRequests(object):
 
         verify((201, 204), response, 'Failed to upload file {0}'.format(path))
 
+    def put_segments(self, path, fp, content_length, segment_size,
+                     retries=3, **kwargs):
+        """
+        Put a large file from a file pointer as separate segments, so that a
+        failure only requires the failed segment to be uploaded again.
+
+        Segments are stored as path.segments/00000, path.segments/00001,
+        etc. When all segments are uploaded, a JSON manifest describing them
+        is put at path. Only one segment is kept in memory at a time.
+        @param content_length: size of the file in bytes
+        @param segment_size: maximum size of a segment in bytes
+        @param retries: number of times to retry a failed segment
+        @return: number of segments
+        """
+        segment_size = max(1, int(segment_size))
+        self.mkdir(path + '.segments', ignore_existing=True, **kwargs)
+
+        number = 0
+        for number, offset in enumerate(
+                range(0, content_length, segment_size)):
+            data = fp.read(min(segment_size, content_length - offset))
+            attempt = 0
+            while True:
+                try:
+                    self.put(segment_path(path, number), data,
+                             content_type='application/octet-stream',
+                             **kwargs)
+                    break
+                except (IOError, requests.RequestException) as ex:
+                    attempt += 1
+                    if attempt > retries:
+                        raise IOError('Failed to upload segment {0} of {1}: '
+                                      '{2}'.format(number, path, ex))
+                    print('Retrying segment {0} of {1} after error: {2}'
+                          .format(number, path, ex))
+
+        segments = number + 1 if content_length > 0 else 0
+        manifest = json.dumps({'segments': segments,
+                               'segment_size': segment_size,
+                               'length': content_length})
+        self.put(path, manifest.encode('utf-8'),
+                 content_type='application/json', **kwargs)
+        return segments
+
     def mkdir(self, path, ignore_existing=False, **kwargs):
         """
         Make a new directory. Set ignore_existing to not throw an error if
@@ -125,16 +242,345 @@ class RestRequests(object):
         verify((200,), response, 'Failed to get file {0}'.format(path))
         return response.content
 
-    def download(self, path, file_path, chunk_size=1024 * 1024, **kwargs):
-        """ Download path to file_path. """
+    def download(self, path, file_path, chunk_size=1024 * 1024, length=None,
+                 resume=False, parallelism=1, retries=3,
+                 min_part_size=64 * 1024 * 1024, **kwargs):
+        """
+        Download path to file_path.
+
+        Interrupted transfers are continued with HTTP Range requests, up to
+        retries times. Large files can be downloaded in parallel parts.
+        @param length: expected file size in bytes. If given, the size of the
+            downloaded file is verified.
+        @param resume: continue a partially downloaded file at file_path
+            instead of starting over.
+        @param parallelism: number of parts to download at the same time, if
+            length is known and the server supports range requests. If the
+            server answers the first range with the whole file, the file is
+            downloaded sequentially instead.
+        @param retries: number of times to resume after a failure.
+        @param min_part_size: minimum number of bytes of a parallel part.
+        @raise IOError: if the download failed or had the wrong size.
+        """
         kwargs.update(self.kwargs)
-        response = requests.get(self.path_to_url(path), stream=True,
-                                auth=self.auth, **kwargs)
+        parts = 1
+        if length is not None and hasattr(os, 'pwrite'):
+            parts = max(1, min(int(parallelism), length // min_part_size))
 
-        verify((200,), response, 'Failed to get file {0}'.format(path))
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                f.write(chunk)
+        if parts > 1:
+            downloaded = self._download_parallel(
+                path, file_path, length, parts, chunk_size, retries, kwargs)
+        else:
+            downloaded = False
+        if not downloaded:
+            self._download_sequential(path, file_path, length, resume,
+                                      chunk_size, retries, kwargs)
+
+        if length is not None and os.path.getsize(file_path) != length:
+            raise IOError('Downloaded file {0} has size {1} instead of {2}'
+                          .format(path, os.path.getsize(file_path), length))
+
+    def download_segments(self, path, file_path, segments, length=None,
+                          **kwargs):
+        """
+        Download a file that was uploaded with put_segments to file_path.
+        @param segments: number of segments
+        @param length: expected file size in bytes
+        @param kwargs: arguments to pass to download for each segment
+        @raise IOError: if the download failed or had the wrong size.
+        """
+        segment_file = file_path + '.segment'
+        try:
+            with open(file_path, 'wb') as f:
+                for number in range(segments):
+                    self.download(segment_path(path, number), segment_file,
+                                  **kwargs)
+                    with open(segment_file, 'rb') as segment:
+                        shutil.copyfileobj(segment, f)
+        finally:
+            if os.path.exists(segment_file):
+                os.remove(segment_file)
+
+        if length is not None and os.path.getsize(file_path) != length:
+            raise IOError('Downloaded file {0} has size {1} instead of {2}'
+                          .format(path, os.path.getsize(file_path), length))
+
+    def _download_sequential(self, path, file_path, length, resume,
+                             chunk_size, retries, kwargs):
+        """ Download a file in a single stream, resuming after failures. """
+        if not resume or not os.path.exists(file_path):
+            open(file_path, 'wb').close()
+
+        attempt = 0
+        while True:
+            offset = os.path.getsize(file_path)
+            if length is not None and offset == length:
+                return
+            try:
+                response = self._get_range(path, offset, None, kwargs)
+                if response.status_code == 416 and length is None:
+                    return  # already complete
+                verify((200, 206), response,
+                       'Failed to get file {0}'.format(path))
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(file_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                return
+            except (IOError, requests.RequestException) as ex:
+                attempt += 1
+                if attempt > retries:
+                    raise IOError('Failed to get file {0}: {1}'
+                                  .format(path, ex))
+                print('Resuming download of {0} after error: {1}'
+                      .format(path, ex))
+
+    def _download_parallel(self, path, file_path, length, parts, chunk_size,
+                           retries, kwargs):
+        """ Download a file in parallel ranges, written in place.
+        @return: False, without downloading, if the server does not answer
+            the first range request with a partial response. """
+        part_size = -(-length // parts)
+        ranges = [(start, min(start + part_size, length))
+                  for start in range(0, length, part_size)]
+
+        try:
+            first = self._get_range(path, 0, ranges[0][1] - 1, kwargs)
+        except requests.RequestException:
+            return False  # the sequential download retries
+        if first.status_code != 206:
+            # range not supported, or an error that the sequential download
+            # reports
+            first.close()
+            return False
+
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            os.ftruncate(fd, length)
+            pool = ThreadPool(len(ranges))
+            try:
+                pool.map(lambda r: self._download_range(
+                    path, fd, r[0], r[1], chunk_size, retries, kwargs,
+                    first if r == ranges[0] else None), ranges)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            os.close(fd)
+        return True
+
+    def _download_range(self, path, fd, start, end, chunk_size, retries,
+                        kwargs, response=None):
+        """ Download bytes [start, end) of a file to the same offsets of fd.
+        @param response: response of an earlier request of the range
+        """
+        attempt = 0
+        while start < end:
+            try:
+                if response is None:
+                    response = self._get_range(path, start, end - 1, kwargs)
+                verify((206,), response,
+                       'Failed to get range of file {0}'.format(path))
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    chunk = chunk[:end - start]
+                    os.pwrite(fd, chunk, start)
+                    start += len(chunk)
+                if start < end:
+                    raise IOError('Range of file {0} ended early'.format(path))
+            except (IOError, requests.RequestException) as ex:
+                response = None
+                attempt += 1
+                if attempt > retries:
+                    raise IOError('Failed to get file {0}: {1}'
+                                  .format(path, ex))
+
+    def _get_range(self, path, start, end, kwargs):
+        """ Stream a GET request for bytes start to end (inclusive) of a file.
+        Without start and end, the whole file is requested. """
+        kwargs = dict(kwargs)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if start > 0 or end is not None:
+            headers['Range'] = 'bytes={0}-{1}'.format(
+                start, '' if end is None else end)
+        return requests.get(self.path_to_url(path), stream=True,
+                            auth=self.auth, headers=headers, **kwargs)
+
+    def list(self, path, depth=1, **kwargs):
+        """
+        List the contents of a directory with a PROPFIND request.
+
+        The response is parsed while it is received, so that large listings
+        are not kept in memory.
+        @param depth: 1 to list only the directory itself, 'infinity' to list
+            all its descendants. Some servers do not allow infinite depth.
+        @return: generator of dicts with keys path, is_dir, length (in
+            bytes), etag and modified; the listed directory itself is
+            excluded.
+        """
+        kwargs.update(self.kwargs)
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Depth'] = str(depth)
+        headers['Content-Type'] = 'application/xml'
+        response = requests.request(
+            'PROPFIND', self.path_to_url(path), auth=self.auth,
+            headers=headers, data=PROPFIND_BODY, stream=True, **kwargs)
+        verify((207,), response, 'Failed to list {0}'.format(path))
+
+        response.raw.decode_content = True
+        base_path = urlparse(self.base_url).path.rstrip('/')
+        own_path = path.strip('/')
+        for event, elem in ElementTree.iterparse(response.raw):
+            if elem.tag != DAV_NS + 'response':
+                continue
+            item = _parse_propfind_response(elem, base_path)
+            elem.clear()
+            if item is not None and item['path'] != own_path:
+                yield item
+
+    def walk(self, path, **kwargs):
+        """
+        List all descendants of a directory, with a single PROPFIND request
+        of infinite depth. If the server refuses that, as many servers are
+        configured to do, each directory is listed separately instead.
+        @return: generator of dicts like those of list
+        """
+        listed = False
+        try:
+            for item in self.list(path, depth='infinity', **kwargs):
+                listed = True
+                yield item
+            return
+        except IOError as ex:
+            if listed or getattr(ex, 'status_code', None) not in (400, 403,
+                                                                  501):
+                raise
+
+        directories = [path]
+        while len(directories) > 0:
+            for item in self.list(directories.pop(), depth=1, **kwargs):
+                if item['is_dir']:
+                    directories.append(item['path'])
+                yield item
+
+    def sync(self, local_dir, path, upload=False, **kwargs):
+        """
+        Synchronize a local directory with a webdav directory, transferring
+        only files that changed.
+
+        Files are compared by size, and by the ETag and modification time
+        recorded in a .dav_sync.json manifest in the local directory after a
+        previous sync. Files are not deleted on either side.
+        @param upload: upload local files to webdav instead of downloading
+            webdav files.
+        @return: list of paths of transferred files, relative to path.
+        """
+        manifest_path = os.path.join(local_dir, SYNC_MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+
+        path = path.strip('/')
+        prefix_length = len(path) + 1 if path else 0
+        remote = {}
+        try:
+            for item in self.walk(path, **kwargs):
+                remote[item['path'][prefix_length:]] = item
+        except IOError:
+            if not upload:
+                raise  # remote directory does not exist
+
+        if upload:
+            transferred = self._sync_upload(local_dir, path, remote, manifest,
+                                            **kwargs)
+        else:
+            transferred = self._sync_download(local_dir, path, remote,
+                                              manifest, **kwargs)
+
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        return transferred
+
+    def _sync_download(self, local_dir, path, remote, manifest, **kwargs):
+        """ Download remote files that differ from the local files. """
+        transferred = []
+        for name, item in sorted(remote.items()):
+            file_path = os.path.join(local_dir, *name.split('/'))
+            if item['is_dir']:
+                _makedirs(file_path)
+                continue
+            recorded = manifest.get(name, {})
+            if (os.path.exists(file_path) and
+                    os.path.getsize(file_path) == item['length'] and
+                    recorded.get('etag') == item['etag'] and
+                    recorded.get('mtime') == os.path.getmtime(file_path)):
+                continue
+
+            _makedirs(os.path.dirname(file_path))
+            self.download(_join(path, name), file_path,
+                          length=item['length'], **kwargs)
+            manifest[name] = {'etag': item['etag'],
+                              'mtime': os.path.getmtime(file_path)}
+            transferred.append(_join(path, name))
+        return transferred
+
+    def _sync_upload(self, local_dir, path, remote, manifest, **kwargs):
+        """ Upload local files that differ from the remote files. """
+        transferred = []
+        if path:
+            self.mkdir(path, ignore_existing=True, **kwargs)
+        for root, dirs, files in os.walk(local_dir):
+            rel_root = os.path.relpath(root, local_dir)
+            rel_root = '' if rel_root == '.' else rel_root.replace(os.sep, '/')
+            for d in sorted(dirs):
+                name = _join(rel_root, d)
+                if name not in remote:
+                    self.mkdir(_join(path, name), ignore_existing=True,
+                               **kwargs)
+            for filename in sorted(files):
+                name = _join(rel_root, filename)
+                if name == SYNC_MANIFEST:
+                    continue
+                file_path = os.path.join(root, filename)
+                length = os.path.getsize(file_path)
+                mtime = os.path.getmtime(file_path)
+                recorded = manifest.get(name, {})
+                item = remote.get(name)
+                if (item is not None and item['length'] == length and
+                        recorded.get('etag') == item['etag'] and
+                        recorded.get('mtime') == mtime):
+                    continue
+
+                with open(file_path, 'rb') as f:
+                    self.put(_join(path, name), f, content_length=length,
+                             **kwargs)
+                manifest[name] = {'etag': self._etag(_join(path, name)),
+                                  'mtime': mtime}
+                transferred.append(_join(path, name))
+        return transferred
+
+    def validator(self, path):
+        """
+        Value that changes when a file is written: its ETag, or its
+        Last-Modified time if the server does not provide an ETag.
+        @return: validator, or None if the file does not exist or the server
+            provides neither.
+        """
+        kwargs = dict(self.kwargs)
+        response = requests.head(self.path_to_url(path), auth=self.auth,
+                                 allow_redirects=True, **kwargs)
+        if response.status_code != 200:
+            return None
+        return (response.headers.get('etag') or
+                response.headers.get('last-modified'))
+
+    def _etag(self, path):
+        """ ETag of a file, or None if the server does not provide one. """
+        kwargs = dict(self.kwargs)
+        response = requests.head(self.path_to_url(path), auth=self.auth,
+                                 allow_redirects=True, **kwargs)
+        return response.headers.get('etag')
 
     def path_to_url(self, path):
         """ Given a path relative to the base_url, returns the full URL."""
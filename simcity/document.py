@@ -151,6 +151,7 @@ class Task(Document):
                 'type': 'task',
                 'lock': 0,
                 'done': 0,
+                'created': seconds(),
                 'hostname': '',
                 'scrub_count': 0,
                 'input': {},
@@ -161,14 +162,29 @@ class Task(Document):
         if self.id is None:
             self['_id'] = 'task_' + uuid4().hex
 
-    def lock(self, job_id):
+    def lock(self, job_id, lease=None):
         """Function which modifies the task such that it is in progress.
         :@param job_id: job id that is processing the task
+        :@param lease: if not None, the number of seconds that the lock is
+            valid, unless it is renewed with renew_lease.
         """
         self['lock'] = seconds()
         self['job'] = job_id
+        if lease is not None:
+            self['lease_until'] = self['lock'] + int(lease)
         return self._update_hostname()
 
+    def renew_lease(self, lease):
+        """Extend the lease of a locked task to lease seconds from now."""
+        self['lease_until'] = seconds() + int(lease)
+        return self
+
+    def lease_expired(self):
+        """ Whether the task is in progress with a lease that has expired. """
+        lease_until = self.get('lease_until', 0)
+        return (self['lock'] > 0 and self['done'] == 0 and
+                0 < lease_until < seconds())
+
     def done(self):
         """Function which modifies the task such that it is closed for ever
         to the view that has supplied it.
@@ -206,10 +222,34 @@ class Task(Document):
     def files(self, files):
         self['files'] = files
 
+    @property
+    def timing(self):
+        """ Duration of each processing phase of the task, in ms. """
+        return self.setdefault('timing', {})
+
+    def record_timing(self, phase, seconds):
+        """ Record the duration of a processing phase.
+        @param phase: name of the phase, e.g. claim, stage_in or execute
+        @param seconds: duration in seconds
+        """
+        self.timing[phase] = int(round(seconds * 1000))
+        return self
+
     def list_files(self):
         """ All attachment names associated to a task. """
         return list(self.files.keys()) + list(self.attachments.keys())
 
+    def release(self):
+        """
+        Unlock a task that was claimed but not started, so that it can be
+        claimed again. Unlike scrub, this does not count as a scrub.
+        """
+        self['lock'] = 0
+        self.pop('job', None)
+        self.pop('lease_until', None)
+        self.pop('timing', None)
+        return self
+
     def scrub(self):
         """
         Task scrubber: makes sure a task can be handed out again if it was
@@ -218,6 +258,8 @@ class Task(Document):
         self['scrub_count'] = 1 + self.setdefault('scrub_count', 0)
         self['done'] = 0
         self['lock'] = 0
+        self.pop('lease_until', None)
+        self.pop('timing', None)
         return self._update_hostname()
 
     def error(self, msg=None, exception=None):
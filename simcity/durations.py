@@ -0,0 +1,117 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Duration statistics of tasks, to predict how long a task will run. """
+
+from .document import Document
+from couchdb.http import ResourceConflict
+import math
+
+
+class TaskDurations(object):
+    """
+    Duration statistics per task class.
+
+    A task class is the combination of the command and the ensemble of a
+    task. For each class, the number of tasks, the mean duration and the sum
+    of squared differences from the mean are kept, so that statistics of
+    different jobs can be merged. Statistics are stored in a single document
+    in the job database.
+    """
+    DOC_ID = 'task_durations'
+
+    def __init__(self, stored=None, new=None):
+        """
+        @param stored: dict of statistics loaded from the database
+        @param new: dict-like to keep statistics of newly finished tasks in,
+            for example a multiprocessing.Manager dict.
+        """
+        self.stored = stored if stored is not None else {}
+        self.new = new if new is not None else {}
+
+    @staticmethod
+    def task_class(task):
+        """ The class of a task: its command and ensemble. """
+        ensemble = task.get('ensemble')
+        if ensemble is None:
+            ensemble = task.get('input', {}).get('ensemble', '')
+        return u'{0}|{1}'.format(task.get('command', ''), ensemble)
+
+    def add(self, task, duration):
+        """ Add the duration in seconds of a finished task. """
+        key = self.task_class(task)
+        self.new[key] = _merge(self.new.get(key), [1, float(duration), 0.0])
+
+    def predict(self, task):
+        """ Predicted duration of a task in seconds: one standard deviation
+        above the mean duration of its class.
+        @return: predicted duration or None if the class has no statistics.
+        """
+        key = self.task_class(task)
+        stats = _merge(self.stored.get(key), self.new.get(key))
+        if stats is None:
+            return None
+        count, mean, m2 = stats
+        if count < 2:
+            return mean
+        return mean + math.sqrt(m2 / (count - 1))
+
+    @classmethod
+    def load(cls, database, new=None):
+        """ Load the stored statistics from the database. """
+        try:
+            stored = database.get(cls.DOC_ID).get('classes', {})
+        except ValueError:
+            stored = {}
+        return cls(stored=stored, new=new)
+
+    def save(self, database):
+        """ Merge the statistics of newly finished tasks into the database.
+        """
+        new = dict(self.new)
+        if len(new) == 0:
+            return
+
+        while True:
+            try:
+                doc = database.get(self.DOC_ID)
+            except ValueError:
+                doc = Document({'_id': self.DOC_ID, 'type': 'durations'})
+
+            classes = doc.setdefault('classes', {})
+            for key, stats in new.items():
+                classes[key] = _merge(classes.get(key), stats)
+            try:
+                database.save(doc)
+                return
+            except ResourceConflict:
+                pass  # updated by another job, merge again
+
+
+def _merge(a, b):
+    """ Merge two [count, mean, m2] statistics; either may be None. """
+    if a is None:
+        return None if b is None else list(b)
+    if b is None:
+        return list(a)
+
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    return [count,
+            mean_a + delta * count_b / count,
+            m2_a + m2_b + delta * delta * count_a * count_b / count]
@@ -19,13 +19,30 @@ Ensemble metadata
 """
 
 
+STATUS_CODE = '''
+                  var status;
+                  if (doc.lock === -1) {
+                    status = "error";
+                  } else if (doc.lock === 0) {
+                    status = "pending";
+                  } else if (doc.done > 0) {
+                    status = "done";
+                  } else {
+                    status = "running";
+                  }'''
+
+ENSEMBLE_STATUSES = ('pending', 'running', 'done', 'error')
+
+
 def ensemble_view(task_db, name, version, url=None, ensemble=None):
     """
-    Create a view for an ensemble.
+    Create views for an ensemble.
 
-    This checks if the view already exists. If not, a new view is created with
-    a new design document name. The view is then called all_docs under that
-    design document.
+    This checks if the views already exist. If not, they are created under a
+    new design document name. The design document contains three views:
+    all_docs with the task metadata, list with the status of each task,
+    keyed by task ID for pagination, and status that counts the tasks per
+    status with a reduce function.
 
     @param task_db: task database
     @param name: simulator name
@@ -43,8 +60,17 @@ def ensemble_view(task_db, name, version, url=None, ensemble=None):
 
     doc_id = '_design/{0}'.format(design_doc)
     try:
-        task_db.get(doc_id)
+        existing_views = task_db.get(doc_id).get('views', {})
     except ValueError:
+        existing_views = {}
+
+    condition = '''doc.type === "task" && doc.name === "{name}" &&
+                  doc.version === "{version}" && !doc.archive
+                  {ensemble_condition}'''.format(
+        name=name, version=version, ensemble_condition=ensemble_condition)
+
+    views = {}
+    if 'all_docs' not in existing_views:
         if url is None:
             url = task_db.url
 
@@ -53,17 +79,11 @@ def ensemble_view(task_db, name, version, url=None, ensemble=None):
 
         map_fun = '''
             function(doc) {{
-              if (doc.type === "task" && doc.name === "{name}" &&
-                  doc.version === "{version}" && !doc.archive
-                  {ensemble_condition}) {{
+              if ({condition}) {{
                 emit(doc._id, {{
                   _id: doc._id,
                   _rev: doc._rev,
                   url: "{url}" + doc._id,
-                  input: {{
-                    ensemble: doc.input.ensemble,
-                    simulation: doc.input.simulation,
-                  }},
                   error: doc.error,
                   lock: doc.lock,
                   done: doc.done,
@@ -74,9 +94,62 @@ def ensemble_view(task_db, name, version, url=None, ensemble=None):
                   defaultFeatureType: doc.defaultFeatureType
                 }});
               }}
-            }}'''.format(name=name, version=version,
-                         ensemble_condition=ensemble_condition, url=url)
+            }}'''.format(condition=condition, url=url)
 
-        task_db.add_view('all_docs', map_fun, design_doc=design_doc)
+        views['all_docs'] = {'map': map_fun}
 
+    if 'list' not in existing_views:
+        map_fun = '''
+            function(doc) {{
+              if ({condition}) {{{status}
+                emit(doc._id, status);
+              }}
+            }}'''.format(condition=condition, status=STATUS_CODE)
+        views['list'] = {'map': map_fun}
+
+    if 'status' not in existing_views:
+        map_fun = '''
+            function(doc) {{
+              if ({condition}) {{{status}
+                emit(status, null);
+              }}
+            }}'''.format(condition=condition, status=STATUS_CODE)
+        views['status'] = {'map': map_fun, 'reduce': '_count'}
+
+    if len(views) > 0:
+        task_db.update_design_document(design_doc, views)
     return design_doc
+
+
+def ensemble_status(task_db, design_doc):
+    """
+    Count the tasks of an ensemble per status.
+
+    This reads only the reduced status view, so it takes constant time
+    regardless of the ensemble size.
+    @param design_doc: design document returned by ensemble_view
+    @return: dict with the number of pending, running, done and error tasks
+    """
+    counts = dict((status, 0) for status in ENSEMBLE_STATUSES)
+    for row in task_db.view('status', design_doc=design_doc, group=True):
+        counts[row.key] = row.value
+    return counts
+
+
+def ensemble_page(task_db, design_doc, limit=100, startkey=None):
+    """
+    Get a page of task IDs and statuses of an ensemble.
+
+    @param design_doc: design document returned by ensemble_view
+    @param limit: maximum number of tasks on the page
+    @param startkey: task ID to start at, as returned by a previous call
+    @return: tuple of a list of (task ID, status) tuples and the startkey of
+        the next page, which is None on the last page
+    """
+    params = {'limit': limit + 1}
+    if startkey is not None:
+        params['startkey'] = startkey
+    rows = list(task_db.view('list', design_doc=design_doc, **params))
+    page = [(row.key, row.value) for row in rows[:limit]]
+    next_key = rows[limit].key if len(rows) > limit else None
+    return page, next_key
@@ -0,0 +1,400 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export of ensemble results to columnar Parquet or Arrow files.
+
+Requires pyarrow, installed with the 'export' extra.
+"""
+
+from __future__ import print_function
+from .document import Task
+from .ensemble import ensemble_view
+from .management import get_task_database
+from .task import read_attachment
+from multiprocessing.pool import ThreadPool
+import json
+import os
+import sys
+import tempfile
+
+# pyarrow is imported by ColumnarWriter, as it is slow to import
+pyarrow = None
+CONVERSION_ERRORS = ()
+
+FORMATS = ('parquet', 'arrow')
+
+
+def _import_pyarrow():
+    """ Import pyarrow into this module.
+    @raise EnvironmentError: if pyarrow is not installed """
+    global pyarrow, CONVERSION_ERRORS
+    if pyarrow is not None:
+        return
+    try:
+        import pyarrow as pyarrow_module
+        import pyarrow.ipc
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise EnvironmentError('Exporting requires pyarrow; install '
+                               'simcity[export]')
+    pyarrow = pyarrow_module
+    CONVERSION_ERRORS = (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError,
+                         TypeError, ValueError, OverflowError)
+
+
+def iter_view_docs(database, view, design_doc, page_size=1000,
+                   **view_params):
+    """
+    Iterate over the documents of a view, fetching page_size documents at a
+    time. The view must have unique keys, like the document ID.
+    """
+    params = dict(view_params)
+    while True:
+        rows = list(database.view(view, design_doc=design_doc,
+                                  include_docs=True, limit=page_size + 1,
+                                  **params))
+        for row in rows[:page_size]:
+            yield row.doc
+        if len(rows) <= page_size:
+            return
+        params['startkey'] = rows[page_size].key
+
+
+def flatten(value, prefix, row):
+    """
+    Flatten nested dicts into row, with dotted column names. Lists are
+    stored as JSON strings.
+    """
+    if isinstance(value, dict):
+        for key, sub_value in value.items():
+            flatten(sub_value, '{0}.{1}'.format(prefix, key), row)
+    elif isinstance(value, (list, tuple)):
+        row[prefix] = json.dumps(value)
+    else:
+        row[prefix] = value
+    return row
+
+
+def task_row(task):
+    """ Flat table row of a task: its metadata, input and output. """
+    row = {
+        'id': task.id,
+        'lock': task.get('lock'),
+        'done': task.get('done'),
+        'errors': len(task.get('error', [])),
+        'runtime': task.get('runtime'),
+    }
+    flatten(task.get('input', {}), 'input', row)
+    flatten(task.get('output', {}), 'output', row)
+    return row
+
+
+class ColumnarWriter(object):
+    """
+    Writes rows to a Parquet or Arrow file, one row group at a time.
+
+    Without a schema, the schema is inferred from the first row group, and
+    later rows with columns that are not in it raise a ValueError. With a
+    schema, such columns are dropped with a warning, since the rows may
+    have changed after the schema was collected. Values that cannot be
+    converted to the type of their column are stored as null.
+
+    The file is written to a temporary file next to path, which replaces
+    path when the writer is closed. If the with block raises an exception,
+    the temporary file is removed instead.
+    @param schema: pyarrow schema of all rows, for example from
+        union_schema
+    """
+    def __init__(self, path, file_format='parquet', schema=None):
+        _import_pyarrow()
+        if file_format not in FORMATS:
+            raise ValueError('Format {0} is not one of {1}'
+                             .format(file_format, ', '.join(FORMATS)))
+        self.path = path
+        self.format = file_format
+        self.schema = schema
+        self.strict = schema is None
+        self.writer = None
+        self.tmp_path = None
+        self.dropped = set()
+        self.rows = 0
+
+    def write(self, rows):
+        """ Write a list of row dicts as a row group. """
+        if len(rows) == 0:
+            return
+        if self.schema is None:
+            self.schema = union_schema([rows])
+        self._check_columns(rows)
+        if self.writer is None:
+            fd, self.tmp_path = tempfile.mkstemp(
+                prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                dir=os.path.dirname(os.path.abspath(self.path)))
+            os.close(fd)
+            if self.format == 'parquet':
+                self.writer = pyarrow.parquet.ParquetWriter(self.tmp_path,
+                                                            self.schema)
+            else:
+                self.writer = pyarrow.ipc.new_file(self.tmp_path,
+                                                   self.schema)
+
+        table = pyarrow.Table.from_arrays(
+            [_column([row.get(field.name) for row in rows], field)
+             for field in self.schema], schema=self.schema)
+        self.writer.write_table(table)
+        self.rows += len(rows)
+
+    def _check_columns(self, rows):
+        """ Warn about columns that are not in the schema.
+        @raise ValueError: if the schema was inferred and rows have columns
+            that are not in it """
+        names = set(self.schema.names)
+        for row in rows:
+            for key in row:
+                if key in names or key in self.dropped:
+                    continue
+                if self.strict:
+                    raise ValueError('Column {0} is not in the schema of '
+                                     '{1}'.format(key, self.path))
+                self.dropped.add(key)
+                print('WARNING: column {0} was added after the schema of {1} '
+                      'was collected and is not exported'
+                      .format(key, self.path), file=sys.stderr)
+
+    def close(self):
+        """ Finish the file and move it into place. """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            _replace(self.tmp_path, self.path)
+            self.tmp_path = None
+
+    def abort(self):
+        """ Stop writing and remove the unfinished file. """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            os.remove(self.tmp_path)
+            self.tmp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _replace(src, dst):
+    """ Rename src to dst, replacing dst if it exists. """
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # Python 2
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def union_schema(row_groups):
+    """
+    Schema with the columns of all row groups. Integer and floating point
+    columns are combined into floating point columns, and columns with
+    other conflicting types into string columns.
+    @param row_groups: iterable of lists of row dicts
+    """
+    _import_pyarrow()
+    fields = []
+    indexes = {}
+    for rows in row_groups:
+        names = []
+        columns = {}
+        for row in rows:
+            for key, value in row.items():
+                if key not in columns:
+                    names.append(key)
+                    columns[key] = []
+                columns[key].append(value)
+
+        for name in names:
+            try:
+                field = pyarrow.field(name, pyarrow.array(columns[name]).type)
+            except CONVERSION_ERRORS:
+                field = pyarrow.field(name, pyarrow.string())
+            if name not in indexes:
+                indexes[name] = len(fields)
+                fields.append(field)
+            else:
+                index = indexes[name]
+                fields[index] = _unify_field(fields[index], field)
+    return _typed_schema(pyarrow.schema(fields))
+
+
+def _unify_field(field, other):
+    """ Field with a type that can store the values of both fields. """
+    if field.type == other.type or pyarrow.types.is_null(other.type):
+        return field
+    if pyarrow.types.is_null(field.type):
+        return other
+    numeric = (pyarrow.types.is_integer, pyarrow.types.is_floating)
+    if (any(is_type(field.type) for is_type in numeric) and
+            any(is_type(other.type) for is_type in numeric)):
+        return field.with_type(pyarrow.float64())
+    return field.with_type(pyarrow.string())
+
+
+def _typed_schema(schema):
+    """ Replace columns without a type, because they only had null values,
+    by binary columns for attachments and string columns otherwise. """
+    fields = []
+    for field in schema:
+        if pyarrow.types.is_null(field.type):
+            if field.name.startswith('file.'):
+                field = field.with_type(pyarrow.binary())
+            else:
+                field = field.with_type(pyarrow.string())
+        fields.append(field)
+    return pyarrow.schema(fields)
+
+
+def _column(values, field):
+    """ Arrow array of values with the type of field. Values are converted
+    to strings for string columns, and to null if they cannot be converted
+    otherwise. """
+    if pyarrow.types.is_string(field.type):
+        values = [v if v is None or isinstance(v, str) else json.dumps(v)
+                  for v in values]
+    try:
+        return pyarrow.array(values, type=field.type)
+    except CONVERSION_ERRORS:
+        converted = []
+        for value in values:
+            try:
+                pyarrow.array([value], type=field.type)
+                converted.append(value)
+            except CONVERSION_ERRORS:
+                converted.append(None)
+        return pyarrow.array(converted, type=field.type)
+
+
+def _add_attachments(tasks, rows, filenames, max_size, pool):
+    """ Read small attachments of tasks concurrently into their rows, in
+    file.[filename] columns. """
+    requests = []
+    for task, row in zip(tasks, rows):
+        for filename in filenames:
+            row['file.' + filename] = None
+            info = task.files.get(filename)
+            if info is None:
+                info = task.get('_attachments', {}).get(filename)
+            if info is not None and info.get('length', 0) <= max_size:
+                requests.append((task, row, filename))
+
+    def read(request):
+        task, row, filename = request
+        try:
+            row['file.' + filename] = read_attachment(task, filename)
+        except (IOError, KeyError, ValueError) as ex:
+            print('WARNING: attachment {0} of task {1} could not be read: '
+                  '{2}'.format(filename, task.id, ex), file=sys.stderr)
+
+    pool.map(read, requests)
+
+
+def export_ensemble(path, name, version, ensemble=None, file_format='parquet',
+                    attachments=(), max_attachment_size=1024 * 1024,
+                    row_group_size=10000, page_size=1000, parallelism=16,
+                    cache_size=100000, database=None):
+    """
+    Export the tasks of an ensemble to a Parquet or Arrow file.
+
+    Tasks are read page by page from the ensemble list view. Each task
+    becomes a row with its id, lock, done, number of errors and runtime, and
+    its input and output flattened into input.* and output.* columns. The
+    columns of all tasks are collected before the first row group is
+    written. Up to cache_size tasks are kept in memory for that; the view
+    of larger ensembles is read a second time to write them.
+    @param attachments: names of attachments to include as binary
+        file.[name] columns, if they are at most max_attachment_size bytes.
+        They are read concurrently by parallelism threads.
+    @param row_group_size: number of rows per row group
+    @return: number of exported tasks
+    """
+    if database is None:
+        database = get_task_database()
+
+    design_doc = ensemble_view(database, name, version, ensemble=ensemble)
+
+    def task_pages():
+        docs = iter_view_docs(database, 'list', design_doc,
+                              page_size=page_size)
+        for page in _pages(docs, row_group_size):
+            yield [Task(doc) for doc in page]
+
+    cache = []
+    total = [0]
+
+    def cached_pages():
+        for tasks in task_pages():
+            total[0] += len(tasks)
+            if total[0] <= cache_size:
+                cache.append(tasks)
+            else:
+                del cache[:]
+            yield tasks
+
+    schema = union_schema([task_row(task) for task in tasks]
+                          for tasks in cached_pages())
+    pages = cache if total[0] <= cache_size else task_pages()
+    if len(attachments) > 0:
+        schema = pyarrow.schema(
+            list(schema) + [pyarrow.field('file.' + filename,
+                                          pyarrow.binary())
+                            for filename in attachments])
+
+    pool = ThreadPool(parallelism) if len(attachments) > 0 else None
+    try:
+        with ColumnarWriter(path, file_format, schema=schema) as writer:
+            for tasks in pages:
+                _write_tasks(writer, tasks, attachments,
+                             max_attachment_size, pool)
+            return writer.rows
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _pages(iterable, size):
+    """ Lists of at most size consecutive items of iterable. """
+    page = []
+    for item in iterable:
+        page.append(item)
+        if len(page) >= size:
+            yield page
+            page = []
+    if len(page) > 0:
+        yield page
+
+
+def _write_tasks(writer, tasks, attachments, max_attachment_size, pool):
+    """ Write tasks as a row group. """
+    rows = [task_row(task) for task in tasks]
+    if len(attachments) > 0:
+        _add_attachments(tasks, rows, attachments, max_attachment_size, pool)
+    writer.write(rows)
@@ -53,26 +53,56 @@ def run_task(task_properties, host, max_jobs, polling_time=None):
     return task, job
 
 
-def overview_total():
+def overview_total(task_db=None, job_db=None):
     """
     Overview of all tasks and jobs.
 
     Returns a dict with the numbers of each type of job and task.
+    @param task_db: task database; by default the configured one
+    @param job_db: job database; by default the configured one
     """
+    if task_db is None:
+        task_db = get_task_database()
+    if job_db is None:
+        job_db = get_job_database()
+
     views = ['pending', 'in_progress', 'error', 'done',
              'finished_jobs', 'running_jobs', 'pending_jobs']
     num = dict((view, 0) for view in views)
 
-    for view in get_task_database().view('overview_total', group=True):
+    for view in task_db.view('overview_total', group=True):
         num[view.key] = view.value
 
-    if get_job_database() is not get_task_database():
-        for view in get_job_database().view('overview_total', group=True):
+    if job_db is not task_db:
+        for view in job_db.view('overview_total', group=True):
             num[view.key] = view.value
 
     return num
 
 
+def timing_profile(ensemble=None):
+    """
+    Statistics of the time that finished tasks spent in each processing
+    phase, per ensemble.
+
+    @param ensemble: only include this ensemble; by default all ensembles
+        are included.
+    @return: dict of ensembles with a dict of phases, with for each phase a
+        dict with the count, sum, min, max and mean duration in ms.
+    """
+    params = {'group_level': 2}
+    if ensemble is not None:
+        params['startkey'] = [ensemble]
+        params['endkey'] = [ensemble, {}]
+
+    profile = {}
+    for row in get_task_database().view('timing', **params):
+        stats = dict(row.value)
+        stats['mean'] = stats['sum'] / float(max(stats['count'], 1))
+        profile.setdefault(row.key[0], {})[row.key[1]] = stats
+    return profile
+
+
 def submit_if_needed(host_id, max_jobs, adaptor=None):
     """
     Submit a new job if not enough jobs are already running or queued.
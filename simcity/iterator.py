@@ -17,7 +17,9 @@
 """ Iterators to iterate over a CouchDB database. """
 
 from .document import Task
+from .util import seconds
 from couchdb.http import ResourceConflict
+import random
 import time
 
 
@@ -26,9 +28,10 @@ class ViewIterator(object):
     Dummy class to show what to implement for an iterator.
     """
 
-    def __init__(self, job_id):
+    def __init__(self, job_id, lease=None):
         self._stop = False
         self.job_id = job_id
+        self.lease = lease
 
     def __iter__(self):
         """Python needs this."""
@@ -74,13 +77,31 @@ class ViewIterator(object):
         raise NotImplementedError("claim_task function not implemented.")
 
 
-def _claim_task(job_id, database, view, allowed_failures=10, **view_params):
+def _claim_task(job_id, database, view, allowed_failures=10, lease=None,
+                **view_params):
     for _ in range(allowed_failures):
         try:
             doc = database.get_single_from_view(view, window_size=100,
                                                 **view_params)
             task = Task(doc)
-            return database.save(task.lock(job_id))
+            return database.save(task.lock(job_id, lease))
+        except ResourceConflict:
+            pass
+    raise EnvironmentError("Unable to claim task.")
+
+
+def _claim_expired_task(job_id, database, lease, view='leases',
+                        allowed_failures=10):
+    """ Claim a task of which the lease has expired, for example because the
+    job processing it has crashed. """
+    for _ in range(allowed_failures):
+        try:
+            doc = database.get_single_from_view(view, window_size=100,
+                                                endkey=seconds())
+            task = Task(doc)
+            if not task.lease_expired():
+                continue  # renewed or finished since the view was read
+            return database.save(task.scrub().lock(job_id, lease))
         except ResourceConflict:
             pass
     raise EnvironmentError("Unable to claim task.")
@@ -90,21 +111,93 @@ class TaskViewIterator(ViewIterator):
 
     """Iterator object to fetch tasks while available.
     """
-    def __init__(self, job_id, database, view, **view_params):
+    def __init__(self, job_id, database, view, lease=None, **view_params):
         """
         @param database: CouchDB database to get tasks from.
         @param view: CouchDB view from which to fetch the task.
+        @param lease: number of seconds that a claimed task is leased, or None
+            to claim tasks without a lease. If set, tasks of which the lease
+            has expired are claimed when the view is empty.
+        @param view_params: parameters which need to be passed on to the view
+        (optional). With the mango query backend of the database, a selector
+        parameter only claims matching tasks, for example
+        selector={'ensemble': 'myensemble'}.
+        """
+        super(TaskViewIterator, self).__init__(job_id, lease)
+        self.database = database
+        self.view = view
+        self.view_params = view_params
+
+    def claim_task(self):
+        try:
+            return _claim_task(self.job_id, self.database, self.view,
+                               lease=self.lease, **self.view_params)
+        except IndexError:
+            if self.lease is None:
+                raise
+            return _claim_expired_task(self.job_id, self.database,
+                                       self.lease)
+
+
+def _claim_priority_task(job_id, database, view, window_size=100,
+                         allowed_failures=10, lease=None, **view_params):
+    for _ in range(allowed_failures):
+        rows = list(database.view(view, limit=window_size, **view_params))
+        # the view is sorted on [-priority, created]: only consider the tasks
+        # with the highest priority in the window.
+        top_priority = rows[0].key[0] if len(rows) > 0 else None
+        row = random.choice([r for r in rows if r.key[0] == top_priority])
+        try:
+            task = Task(database.get(row.id))
+            if task['lock'] != 0:
+                continue  # claimed since the view was read
+            return database.save(task.lock(job_id, lease))
+        except (ResourceConflict, ValueError):
+            pass
+    raise EnvironmentError("Unable to claim task.")
+
+
+class PriorityViewIterator(ViewIterator):
+    """
+    Iterator object to fetch tasks in order of their numeric priority.
+
+    Tasks are read from a view that is keyed by [-priority, created], so that
+    the first rows contain the highest priority tasks. To reduce contention,
+    a random task is chosen among the tasks with the highest priority in the
+    first window_size rows of the view. Tasks with a lower priority are only
+    claimed if no tasks with a higher priority are available.
+    """
+
+    def __init__(self, job_id, database, view='pending_by_priority',
+                 window_size=100, lease=None, **view_params):
+        """
+        @param database: CouchDB database to get tasks from.
+        @param view: CouchDB view from which to fetch the task, with keys
+                     [-priority, created].
+        @param window_size: number of rows to choose a task from.
+        @param lease: number of seconds that a claimed task is leased, or None
+            to claim tasks without a lease. If set, tasks of which the lease
+            has expired are claimed when the view is empty.
         @param view_params: parameters which need to be passed on to the view
         (optional).
         """
-        super(TaskViewIterator, self).__init__(job_id)
+        super(PriorityViewIterator, self).__init__(job_id, lease)
         self.database = database
         self.view = view
+        self.window_size = window_size
         self.view_params = view_params
 
     def claim_task(self):
-        return _claim_task(self.job_id, self.database, self.view,
-                           **self.view_params)
+        try:
+            return _claim_priority_task(
+                self.job_id, self.database, self.view,
+                window_size=self.window_size, lease=self.lease,
+                **self.view_params)
+        except IndexError:
+            if self.lease is None:
+                raise
+            return _claim_expired_task(self.job_id, self.database,
+                                       self.lease)
 
 
 class PrioritizedViewIterator(ViewIterator):
@@ -132,8 +225,8 @@ class PrioritizedViewIterator(ViewIterator):
 
     def claim_task(self):
         try:
-            return _claim_task(self.database, self.high_priority_view,
-                               **self.view_params)
+            return _claim_task(self.job_id, self.database,
+                               self.high_priority_view, **self.view_params)
         except IndexError:
             # don't catch the second IndexError:
             # if both views are empty, fail.
@@ -156,7 +249,8 @@ class EndlessViewIterator(ViewIterator):
                               iterator should stop feeding tasks
         @param stop_callback_args: arguments to the stop_callback function.
         """
-        super(EndlessViewIterator, self).__init__(job_id)
+        super(EndlessViewIterator, self).__init__(
+            job_id, getattr(view_iterator, 'lease', None))
         self.iterator = view_iterator
         self.sleep_sec = sleep_sec
         self.stop_callback = stop_callback
@@ -0,0 +1,308 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synthetic load to size a deployment: many generated tasks processed by
+simulated jobs on a single machine.
+"""
+
+from __future__ import print_function
+from .actors import JobActor
+from .config import Config
+from .document import Job, Task
+from .iterator import TaskViewIterator
+from .worker import ExecuteWorker
+from couchdb.http import ResourceConflict
+from multiprocessing import Process, Value
+from threading import Thread
+from uuid import uuid4
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+def parse_distribution(spec):
+    """
+    Parse a runtime distribution of the form name:arguments.
+
+    Supported are constant:SECONDS, uniform:LOW,HIGH, exponential:MEAN and
+    lognormal:MU,SIGMA.
+    @return: function that draws a value from a random.Random
+    @raise ValueError: if the specification is invalid
+    """
+    name, _, arguments = spec.partition(':')
+    try:
+        args = [float(arg) for arg in arguments.split(',') if arg]
+    except ValueError:
+        raise ValueError('Invalid distribution arguments in ' + spec)
+
+    distributions = {
+        'constant': (1, lambda rnd: args[0]),
+        'uniform': (2, lambda rnd: rnd.uniform(args[0], args[1])),
+        'exponential': (1, lambda rnd: rnd.expovariate(1.0 / args[0])),
+        'lognormal': (2, lambda rnd: rnd.lognormvariate(args[0], args[1])),
+    }
+    try:
+        num_args, draw = distributions[name]
+    except KeyError:
+        raise ValueError('Distribution {0} is not one of {1}'.format(
+            name, ', '.join(sorted(distributions))))
+    if len(args) != num_args:
+        raise ValueError('Distribution {0} needs {1} arguments'
+                         .format(name, num_args))
+    return draw
+
+
+def create_tasks(database, number, ensemble, input_size=0,
+                 runtime='constant:0', output_files=0, output_size=0,
+                 seed=None, batch_size=1000):
+    """
+    Add synthetic tasks to the database.
+    @param ensemble: ensemble name, to find the tasks back
+    @param input_size: bytes of padding in the input of each task
+    @param runtime: distribution of the number of seconds each task sleeps,
+        see parse_distribution
+    @param output_files: number of output files per task
+    @param output_size: bytes per output file
+    @return: list of task IDs
+    """
+    draw = parse_distribution(runtime)
+    rnd = random.Random(seed)
+    ids = []
+    batch = []
+    for i in range(number):
+        task = Task({
+            '_id': '{0}_{1:08d}'.format(ensemble, i),
+            'command': 'loadtest',
+            'ensemble': ensemble,
+            'input': {
+                'runtime': max(0.0, draw(rnd)),
+                'output_files': output_files,
+                'output_size': output_size,
+                'padding': 'x' * input_size,
+            },
+        })
+        batch.append(task)
+        ids.append(task.id)
+        if len(batch) >= batch_size:
+            database.save_documents(batch)
+            batch = []
+    if batch:
+        database.save_documents(batch)
+    return ids
+
+
+class LoadWorker(ExecuteWorker):
+    """
+    Worker that simulates a task: it sleeps for the runtime in the task
+    input and writes its output files, which are then uploaded as usual.
+    """
+    def execute_task(self, task, dirs, out_file, err_file):
+        task['execute_properties'] = {'loadtest': True}
+        block = b'x' * min(task.input['output_size'], 1024 * 1024)
+        for i in range(task.input['output_files']):
+            path = os.path.join(dirs['SIMCITY_OUT'], 'out{0}.dat'.format(i))
+            with open(path, 'wb') as f:
+                remaining = task.input['output_size']
+                while remaining > 0:
+                    f.write(block[:remaining])
+                    remaining -= len(block)
+        time.sleep(task.input['runtime'])
+        return 0
+
+
+class ConflictCounter(object):
+    """
+    Database wrapper that counts the update conflicts of save, in a value
+    that is shared with forked processes.
+    """
+    def __init__(self, database, conflicts=None):
+        self.database = database
+        if conflicts is None:
+            conflicts = Value('i', 0)
+        self.conflicts = conflicts
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def copy(self):
+        return ConflictCounter(self.database.copy(), self.conflicts)
+
+    def save(self, doc):
+        try:
+            return self.database.save(doc)
+        except ResourceConflict:
+            with self.conflicts.get_lock():
+                self.conflicts.value += 1
+            raise
+
+
+class LoadJobActor(JobActor):
+    """ JobActor of a simulated job, with its own job ID. """
+    def __init__(self, job_id, *args, **kwargs):
+        self.job_id = job_id
+        super(LoadJobActor, self).__init__(*args, **kwargs)
+
+    def prepare_env(self):
+        job = Job({'_id': self.job_id, 'parallelism': self.parallelism})
+        self.job = self.job_db.save(job.start())
+
+
+class LoadIterator(TaskViewIterator):
+    """ Iterator that keeps trying to claim a pending task, however high the
+    contention between the simulated jobs is. """
+    def claim_task(self):
+        while True:
+            try:
+                return super(LoadIterator, self).claim_task()
+            except EnvironmentError:
+                pass
+
+
+def run_job(job_id, database, config, workers):
+    """ Process tasks as a simulated job until none are pending. """
+    database = database.copy()
+    iterator = LoadIterator(job_id, database, 'pending')
+    actor = LoadJobActor(job_id, iterator, LoadWorker, task_db=database,
+                         job_db=database, parallelism=workers,
+                         config=config)
+    actor.run()
+
+
+def percentile(values, fraction):
+    """ Value at given fraction of the sorted values, or None. """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def collect_results(database, ids, elapsed, conflicts):
+    """ Summarize the processed tasks. """
+    latencies = []
+    claims = []
+    done = errors = 0
+    for task_id in ids:
+        task = Task(database.get(task_id))
+        if task.has_error():
+            errors += 1
+        elif task['done'] > 0:
+            done += 1
+        timing = task.get('timing', {})
+        if timing:
+            latencies.append(sum(timing.values()))
+            claims.append(timing.get('claim', 0))
+
+    return {
+        'tasks': len(ids),
+        'done': done,
+        'errors': errors,
+        'seconds': elapsed,
+        'throughput': done / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': dict(
+            ('p{0}'.format(p), percentile(latencies, p / 100.0))
+            for p in (50, 95, 99)),
+        'claim_ms': dict(
+            ('p{0}'.format(p), percentile(claims, p / 100.0))
+            for p in (50, 95, 99)),
+        'conflicts': conflicts,
+    }
+
+
+def loadtest(database, tasks=1000, jobs=4, workers=1, processes=False,
+             input_size=0, runtime='constant:0', output_files=0,
+             output_size=0, seed=None, keep=False):
+    """
+    Create synthetic tasks and process them with simulated jobs.
+
+    Each job is a JobActor with a worker that sleeps for the runtime of
+    the task and writes its output files. The jobs run as threads, or as
+    processes if processes is True. The latency of a task is the sum of its
+    phase timings, from claiming it to handing it to the collector.
+    @param database: task database, for example a simcity.CouchDB or a
+        MemoryDB shared with simcity.memorydb.shared_memory_db
+    @param tasks: number of tasks
+    @param jobs: number of simulated jobs
+    @param workers: number of worker processes per job
+    @param keep: keep the tasks and jobs in the database afterwards
+    @return: dict with the number of tasks, done and errors, elapsed
+        seconds, throughput in tasks per second, latency and claim time
+        percentiles in ms and the number of update conflicts.
+    """
+    ensemble = 'loadtest_' + uuid4().hex[:8]
+    ids = create_tasks(database, tasks, ensemble, input_size=input_size,
+                       runtime=runtime, output_files=output_files,
+                       output_size=output_size, seed=seed)
+    job_ids = ['{0}_job{1}'.format(ensemble, i) for i in range(jobs)]
+    counter = ConflictCounter(database)
+
+    directory = tempfile.mkdtemp(prefix='simcity-loadtest')
+    try:
+        runners = []
+        for job_id in job_ids:
+            job_dir = os.path.join(directory, job_id)
+            config = Config()
+            config.add_section('Execution', {
+                'tmp_dir': os.path.join(job_dir, 'tmp'),
+                'input_dir': os.path.join(job_dir, 'in'),
+                'output_dir': os.path.join(job_dir, 'out'),
+            })
+            os.makedirs(job_dir)
+            runner_cls = Process if processes else Thread
+            runners.append(runner_cls(
+                target=run_job, args=(job_id, counter, config, workers)))
+
+        start = time.time()
+        for runner in runners:
+            runner.start()
+        for runner in runners:
+            runner.join()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = collect_results(database, ids, elapsed,
+                              counter.conflicts.value)
+    if not keep:
+        docs = []
+        for doc_id in ids + job_ids:
+            try:
+                docs.append(database.get(doc_id))
+            except ValueError:
+                pass
+        database.delete_documents(docs)
+    return results
+
+
+def format_results(results):
+    """ Text report of loadtest results. """
+    def fmt(value):
+        return '-' if value is None else str(value)
+
+    lines = [
+        'tasks:       {0} ({1} done, {2} errors)'.format(
+            results['tasks'], results['done'], results['errors']),
+        'duration:    {0:.1f} s'.format(results['seconds']),
+        'throughput:  {0:.2f} tasks/s'.format(results['throughput']),
+        'latency ms:  p50 {0}  p95 {1}  p99 {2}'.format(
+            *[fmt(results['latency_ms'][p]) for p in ('p50', 'p95', 'p99')]),
+        'claim ms:    p50 {0}  p95 {1}  p99 {2}'.format(
+            *[fmt(results['claim_ms'][p]) for p in ('p50', 'p95', 'p99')]),
+        'conflicts:   {0}'.format(results['conflicts']),
+    ]
+    return '\n'.join(lines)
@@ -19,13 +19,14 @@ Initialize SIM-CITY variables and databases based on the SIM-CITY configuration
 file.
 """
 
-from .util import get_truthy
+from .util import get_truthy, Timer
 from .config import Config, FileConfig, CouchDBConfig
-from .database import CouchDB
+from .database import (CouchDB, design_document, MANGO_VIEWS,
+                       MONITOR_DESIGN_DOC, VIEW_DESIGN_DOCS)
 from .document import User
 from .dav import RestRequests
+from threading import Event, Thread
 import couchdb
-import pystache
 
 import os
 
@@ -110,6 +111,17 @@ def uses_webdav():
                 get_truthy(dav_cfg.get('enabled', True)))
 
 
+def uses_content_addressing():
+    """ Whether webdav files are stored once per unique content, under their
+    SHA-256 digest. """
+    try:
+        dav_cfg = get_config().section('webdav')
+    except (EnvironmentError, KeyError):
+        return False
+    else:
+        return get_truthy(dav_cfg.get('content_addressed', False))
+
+
 def get_webdav(process=None):
     """ Gets or creates a webdav connection.
 
@@ -161,9 +173,9 @@ def init(config, job_id=None):
         _config = config
     else:
         _config = Config()
-        _config.configurators.append(FileConfig(config))
+        _config.add_configurator(FileConfig(config))
         try:
-            _config.configurators.append(load_config_database(_config))
+            _config.add_configurator(load_config_database(_config))
         except KeyError:
             print("WARN: SIM-CITY configuration database not set. "
                   "Skipping.")
@@ -186,8 +198,9 @@ def load_config_database(config):
             url, db, user, password)
     except KeyError:
         cfg = config.section('config-db')
-        return CouchDBConfig.from_url(cfg['url'], cfg['db'],
-                                      cfg.get('user'), cfg.get('password'))
+        return CouchDBConfig.from_url(
+            cfg['url'], cfg['db'], cfg.get('user'), cfg.get('password'),
+            refresh_interval=cfg.get('refresh_interval', 60))
 
 
 def create(admin_user, admin_password):
@@ -288,10 +301,25 @@ def _create_user(cfg, admin_user, admin_password):
     users.save(User(cfg['username'], cfg['password']))
 
 
-def create_views():
+def create_views(warm=False):
     """
     Create views necessary to run simcity client with.
+
+    The views that jobs use to claim tasks, the reporting views and the job
+    views are kept in separate design documents (see
+    simcity.database.VIEW_DESIGN_DOCS), because every change of a design
+    document rebuilds all of its indexes. Each design document is written
+    in a single update, and only if it changed. Views that earlier versions
+    stored in the Monitor design document are removed from it after their
+    new design document is written. Databases with the mango query backend
+    get the Mango indexes instead of the map views of
+    simcity.database.MANGO_VIEWS; the indexes are built on their first
+    query.
+    @param warm: build the indexes right away, printing the progress.
+        Otherwise they are built on first use.
     """
+    import pystache  # only needed here, so not imported with simcity
+
     task_map_template = '''
     function(doc) {
       if(doc.type === 'task' && {{condition}}) {
@@ -302,6 +330,47 @@ def create_views():
       }
     }
         '''
+    priority_map_code = '''
+    function(doc) {
+      if (doc.type === 'task' && doc.lock === 0) {
+        var priority = doc.priority;
+        if (priority === 'high') {
+          priority = 1;
+        } else if (typeof priority !== 'number') {
+          priority = Number(priority) || 0;
+        }
+        emit([-priority, doc.created || 0], {
+            lock: doc.lock,
+            done: doc.done,
+            priority: priority,
+        });
+      }
+    }
+        '''
+    lease_map_code = '''
+    function(doc) {
+      if (doc.type === 'task' && doc.lock > 0 && doc.done === 0 &&
+          doc.lease_until > 0) {
+        emit(doc.lease_until, {
+            lock: doc.lock,
+            done: doc.done,
+        });
+      }
+    }
+        '''
+    timing_map_code = '''
+    function(doc) {
+      if (doc.type === 'task' && doc.done !== 0 && doc.timing) {
+        var ensemble = doc.ensemble;
+        if (ensemble === undefined || ensemble === null) {
+          ensemble = (doc.input && doc.input.ensemble) || '';
+        }
+        for (var phase in doc.timing) {
+          emit([ensemble, phase], doc.timing[phase]);
+        }
+      }
+    }
+        '''
     erroneous_map_code = '''
     function(doc) {
       if (doc.type === 'task' && doc.lock == -1) {
@@ -368,22 +437,105 @@ def create_views():
     }
     renderer = pystache.Renderer(escape=lambda u: u)
 
+    task_views = {}
+    job_views = {}
     for view in pystache_views['tasks']:
         map_code = renderer.render(task_map_template, view)
-        _task_db.add_view(view['name'], map_code)
+        task_views[view['name']] = {'map': map_code}
 
     for view in pystache_views['jobs']:
         map_code = renderer.render(job_map_template, view)
-        _job_db.add_view(view['name'], map_code)
-
-    _task_db.add_view('error', erroneous_map_code)
+        job_views[view['name']] = {'map': map_code}
+
+    task_views['error'] = {'map': erroneous_map_code}
+    # pending tasks ordered by descending priority, then by creation time
+    task_views['pending_by_priority'] = {'map': priority_map_code}
+    # in progress tasks by lease expiry time; query with endkey=now to get
+    # the tasks with an expired lease
+    task_views['leases'] = {'map': lease_map_code}
+    # statistics of the phase timings of finished tasks, keyed by
+    # [ensemble, phase]
+    task_views['timing'] = {'map': timing_map_code, 'reduce': '_stats'}
 
     # overview_total View -- lists all views and the number of tasks in each
     # view
     overview_map_code = renderer.render(overview_map_template, pystache_views)
-    _task_db.add_view('overview_total', overview_map_code,
-                      overview_reduce_code)
-    _job_db.add_view('overview_total', overview_map_code, overview_reduce_code)
+    overview = {'map': overview_map_code, 'reduce': overview_reduce_code}
+    task_views['overview_total'] = overview
+    job_views['overview_total'] = overview
+
+    if _job_db is _task_db:
+        task_views.update(job_views)
+        databases = [('task and job', _task_db, task_views)]
+    else:
+        databases = [('task', _task_db, task_views),
+                     ('job', _job_db, job_views)]
+
+    for name, database, views in databases:
+        mango = getattr(database, 'query_backend', 'view') == 'mango'
+        design_docs = {}
+        for view, definition in views.items():
+            design_docs.setdefault(design_document(view), {})[view] = \
+                definition
+        # update the Monitor design document last, so that the moved views
+        # remain available until their new design document exists
+        for design_doc in sorted(design_docs,
+                                 key=lambda d: (d == MONITOR_DESIGN_DOC, d)):
+            if design_doc == MONITOR_DESIGN_DOC:
+                remove = set(VIEW_DESIGN_DOCS)
+            else:
+                remove = set()
+            design_views = design_docs[design_doc]
+            if mango:
+                # the Mango indexes replace these map views, which would
+                # otherwise still be indexed on each query of their design
+                # document
+                remove |= set(design_views) & set(MANGO_VIEWS)
+                design_views = dict(
+                    (view, definition)
+                    for view, definition in design_views.items()
+                    if view not in MANGO_VIEWS)
+            if database.update_design_document(
+                    design_doc, design_views, remove=sorted(remove)):
+                print("Updated the {0} views of the {1} database"
+                      .format(design_doc, name))
+            if warm:
+                warm_views(database, design_doc, sorted(design_views))
+        if mango:
+            created = database.create_indexes()
+            if created:
+                print("Created the Mango indexes {0} of the {1} database"
+                      .format(', '.join(created), name))
+
+
+def warm_views(database, design_doc, views, interval=10):
+    """
+    Build the indexes of views by querying each of them once, printing the
+    progress every interval seconds.
+    """
+    for view in views:
+        print("Building index of view {0}/{1}...".format(design_doc, view))
+        timer = Timer()
+        done = Event()
+        reporter = Thread(target=_report_indexing,
+                          args=(database, design_doc, done, interval))
+        reporter.daemon = True
+        reporter.start()
+        try:
+            list(database.view(view, design_doc=design_doc, limit=0))
+        finally:
+            done.set()
+            reporter.join()
+        print("Index of view {0}/{1} is ready after {2:.1f} s"
+              .format(design_doc, view, timer.elapsed()))
+
+
+def _report_indexing(database, design_doc, done, interval):
+    """ Print the indexing progress of a design document until done. """
+    while not done.wait(interval):
+        progress = database.indexing_progress(design_doc)
+        if progress is not None:
+            print("  {0:.0f}% indexed".format(progress))
 
 
 def _init_databases():
@@ -429,7 +581,8 @@ def _load_database(name, admin_user=None, admin_password=""):
             username=user,
             password=password,
             ssl_verification=get_truthy(cfg.get('ssl_verification', False)),
-            create=do_create)
+            create=do_create,
+            query_backend=cfg.get('query_backend', 'view'))
     except IOError as ex:
         raise IOError("Cannot establish connection with %s CouchDB <%s>: %s" %
                       (name, cfg['url'], str(ex)))
@@ -0,0 +1,734 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory stand-in for a CouchDB database, for benchmarks and tests.
+
+It has the same interface as simcity.CouchDB, with document revisions and
+conflicts. Views are Python functions instead of JavaScript; the views of
+simcity.create_views are predefined. A MemoryDB is only shared between
+threads; use shared_memory_db to share one between processes.
+"""
+
+from .database import (design_document, find_rows, MANGO_VIEWS,
+                       MONITOR_DESIGN_DOC, QUERY_BACKENDS)
+from .document import Document
+from couchdb.http import ResourceConflict
+from multiprocessing.managers import BaseManager, BaseProxy
+from numbers import Number
+from threading import Condition, RLock
+from uuid import uuid4
+import copy
+import random
+
+
+class Row(object):
+    """ Row of a view. """
+    def __init__(self, id, key, value, doc=None):
+        self.id = id
+        self.key = key
+        self.value = value
+        self.doc = doc
+
+    def __repr__(self):
+        return '<Row id={0!r} key={1!r} value={2!r}>'.format(
+            self.id, self.key, self.value)
+
+
+def _task_status_view(condition):
+    def map_fun(doc):
+        if doc.get('type') == 'task' and condition(doc):
+            yield doc['_id'], {'lock': doc.get('lock'),
+                               'done': doc.get('done')}
+    return map_fun
+
+
+def _job_status_view(condition):
+    def map_fun(doc):
+        if doc.get('type') == 'job' and condition(doc):
+            yield doc['_id'], {'queue': doc.get('queue'),
+                               'start': doc.get('start'),
+                               'done': doc.get('done')}
+    return map_fun
+
+
+TASK_CONDITIONS = {
+    'pending': lambda doc: doc.get('lock') == 0,
+    'pending_priority': lambda doc: (doc.get('lock') == 0 and
+                                     doc.get('priority') == 'high'),
+    'in_progress': lambda doc: (doc.get('lock', 0) > 0 and
+                                doc.get('done') == 0),
+    'done': lambda doc: doc.get('lock', 0) > 0 and doc.get('done', 0) > 0,
+}
+
+JOB_CONDITIONS = {
+    'pending_jobs': lambda doc: (doc.get('start') == 0 and
+                                 doc.get('archive') == 0),
+    'running_jobs': lambda doc: (doc.get('start', 0) > 0 and
+                                 doc.get('done') == 0 and
+                                 doc.get('archive') == 0),
+    'finished_jobs': lambda doc: doc.get('done', 0) > 0,
+    'archived_jobs': lambda doc: doc.get('archive', 0) > 0,
+    'active_jobs': lambda doc: not doc.get('archive'),
+}
+
+
+def _error_map(doc):
+    if doc.get('type') == 'task' and doc.get('lock') == -1:
+        yield doc['_id'], doc.get('error')
+
+
+def _priority_map(doc):
+    if doc.get('type') == 'task' and doc.get('lock') == 0:
+        priority = doc.get('priority')
+        if priority == 'high':
+            priority = 1
+        elif not isinstance(priority, Number):
+            try:
+                priority = float(priority)
+            except (TypeError, ValueError):
+                priority = 0
+        yield ([-priority, doc.get('created') or 0],
+               {'lock': doc['lock'], 'done': doc.get('done'),
+                'priority': priority})
+
+
+def _lease_map(doc):
+    if (doc.get('type') == 'task' and doc.get('lock', 0) > 0 and
+            doc.get('done') == 0 and doc.get('lease_until', 0) > 0):
+        yield doc['lease_until'], {'lock': doc['lock'],
+                                   'done': doc['done']}
+
+
+def _timing_map(doc):
+    if (doc.get('type') == 'task' and doc.get('done', 0) != 0 and
+            doc.get('timing')):
+        ensemble = doc.get('ensemble')
+        if ensemble is None:
+            ensemble = doc.get('input', {}).get('ensemble') or ''
+        for phase, ms in doc['timing'].items():
+            yield [ensemble, phase], ms
+
+
+def _overview_map(doc):
+    if doc.get('type') == 'task':
+        for name, condition in TASK_CONDITIONS.items():
+            if condition(doc):
+                yield name, 1
+        if doc.get('lock') == -1:
+            yield 'error', 1
+    elif doc.get('type') == 'job':
+        for name, condition in JOB_CONDITIONS.items():
+            if condition(doc):
+                yield name, 1
+
+
+def monitor_views():
+    """ Python versions of the views of simcity.create_views, as a dict of
+    view names with (map function, reduce) tuples. """
+    views = {}
+    for name, condition in TASK_CONDITIONS.items():
+        views[name] = (_task_status_view(condition), None)
+    for name, condition in JOB_CONDITIONS.items():
+        views[name] = (_job_status_view(condition), None)
+    views['error'] = (_error_map, None)
+    views['pending_by_priority'] = (_priority_map, None)
+    views['leases'] = (_lease_map, None)
+    views['timing'] = (_timing_map, '_stats')
+    views['overview_total'] = (_overview_map, '_sum')
+    return views
+
+
+def collation_key(value):
+    """ Sort key that orders JSON values like CouchDB does. """
+    if value is None:
+        return (0,)
+    elif isinstance(value, bool):
+        return (1, value)
+    elif isinstance(value, Number):
+        return (2, value)
+    elif isinstance(value, (list, tuple)):
+        return (4, tuple(collation_key(v) for v in value))
+    elif isinstance(value, dict):
+        return (5, tuple((collation_key(k), collation_key(v))
+                         for k, v in value.items()))
+    else:
+        return (3, value)
+
+
+def _reduce(reduce_fun, values):
+    if reduce_fun == '_count':
+        return len(values)
+    elif reduce_fun == '_sum':
+        return sum(values)
+    elif reduce_fun == '_stats':
+        return {'sum': sum(values), 'count': len(values),
+                'min': min(values), 'max': max(values),
+                'sumsqr': sum(v * v for v in values)}
+    else:
+        raise ValueError('Reduce function {0} is not supported'
+                         .format(reduce_fun))
+
+
+_MISSING = object()
+
+
+def mango_match(doc, selector):
+    """ Whether a document matches a Mango selector. Supported are the
+    $and, $or and $nor combinations, $not, and the $eq, $ne, $gt, $gte,
+    $lt, $lte, $in, $nin and $exists conditions on fields, which may be
+    nested with dots. Values are compared in CouchDB collation order. """
+    for field, condition in selector.items():
+        if field == '$and':
+            matches = all(mango_match(doc, sub) for sub in condition)
+        elif field == '$or':
+            matches = any(mango_match(doc, sub) for sub in condition)
+        elif field == '$nor':
+            matches = not any(mango_match(doc, sub) for sub in condition)
+        elif field == '$not':
+            matches = not mango_match(doc, condition)
+        else:
+            matches = _match_condition(_field_value(doc, field), condition)
+        if not matches:
+            return False
+    return True
+
+
+def _field_value(doc, field):
+    value = doc
+    for name in field.split('.'):
+        if not isinstance(value, dict) or name not in value:
+            return _MISSING
+        value = value[name]
+    return value
+
+
+def _match_condition(value, condition):
+    if not (isinstance(condition, dict) and len(condition) > 0 and
+            all(op.startswith('$') for op in condition)):
+        condition = {'$eq': condition}
+    for operator, argument in condition.items():
+        if operator == '$exists':
+            if (value is not _MISSING) != argument:
+                return False
+            continue
+        if value is _MISSING:
+            return False
+        key = collation_key(value)
+        if operator in ('$in', '$nin'):
+            found = key in [collation_key(arg) for arg in argument]
+            matches = found if operator == '$in' else not found
+        elif operator in _COMPARISONS:
+            matches = _COMPARISONS[operator](key, collation_key(argument))
+        else:
+            raise ValueError('Mango operator {0} is not supported'
+                             .format(operator))
+        if not matches:
+            return False
+    return True
+
+
+_COMPARISONS = {
+    '$eq': lambda a, b: a == b,
+    '$ne': lambda a, b: a != b,
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+
+class MemoryDB(object):
+    """ In-memory database with the interface of simcity.CouchDB. """
+
+    def __init__(self, url='memory://', db='test', views=None,
+                 query_backend='view'):
+        """
+        @param views: dict of view names with (map function, reduce) tuples,
+            where the map function yields (key, value) tuples for a document
+            and reduce is None, '_count', '_sum' or '_stats'. Defaults to
+            the views of simcity.create_views in their design documents,
+            see simcity.database.design_document. Views of other design
+            documents are named design_doc/view.
+        @param query_backend: 'view', or 'mango' to answer the views of
+            simcity.database.MANGO_VIEWS with find, like simcity.CouchDB.
+        """
+        if query_backend not in QUERY_BACKENDS:
+            raise ValueError('Query backend {0} is not one of {1}'
+                             .format(query_backend, ', '.join(QUERY_BACKENDS)))
+        self.query_backend = query_backend
+        self.url = url.rstrip('/') + '/' + db
+        self.docs = {}
+        self.views = monitor_views() if views is None else dict(views)
+        self.lock = RLock()
+        self.changed = Condition(self.lock)
+        self.seq = 0
+        self.seqs = {}
+
+    def copy(self):
+        """ The same database, since it is only shared between threads. """
+        return self
+
+    def __getitem__(self, idx):
+        return self.get(idx)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def get(self, id):
+        """ Copy of the document with given ID.
+        @raise ValueError: if the document does not exist """
+        try:
+            return Document(copy.deepcopy(self.docs[id]))
+        except KeyError:
+            raise ValueError(id + " is not a document ID in the database")
+
+    def all_ids(self, batch_size=10000):
+        """ Iterate over the IDs of all documents. """
+        with self.lock:
+            return iter(sorted(self.docs))
+
+    def save(self, doc):
+        """ Save a Document, updating its _id and _rev.
+        @raise couchdb.http.ResourceConflict: if the revision does not match
+        """
+        with self.lock:
+            doc_id = doc.get('_id')
+            if doc_id is None:
+                doc_id = uuid4().hex
+            current = self.docs.get(doc_id)
+            current_rev = None if current is None else current['_rev']
+            if doc.get('_rev') != current_rev:
+                raise ResourceConflict(
+                    ('conflict', 'Document update conflict.'))
+            number = 0 if current_rev is None else int(
+                current_rev.split('-')[0])
+            doc['_id'] = doc_id
+            doc['_rev'] = '{0}-{1}'.format(number + 1, uuid4().hex)
+            stored = copy.deepcopy(dict(doc))
+            self.docs[doc_id] = stored
+            self._changed(doc_id)
+        return doc
+
+    def _changed(self, doc_id):
+        """ Record a change of a document in the update sequence. The lock
+        must be held. """
+        self.seq += 1
+        self.seqs[doc_id] = self.seq
+        self.changed.notify_all()
+
+    def save_documents(self, docs):
+        """ Save a sequence of Documents.
+        @return: list of booleans indicating whether each save succeeded """
+        result = []
+        for doc in docs:
+            try:
+                self.save(doc)
+                result.append(True)
+            except ResourceConflict:
+                result.append(False)
+        return result
+
+    def delete(self, doc):
+        """ Delete a Document with a current _rev.
+        @raise couchdb.http.ResourceConflict: if the revision does not match
+        """
+        with self.lock:
+            current = self.docs.get(doc.get('_id'))
+            if current is None or current['_rev'] != doc.get('_rev'):
+                raise ResourceConflict(
+                    ('conflict', 'Document update conflict.'))
+            del self.docs[doc['_id']]
+            self._changed(doc['_id'])
+
+    def delete_documents(self, docs):
+        """ Delete a sequence of Documents.
+        @return: list of booleans indicating whether each delete succeeded
+        """
+        result = []
+        for doc in docs:
+            try:
+                self.delete(doc)
+                result.append(True)
+            except ResourceConflict:
+                result.append(False)
+        return result
+
+    def changes(self, since='now', heartbeat=30000, include_docs=True,
+                **params):
+        """
+        Follow the changes of the database, like simcity.CouchDB.changes.
+        Only the latest change of each document is returned.
+        @param heartbeat: milliseconds to wait for new changes at a time
+        @return: iterator over change dicts with id, seq and optionally doc
+            and deleted keys; it does not end.
+        """
+        with self.lock:
+            seq = self.seq if since == 'now' else int(since)
+        return self._follow(seq, heartbeat / 1000.0, include_docs)
+
+    def _follow(self, seq, timeout, include_docs):
+        """ Generator of the changes after seq. """
+        while True:
+            with self.lock:
+                ids = sorted((doc_seq, doc_id)
+                             for doc_id, doc_seq in self.seqs.items()
+                             if doc_seq > seq)
+                if len(ids) == 0:
+                    self.changed.wait(timeout)
+                    continue
+                changes = []
+                for doc_seq, doc_id in ids:
+                    change = {'id': doc_id, 'seq': doc_seq}
+                    doc = self.docs.get(doc_id)
+                    if doc is None:
+                        change['deleted'] = True
+                        doc = {'_id': doc_id, '_deleted': True}
+                    if include_docs:
+                        change['doc'] = copy.deepcopy(doc)
+                    changes.append(change)
+                seq = ids[-1][0]
+            for change in changes:
+                yield change
+
+    def changes_since(self, since=None):
+        """
+        Documents changed since an update sequence, like
+        simcity.CouchDB.changes_since.
+        @return: tuple of the set of changed document IDs and the current
+            update sequence.
+        """
+        with self.lock:
+            if since is None:
+                return set(), self.seq
+            return (set(doc_id for doc_id, doc_seq in self.seqs.items()
+                        if doc_seq > since), self.seq)
+
+    def delete_from_view(self, view, design_doc="Monitor"):
+        """ Delete all documents in a view. """
+        return self.delete_documents(
+            self.get_from_view(view, design_doc=design_doc))
+
+    def add_view(self, view, map_fun, reduce_fun=None, design_doc="Monitor",
+                 *args, **kwargs):
+        """ Store a JavaScript view definition in its design document. Only
+        Python views given to the constructor or to add_python_view can be
+        queried. """
+        doc_id = '_design/' + design_document(view, design_doc)
+        with self.lock:
+            design = self.docs.setdefault(
+                doc_id, {'_id': doc_id, '_rev': '1-' + uuid4().hex,
+                         'language': 'javascript', 'views': {}})
+            definition = {'map': map_fun}
+            if reduce_fun is not None:
+                definition['reduce'] = reduce_fun
+            design['views'][view] = definition
+
+    def update_design_document(self, design_doc, views, remove=(),
+                               language='javascript'):
+        """ Store JavaScript view definitions in their design document and
+        remove the views named in remove.
+        @return: whether the design document changed """
+        doc_id = '_design/' + design_doc
+        with self.lock:
+            design = self.docs.get(doc_id, {'_id': doc_id,
+                                            'language': language,
+                                            'views': {}})
+            new_views = dict(design['views'])
+            for view, definition in views.items():
+                new_views[view] = dict(
+                    (key, value) for key, value in definition.items()
+                    if value is not None)
+            for view in remove:
+                new_views.pop(view, None)
+            if new_views == design['views']:
+                return False
+            self.save(dict(design, views=new_views))
+            return True
+
+    def indexing_progress(self, design_doc):
+        """ Views are computed on each query. """
+        return None
+
+    def find(self, selector, fields=None, sort=None, limit=None, skip=0,
+             bookmark=None, use_index=None):
+        """ Documents that match a Mango selector, see mango_match, in
+        order of their ID unless sorted otherwise. The bookmark is the
+        position of the next page.
+        @return: tuple of the list of documents and the bookmark """
+        with self.lock:
+            docs = [self.docs[doc_id] for doc_id in sorted(self.docs)
+                    if not doc_id.startswith('_design/') and
+                    mango_match(self.docs[doc_id], selector)]
+            for field in reversed(sort or []):
+                if isinstance(field, dict):
+                    field, direction = list(field.items())[0]
+                else:
+                    direction = 'asc'
+                docs.sort(key=lambda doc: collation_key(
+                    _field_value(doc, field)), reverse=direction == 'desc')
+            start = skip + (0 if bookmark is None else int(bookmark))
+            end = start + (25 if limit is None else limit)
+            docs = docs[start:end]
+            if fields is None:
+                docs = [copy.deepcopy(doc) for doc in docs]
+            else:
+                docs = [dict((field, copy.deepcopy(doc[field]))
+                             for field in fields if field in doc)
+                        for doc in docs]
+        return docs, str(start + len(docs))
+
+    def create_indexes(self):
+        """ Documents are matched on each query.
+        @return: empty list """
+        return []
+
+    def add_python_view(self, view, map_fun, reduce_fun=None,
+                        design_doc="Monitor"):
+        """ Add a view with a Python map function that yields (key, value)
+        tuples for a document. """
+        self.views[self._view_name(view, design_doc)] = (map_fun, reduce_fun)
+
+    @staticmethod
+    def _view_name(view, design_doc):
+        if design_doc in (MONITOR_DESIGN_DOC, design_document(view)):
+            return view
+        return design_doc + '/' + view
+
+    def view(self, view, design_doc="Monitor", **view_params):
+        """ Query a view, with the CouchDB view parameters. With the mango
+        query backend, the views of MANGO_VIEWS are queried with find.
+        @return: list of Row objects """
+        if (self.query_backend == 'mango' and view in MANGO_VIEWS and
+                design_doc == MONITOR_DESIGN_DOC):
+            return find_rows(self, view, **view_params)
+        return self._map_view(view, design_doc, **view_params)
+
+    def _map_view(self, view, design_doc, key=None, keys=None,
+                  startkey=None, endkey=None, limit=None, skip=0,
+                  descending=False, include_docs=False, reduce=True,
+                  group=False, group_level=None, inclusive_end=True,
+                  **view_params):
+        try:
+            map_fun, reduce_fun = self.views[
+                self._view_name(view, design_doc)]
+        except KeyError:
+            raise ValueError('View {0}/{1} is not defined as a Python view'
+                             .format(design_doc, view))
+
+        with self.lock:
+            docs = list(self.docs.values())
+        rows = []
+        for doc in docs:
+            if doc['_id'].startswith('_design/'):
+                continue
+            for row_key, value in map_fun(doc):
+                rows.append((collation_key(row_key), doc['_id'], row_key,
+                             value, doc))
+        rows.sort(key=lambda row: (row[0], row[1]))
+        if descending:
+            rows.reverse()
+
+        rows = [row for row in rows
+                if self._in_range(row[0], key, keys, startkey, endkey,
+                                  descending, inclusive_end)]
+
+        if reduce_fun is not None and reduce:
+            return self._reduced(rows, reduce_fun, group, group_level, skip,
+                                 limit)
+
+        rows = rows[skip:]
+        if limit is not None:
+            rows = rows[:limit]
+        return [Row(doc_id, row_key, value,
+                    Document(copy.deepcopy(doc)) if include_docs else None)
+                for _, doc_id, row_key, value, doc in rows]
+
+    @staticmethod
+    def _in_range(sort_key, key, keys, startkey, endkey, descending,
+                  inclusive_end):
+        if key is not None and sort_key != collation_key(key):
+            return False
+        if keys is not None and sort_key not in [collation_key(k)
+                                                 for k in keys]:
+            return False
+        low, high = (endkey, startkey) if descending else (startkey, endkey)
+        if low is not None and sort_key < collation_key(low):
+            return False
+        if high is not None:
+            high = collation_key(high)
+            if sort_key > high or (sort_key == high and not inclusive_end):
+                return False
+        return True
+
+    @staticmethod
+    def _reduced(rows, reduce_fun, group, group_level, skip, limit):
+        if group_level is None and not group:
+            if len(rows) == 0:
+                return []
+            return [Row(None, None,
+                        _reduce(reduce_fun, [row[3] for row in rows]))]
+
+        groups = []
+        for _, _, row_key, value, _ in rows:
+            if group_level is not None and isinstance(row_key, list):
+                row_key = row_key[:group_level]
+            if len(groups) > 0 and groups[-1][0] == row_key:
+                groups[-1][1].append(value)
+            else:
+                groups.append((row_key, [value]))
+        groups = groups[skip:]
+        if limit is not None:
+            groups = groups[:limit]
+        return [Row(None, row_key, _reduce(reduce_fun, values))
+                for row_key, values in groups]
+
+    def get_from_view(self, view, **view_params):
+        """ Documents of the rows of a view. """
+        result = []
+        for row in self.view(view, **view_params):
+            try:
+                result.append(self.get(row.id))
+            except ValueError:
+                pass  # doc was already deleted
+        return result
+
+    def get_single_from_view(self, view, window_size=1, **view_params):
+        """ A random document from the first window_size rows of a view.
+        @raise IndexError: if the view is empty """
+        row = random.choice(self.view(view, limit=window_size,
+                                      **view_params))
+        return self.get(row.id)
+
+    def set_users(self, admins=None, members=None, admin_roles=None,
+                  member_roles=None):
+        """ Users are not checked. """
+        pass
+
+
+class MemoryDBProxy(BaseProxy):
+    """ Proxy to a MemoryDB in a manager process, that updates the _id and
+    _rev of saved documents like simcity.CouchDB does. """
+    _exposed_ = ('get', 'save', 'delete', 'view', 'get_from_view',
+                 'get_single_from_view', 'add_view', 'update_design_document',
+                 'indexing_progress', 'find', 'create_indexes', 'all_ids',
+                 'set_users', 'changes_since',
+                 'delete_from_view', '__len__')
+
+    def copy(self):
+        return self
+
+    def __len__(self):
+        return self._callmethod('__len__')
+
+    def __getitem__(self, idx):
+        return self.get(idx)
+
+    def get(self, id):
+        return self._callmethod('get', (id,))
+
+    def all_ids(self, batch_size=10000):
+        return self._callmethod('all_ids')
+
+    def save(self, doc):
+        saved = self._callmethod('save', (doc,))
+        doc['_id'] = saved['_id']
+        doc['_rev'] = saved['_rev']
+        return doc
+
+    def save_documents(self, docs):
+        result = []
+        for doc in docs:
+            try:
+                self.save(doc)
+                result.append(True)
+            except ResourceConflict:
+                result.append(False)
+        return result
+
+    def delete(self, doc):
+        return self._callmethod('delete', (doc,))
+
+    def delete_documents(self, docs):
+        result = []
+        for doc in docs:
+            try:
+                self.delete(doc)
+                result.append(True)
+            except ResourceConflict:
+                result.append(False)
+        return result
+
+    def delete_from_view(self, view, design_doc="Monitor"):
+        return self._callmethod('delete_from_view', (view, design_doc))
+
+    def changes_since(self, since=None):
+        return self._callmethod('changes_since', (since,))
+
+    def view(self, view, **view_params):
+        return self._callmethod('view', (view,), view_params)
+
+    def get_from_view(self, view, **view_params):
+        return self._callmethod('get_from_view', (view,), view_params)
+
+    def get_single_from_view(self, view, window_size=1, **view_params):
+        view_params['window_size'] = window_size
+        return self._callmethod('get_single_from_view', (view,),
+                                view_params)
+
+    def add_view(self, view, map_fun, reduce_fun=None, design_doc="Monitor",
+                 *args, **kwargs):
+        return self._callmethod('add_view', (view, map_fun, reduce_fun,
+                                             design_doc))
+
+    def update_design_document(self, design_doc, views, remove=(),
+                               language='javascript'):
+        return self._callmethod('update_design_document',
+                                (design_doc, views, remove, language))
+
+    def indexing_progress(self, design_doc):
+        return None
+
+    def find(self, selector, **find_params):
+        return self._callmethod('find', (selector,), find_params)
+
+    def create_indexes(self):
+        return self._callmethod('create_indexes')
+
+    def set_users(self, admins=None, members=None, admin_roles=None,
+                  member_roles=None):
+        pass
+
+
+class MemoryDBManager(BaseManager):
+    """ Manager that serves MemoryDB objects to other processes. """
+    pass
+
+
+MemoryDBManager.register('MemoryDB', MemoryDB, proxytype=MemoryDBProxy)
+
+
+def shared_memory_db(**kwargs):
+    """
+    Start a MemoryDB in a separate manager process, so that it can be used
+    from multiple processes. Views are limited to the predefined simcity
+    views.
+    @return: tuple of the started MemoryDBManager, to shut down when done,
+        and a proxy to the MemoryDB.
+    """
+    manager = MemoryDBManager()
+    manager.start()
+    return manager, manager.MemoryDB(**kwargs)
@@ -0,0 +1,295 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Counters, gauges and histograms of a job, exported in the OpenMetrics text
+format to a file or over HTTP.
+"""
+
+from .util import Timer
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+import os
+import socket
+import tempfile
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# phase duration buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+CONTENT_TYPE = ('application/openmetrics-text; version=1.0.0; '
+                'charset=utf-8')
+
+HELP = {
+    'simcity_phase_seconds': 'Duration of the phases of processing a task',
+    'simcity_tasks': 'Processed tasks',
+    'simcity_save_conflicts': 'Conflicts when saving a task',
+    'simcity_upload_bytes': 'Bytes of output files uploaded',
+    'simcity_backlog_tasks': 'Claimed tasks waiting for resources',
+    'simcity_running_tasks': 'Tasks being processed',
+}
+
+
+class Metrics(object):
+    """
+    Registry of counters, gauges and histograms that can be updated from
+    multiple processes.
+
+    Each sample is identified by a metric name and its labels. Labels that
+    are the same for all samples, like the job and host, are only added when
+    rendering. A disabled registry ignores all updates, so that code can
+    record metrics without checking whether they are exported.
+    """
+    def __init__(self, manager=None, labels=None, enabled=True,
+                 buckets=DEFAULT_BUCKETS):
+        """
+        @param manager: multiprocessing.Manager to share the values with
+            other processes. If None, values are only kept in this process.
+        @param labels: dict of labels to add to all samples
+        @param enabled: whether to record updates at all
+        @param buckets: upper bounds of the histogram buckets in seconds
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.labels = dict(labels or {})
+        if manager is None:
+            self.values = {}
+            self.types = {}
+            self.lock = Lock()
+        else:
+            self.values = manager.dict()
+            self.types = manager.dict()
+            self.lock = manager.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """ Increase a counter. """
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            self.types[name] = 'counter'
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ Set a gauge. """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.types[name] = 'gauge'
+            self.values[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """ Add an observation to a histogram. """
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            self.types[name] = 'histogram'
+            counts = self.values.get(key)
+            if counts is None:
+                counts = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+            self.values[key] = counts
+
+    @contextmanager
+    def time(self, name, **labels):
+        """ Observe the duration of a block of code in a histogram. """
+        timer = Timer()
+        try:
+            yield
+        finally:
+            self.observe(name, timer.elapsed(), **labels)
+
+    def get(self, name, **labels):
+        """ Current value of a counter or gauge, or the bucket counts, sum
+        and count of a histogram. """
+        return self.values.get(_key(name, labels))
+
+    def render(self):
+        """ All samples in the OpenMetrics text format. """
+        with self.lock:
+            values = dict(self.values)
+            types = dict(self.types)
+
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            metric_type = types.get(name, 'unknown')
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            if name in HELP:
+                lines.append('# HELP {0} {1}'.format(name, HELP[name]))
+            for labels, value in sorted(by_name[name]):
+                labels = sorted(self.labels.items()) + list(labels)
+                if metric_type == 'histogram':
+                    lines.extend(self._render_histogram(name, labels, value))
+                elif metric_type == 'counter':
+                    lines.append(_sample(name + '_total', labels, value))
+                else:
+                    lines.append(_sample(name, labels, value))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, name, labels, counts):
+        for bound, count in zip(self.buckets, counts):
+            yield _sample(name + '_bucket', labels + [('le', repr(bound))],
+                          count)
+        yield _sample(name + '_bucket', labels + [('le', '+Inf')],
+                      counts[-1])
+        yield _sample(name + '_sum', labels, counts[-2])
+        yield _sample(name + '_count', labels, counts[-1])
+
+    def write_textfile(self, path):
+        """ Atomically write all samples to a file, for example for the
+        textfile collector of the Prometheus node exporter. """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+def task_command(task):
+    """ Command or entry point of a task, to label its metrics with. """
+    return task.get('entry_point') or task.get('command') or ''
+
+
+def _key(name, labels):
+    """ Hashable key of a sample. """
+    return name, tuple(sorted(labels.items()))
+
+
+def _sample(name, labels, value):
+    """ Single sample line. """
+    if len(labels) > 0:
+        name += '{' + ','.join(
+            '{0}="{1}"'.format(key, _escape(str(label_value)))
+            for key, label_value in labels) + '}'
+    return '{0} {1}'.format(name, value)
+
+
+def _escape(value):
+    """ Escape a label value. """
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class MetricsExporter(object):
+    """
+    Publishes the metrics of a job, by periodically writing a text file,
+    by serving them over HTTP at /metrics, or both.
+    """
+    def __init__(self, metrics, path=None, port=None, interval=15):
+        """
+        @param metrics: Metrics to export
+        @param path: file to write the metrics to, or None
+        @param port: port to serve the metrics on, or None
+        @param interval: seconds between writes of the file
+        """
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = float(interval)
+        self.stopped = Event()
+        self.writer = None
+        self.server = None
+
+    def start(self):
+        """ Start exporting in background threads. """
+        if self.path is not None:
+            self.writer = Thread(target=self._write_periodically)
+            self.writer.daemon = True
+            self.writer.start()
+
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', CONTENT_TYPE)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = HTTPServer(('', int(self.port)), Handler)
+            thread = Thread(target=self.server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+    def _write_periodically(self):
+        while True:
+            self._write()
+            if self.stopped.wait(self.interval):
+                return
+
+    def _write(self):
+        try:
+            self.metrics.write_textfile(self.path)
+        except (IOError, OSError) as ex:
+            print("Failed to write metrics to {0}: {1}".format(self.path, ex))
+
+    def stop(self):
+        """ Stop exporting, after writing the file a final time. """
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self._write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def job_metrics(config, manager):
+    """
+    Create the metrics of a job and their exporter, as configured in the
+    metrics_file, metrics_port and metrics_interval options of the Execution
+    configuration section.
+    @param config: Execution configuration section
+    @return: tuple of Metrics, disabled if no exporter is configured, and
+        MetricsExporter or None.
+    """
+    path = config.get('metrics_file')
+    port = config.get('metrics_port')
+    if path is None and port is None:
+        return Metrics(enabled=False), None
+
+    metrics = Metrics(manager, labels={'host': socket.gethostname()})
+    exporter = MetricsExporter(metrics, path=path, port=port,
+                               interval=config.get('metrics_interval', 15))
+    return metrics, exporter
@@ -0,0 +1,190 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Garbage collection of webdav files that no document refers to. """
+
+from .document import Task
+from .management import get_task_database, get_webdav
+from .task import _webdav_id_to_path
+from multiprocessing.pool import ThreadPool
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+    """
+    Set of strings with a fixed memory size, that may report false positives
+    but never false negatives.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        @param capacity: expected number of items
+        @param error_rate: probability of a false positive when the filter
+            contains capacity items
+        """
+        capacity = max(1, int(capacity))
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) /
+                                   math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(
+            self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        """ Bit positions of an item, using double hashing. """
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        h1, h2 = struct.unpack('<QQ', digest[:16])
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        """ Add a string to the filter. """
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+def find_orphans(database=None, dav=None, capacity=10000000,
+                 check_files=True):
+    """
+    Find webdav directories and files of documents that no longer exist,
+    and files of existing tasks that the task does not refer to.
+
+    All document IDs of the task database are streamed into a Bloom filter.
+    Then the two-level [hash]/[task_id] webdav tree and the content-addressed
+    cas/[prefix]/[digest] tree are listed, and every entry whose document is
+    not in the filter is confirmed to be missing by requesting the document
+    itself. Other webdav directories are not touched. Memory use depends
+    only on capacity, not on the number of documents or files.
+    @param capacity: expected maximum number of documents
+    @param check_files: also get each task that has a webdav directory, and
+        find the files in it that are not in its files, such as those left
+        by failed uploads. Tasks in progress are skipped, since they may
+        still be uploading.
+    @return: generator of webdav paths that can be deleted
+    """
+    if database is None:
+        database = get_task_database()
+    if dav is None:
+        dav = get_webdav()
+
+    ids = BloomFilter(capacity)
+    for doc_id in database.all_ids():
+        ids.add(doc_id)
+
+    for top in dav.list('', depth=1):
+        if not top['is_dir']:
+            continue
+        if top['path'] == 'cas':
+            for path, doc_id in _blob_candidates(dav):
+                if doc_id not in ids and not _exists(database, doc_id):
+                    yield path
+            continue
+
+        for path, task_id in _task_candidates(dav, top['path']):
+            if not check_files:
+                if task_id not in ids and not _exists(database, task_id):
+                    yield path
+                continue
+            try:
+                task = Task(database.get(task_id))
+            except ValueError:
+                yield path
+            else:
+                for file_path in _extra_files(dav, task, path):
+                    yield file_path
+
+
+def _task_candidates(dav, id_hash):
+    """ (path, task ID) of the task directories in a [hash] directory.
+    Entries that do not match the layout of _webdav_id_to_path are not
+    task directories and are skipped. """
+    for item in dav.list(id_hash, depth=1):
+        task_id = item['path'].split('/')[-1]
+        if item['is_dir'] and _webdav_id_to_path(task_id)[2] == id_hash:
+            yield item['path'], task_id
+
+
+def _extra_files(dav, task, task_dir):
+    """ Paths in the webdav directory of a task that are not in its files.
+    """
+    if task.get('lock', 0) > 0 and task.get('done', 0) == 0:
+        return
+    known = set()
+    for file_info in task.files.values():
+        try:
+            path = dav.url_to_path(file_info['url'])
+        except (KeyError, ValueError):
+            continue
+        known.add(path)
+        known.add(path + '.segments')
+    for item in dav.list(task_dir, depth=1):
+        if item['path'] not in known:
+            yield item['path']
+
+
+def _blob_candidates(dav):
+    """ (path, document ID) of all blobs in content-addressed storage. """
+    for prefix in dav.list('cas', depth=1):
+        for item in dav.list(prefix['path'], depth=1):
+            digest = item['path'].split('/')[-1]
+            if digest.endswith('.segments'):
+                digest = digest[:-len('.segments')]
+            yield item['path'], 'blob_' + digest
+
+
+def _exists(database, doc_id):
+    """ Whether a document exists in the database. """
+    try:
+        database.get(doc_id)
+        return True
+    except ValueError:
+        return False
+
+
+def delete_orphans(paths, dav=None, parallelism=8, batch_size=1000):
+    """
+    Delete webdav paths in parallel, in batches so that only batch_size
+    paths are kept in memory.
+    @param paths: iterable of paths, for example from find_orphans
+    @return: number of deleted paths
+    """
+    if dav is None:
+        dav = get_webdav()
+
+    def delete(path):
+        dav.delete(path, ignore_not_existing=True)
+
+    pool = ThreadPool(parallelism)
+    count = 0
+    try:
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) >= batch_size:
+                pool.map(delete, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            pool.map(delete, batch)
+            count += len(batch)
+    finally:
+        pool.close()
+        pool.join()
+    return count
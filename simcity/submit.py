@@ -24,11 +24,23 @@ import subprocess
 from uuid import uuid4
 
 try:
-    import xenon
-    from xenon import java
-    xenon_support = True
+    from importlib.util import find_spec
 except ImportError:
-    xenon_support = False
+    from pkgutil import find_loader as find_spec
+
+# xenon starts a Java virtual machine, so it is only imported by XenonAdaptor
+xenon = None
+java = None
+xenon_support = find_spec('xenon') is not None
+
+
+def _import_xenon():
+    """ Import xenon and its Java bridge into this module. """
+    global xenon, java
+    if xenon is None:
+        import xenon as xenon_module
+        from xenon import java as java_module
+        xenon, java = xenon_module, java_module
 
 
 def create_adaptor(host_id, host_cfg):
@@ -383,6 +395,7 @@ class XenonAdaptor(Adaptor):
                  properties=None):
         super(XenonAdaptor, self).__init__(database, host, prefix, jobdir,
                                            "xenon")
+        _import_xenon()
         try:
             xenon.init(log_level='INFO')
         except ValueError:
@@ -15,12 +15,25 @@
 # limitations under the License.
 
 """ Create and update tasks. """
-from .document import Task
-from .management import get_task_database, get_webdav
+from .cache import get_attachment_cache
+from .compression import (SUFFIXES, check_encoding, compress_file,
+                          decompress_data, decompress_file, is_compressible,
+                          zstandard)
+from .dav import segment_path
+from .document import Document, Task
+from .management import (get_config, get_task_database, get_webdav,
+                         uses_content_addressing)
 from .util import data_content_type, file_content_type
+from couchdb.http import ResourceConflict
+import hashlib
 import os
 import io
 
+# Largest attachment in bytes that is stored in the task database, if webdav
+# is not configured or unavailable. Larger attachments are not read into
+# memory.
+MAX_DATABASE_ATTACHMENT_SIZE = 64 * 1024 * 1024
+
 
 def add_task(properties, database=None):
     """
@@ -81,28 +94,207 @@ def _put_attachment(task, filename, f, length, content_type=None):
     try:
         dav = get_webdav()
     except EnvironmentError:
-        task.put_attachment(filename, f.read(), content_type)
+        _put_database_attachment(task, filename, f, length, content_type)
     else:
-        path, task_dir, id_hash = _webdav_id_to_path(task.id, filename)
+        encoding = _compression(content_type, length)
         try:
-            if len(task.files) == 0:
-                dav.mkdir(id_hash, ignore_existing=True)
-                dav.mkdir(task_dir, ignore_existing=True)
-
-            dav.put(path, f, content_type=content_type, content_length=length)
+            if encoding is None:
+                file_info = _put_dav_attachment(dav, task, filename, f, length,
+                                                content_type)
+            else:
+                compressed, compressed_length = compress_file(f, encoding)
+                try:
+                    file_info = _put_dav_attachment(
+                        dav, task, filename + SUFFIXES[encoding], compressed,
+                        compressed_length, 'application/' + encoding)
+                finally:
+                    compressed.close()
+                file_info['encoding'] = encoding
+                file_info['uncompressed_length'] = length
 
-            task.files[filename] = {
-                'url': dav.path_to_url(path),
-                'length': length,
-            }
             if content_type is not None:
-                task.files[filename]['content_type'] = content_type
+                file_info['content_type'] = content_type
+            task.files[filename] = file_info
 
         except IOError as ex:
             print(
                 'WARNING: attachment {0} could not be uploaded to webdav: {1}'
                 .format(filename, ex))
-            task.put_attachment(filename, f.read(), content_type)
+            f.seek(0)
+            _put_database_attachment(task, filename, f, length, content_type)
+
+
+def _put_dav_attachment(dav, task, filename, f, length, content_type=None):
+    """ Put an attachment file descriptor to webdav.
+    @return: file information for task.files
+    """
+    if uses_content_addressing():
+        return _put_blob(dav, f, length, content_type)
+
+    path, task_dir, id_hash = _webdav_id_to_path(task.id, filename)
+    if len(task.files) == 0:
+        dav.mkdir(id_hash, ignore_existing=True)
+        dav.mkdir(task_dir, ignore_existing=True)
+
+    file_info = {'url': dav.path_to_url(path), 'length': length}
+    file_info.update(_dav_put(dav, path, f, length, content_type))
+    return file_info
+
+
+def _compression(content_type, length):
+    """ Encoding to compress a file with before storing it on webdav, from
+    the compression and compression_min_size_kb settings of the webdav
+    configuration.
+    @return: 'gzip', 'zstd' or None if the file should not be compressed.
+    """
+    try:
+        dav_cfg = get_config().section('webdav')
+    except (EnvironmentError, KeyError):
+        return None
+
+    encoding = dav_cfg.get('compression', 'none')
+    if encoding == 'none' or not is_compressible(content_type):
+        return None
+    if length < float(dav_cfg.get('compression_min_size_kb', 64)) * 1024:
+        return None
+    if encoding == 'zstd' and zstandard is None:
+        encoding = 'gzip'
+    check_encoding(encoding)
+    return encoding
+
+
+def _put_database_attachment(task, filename, f, length, content_type=None):
+    """ Put an attachment in the task document, if it is small enough.
+    @raise IOError: if the file is larger than MAX_DATABASE_ATTACHMENT_SIZE.
+    """
+    if length > MAX_DATABASE_ATTACHMENT_SIZE:
+        raise IOError('Attachment {0} of {1} bytes is too large to store in '
+                      'the task database'.format(filename, length))
+    task.put_attachment(filename, f.read(), content_type)
+
+
+def _dav_put(dav, path, f, length, content_type=None):
+    """ Put a file to webdav, in segments if it is larger than the
+    segment_size_mb setting of the webdav configuration.
+    @return: dict with the number of segments and the segment size if the
+        file was segmented, an empty dict otherwise.
+    """
+    segment_size = _segment_size()
+    if segment_size is not None and length > segment_size:
+        segments = dav.put_segments(path, f, length, segment_size)
+        return {'segments': segments, 'segment_size': segment_size}
+    else:
+        dav.put(path, f, content_type=content_type, content_length=length)
+        return {}
+
+
+def _dav_delete(dav, path, file_info):
+    """ Delete a file from webdav, including its segments. """
+    dav.delete(path, ignore_not_existing=True)
+    if 'segments' in file_info:
+        dav.delete(path + '.segments', ignore_not_existing=True)
+
+
+def _segment_size():
+    """ Size in bytes above which files are uploaded in segments, from the
+    segment_size_mb setting of the webdav configuration.
+    @return: size or None if files are never segmented.
+    """
+    try:
+        size_mb = get_config().section('webdav').get('segment_size_mb')
+    except (EnvironmentError, KeyError):
+        return None
+    if size_mb is None:
+        return None
+    return int(float(size_mb) * 1024 * 1024)
+
+
+def _put_blob(dav, f, length, content_type=None):
+    """ Put a file in the content-addressed webdav storage.
+
+    The file is stored at cas/[digest[:2]]/[digest], where digest is the
+    SHA-256 of its contents. If the file is already stored, by another task,
+    it is not uploaded again. References to the blob are counted in the task
+    database, so that it is deleted when no task refers to it anymore.
+    @return: file information for task.files
+    """
+    digest = _sha256(f)
+    path, blob_dir, cas_dir = _blob_path(digest)
+    file_info = {'url': dav.path_to_url(path), 'length': length,
+                 'sha256': digest}
+
+    # Count the reference before checking for the blob, so a concurrent
+    # delete of the last reference does not remove the blob after the check.
+    blob = _update_blob_references(digest, 1)
+    if blob['refs'] > 1 and dav.exists(path):
+        print("Reusing stored file {0}".format(path))
+        file_info.update(blob.get('layout', {}))
+    else:
+        try:
+            dav.mkdir(cas_dir, ignore_existing=True)
+            dav.mkdir(blob_dir, ignore_existing=True)
+            f.seek(0)
+            layout = _dav_put(dav, path, f, length, content_type)
+        except IOError:
+            _update_blob_references(digest, -1)
+            raise
+        if layout:
+            _update_blob_references(digest, 0, layout=layout)
+            file_info.update(layout)
+
+    return file_info
+
+
+def _delete_blob(dav, file_info):
+    """ Remove a reference to a blob, and delete it if it was the last. """
+    digest = file_info['sha256']
+    if _update_blob_references(digest, -1)['refs'] == 0:
+        _dav_delete(dav, _blob_path(digest)[0], file_info)
+
+
+def _update_blob_references(digest, change, layout=None, database=None):
+    """ Change the reference count of a blob.
+
+    Reference counts are stored in blob_[digest] documents in the task
+    database, together with the segment layout of the blob, if any. The
+    document is deleted when the count reaches zero.
+    @return: the blob document
+    """
+    if database is None:
+        database = get_task_database()
+
+    doc_id = 'blob_' + digest
+    while True:
+        try:
+            doc = database.get(doc_id)
+        except ValueError:
+            doc = Document({'_id': doc_id, 'type': 'blob', 'refs': 0})
+
+        doc['refs'] = max(0, doc.get('refs', 0) + change)
+        if layout is not None:
+            doc['layout'] = layout
+        try:
+            if doc['refs'] > 0:
+                database.save(doc)
+            elif '_rev' in doc:
+                database.delete(doc)
+            return doc
+        except ResourceConflict:
+            pass  # updated by another task, try again
+
+
+def _sha256(f, chunk_size=1024 * 1024):
+    """ SHA-256 hex digest of the contents of a file object. """
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _blob_path(digest):
+    """ Path of a blob in the content-addressed storage. """
+    blob_dir = 'cas/' + digest[:2]
+    return blob_dir + '/' + digest, blob_dir, 'cas'
 
 
 def write_attachment(task, filename, data, content_type=None):
@@ -123,11 +315,27 @@ def write_attachment(task, filename, data, content_type=None):
 def read_attachment(task, filename, task_db=None):
     """
     Reads an attachment from the configured file storage layer as bytes data.
+    If an attachment cache is configured, the data is read from the cache.
     """
+    cache = get_attachment_cache()
+    key = _attachment_cache_key(cache, task, filename)
+    if key is not None:
+        return cache.read(key, lambda path: _download_attachment(
+            task, path, filename, task_db))
+
     if filename in task.files:
         url = task.files[filename]['url']
         dav = get_webdav()
-        return dav.get(dav.url_to_path(url))
+        path = dav.url_to_path(url)
+        if 'segments' in task.files[filename]:
+            data = b''.join(dav.get(segment_path(path, number))
+                            for number in range(
+                                task.files[filename]['segments']))
+        else:
+            data = dav.get(path)
+        if 'encoding' in task.files[filename]:
+            data = decompress_data(data, task.files[filename]['encoding'])
+        return data
     else:
         if task_db is None:
             task_db = get_task_database()
@@ -136,26 +344,95 @@ def read_attachment(task, filename, task_db=None):
 
 
 def download_attachment(task, directory, filename, task_db=None):
-    """ Uploads an attachment from the configured file storage layer. """
+    """ Downloads an attachment from the configured file storage layer. If an
+    attachment cache is configured, the file is taken from the cache. """
+    file_path = os.path.join(directory, filename)
+    cache = get_attachment_cache()
+    key = _attachment_cache_key(cache, task, filename)
+    if key is not None:
+        cache.fetch(key, file_path, lambda path: _download_attachment(
+            task, path, filename, task_db))
+    else:
+        _download_attachment(task, file_path, filename, task_db)
+
+
+def _download_attachment(task, file_path, filename, task_db=None):
+    """ Downloads an attachment from the file storage layer to file_path. """
     if filename in task.files:
         dav = get_webdav()
-        url = task.files[filename]['url']
-        file_path = os.path.join(directory, filename)
-        dav.download(dav.url_to_path(url), file_path)
+        file_info = task.files[filename]
+        path = dav.url_to_path(file_info['url'])
+        encoding = file_info.get('encoding')
+        if encoding is None:
+            download_path = file_path
+        else:
+            download_path = file_path + SUFFIXES[encoding]
+
+        if 'segments' in file_info:
+            dav.download_segments(path, download_path, file_info['segments'],
+                                  length=file_info.get('length'))
+        else:
+            dav.download(path, download_path,
+                         length=file_info.get('length'),
+                         parallelism=_download_parallelism())
+
+        if encoding is not None:
+            try:
+                decompress_file(download_path, file_path, encoding)
+            finally:
+                os.remove(download_path)
     else:
         if task_db is None:
             task_db = get_task_database()
         attach = task.get_attachment(filename, retrieve_from_database=task_db)
-        with open(os.path.join(directory, filename), 'wb') as f:
+        with open(file_path, 'wb') as f:
             f.write(attach['data'])
 
 
+def _download_parallelism():
+    """ Number of parallel parts to download large webdav files in, from the
+    download_parallelism setting of the webdav configuration. """
+    try:
+        return int(get_config().section('webdav')
+                   .get('download_parallelism', 1))
+    except (EnvironmentError, KeyError):
+        return 1
+
+
+def _attachment_cache_key(cache, task, filename):
+    """ Cache key of an attachment: its URL, length and content hash for
+    content-addressed webdav files, its URL, length and current ETag or
+    Last-Modified time for other webdav files, and its digest for CouchDB
+    attachments.
+    @return: key, or None if there is no cache or the attachment has no
+        stable identity.
+    """
+    if cache is None:
+        return None
+    if filename in task.files:
+        info = task.files[filename]
+        if 'sha256' in info:
+            return cache.key(info['url'], info.get('length'), info['sha256'])
+        dav = get_webdav()
+        validator = dav.validator(dav.url_to_path(info['url']))
+        if validator is None:
+            return None
+        return cache.key(info['url'], info.get('length'), validator)
+    digest = task.get('_attachments', {}).get(filename, {}).get('digest')
+    if digest is None:
+        return None
+    return cache.key('couchdb', digest)
+
+
 def delete_attachment(task, filename):
     """ Deletes an attachment from the configured file storage layer. """
     if filename in task.files:
         dav = get_webdav()
-        dav.delete(dav.url_to_path(task.files[filename]['url']),
-                   ignore_not_existing=True)
+        file_info = task.files[filename]
+        if 'sha256' in file_info:
+            _delete_blob(dav, file_info)
+        else:
+            _dav_delete(dav, dav.url_to_path(file_info['url']), file_info)
         del task.files[filename]
     else:
         task.delete_attachment(filename)
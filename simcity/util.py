@@ -21,8 +21,6 @@ import glob
 import shutil
 from numbers import Number
 import time
-import jsonschema
-import ijson
 import mimetypes
 import io
 from datetime import datetime
@@ -45,6 +43,8 @@ def parse_parameters(parameters, schema):
     ValueError: if the parameters do not conform to the schema
     EnvironmentError: if the schema is not a valid JSON schema
     """
+    import jsonschema  # slow to import, and only used here
+
     try:
         jsonschema.validate(parameters, schema)
     except jsonschema.SchemaError as ex:
@@ -97,6 +97,20 @@ class Timer(object):
         return diff
 
 
+def node_memory_mb(meminfo='/proc/meminfo'):
+    """ Total memory of the current node in MB, read from /proc/meminfo.
+    @return: memory in MB or None if it cannot be determined. """
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    # value is given in kB
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return None
+
+
 def get_truthy(value):
     """ Returns True on non-zero numbers and on '1', 'true', 'yes', 'on'.
         False otherwise. """
@@ -187,6 +201,8 @@ def file_content_type(filename, path):
 
 def is_geojson(f):
     """ Whether given file pointer contains GeoJSON data. """
+    import ijson
+
     try:
         json_type = next(ijson.items(f, 'type'))
         return json_type in ['Feature', 'FeatureCollection']
@@ -16,21 +16,37 @@
 
 """ Version information """
 
-from pkg_resources import get_distribution, DistributionNotFound
 import os.path
 
 try:
-    _dist = get_distribution('simcity')
+    from importlib.metadata import distribution, PackageNotFoundError
+except ImportError:
+    # pkg_resources is slow to import, so it is only used on old Pythons
+    from pkg_resources import (get_distribution as distribution,
+                               DistributionNotFound as PackageNotFoundError)
+
+
+def _installed_version():
+    """ Version of the installed simcity distribution, if that is the one
+    that is imported. """
+    try:
+        dist = distribution('simcity')
+    except PackageNotFoundError:
+        return None
+    try:
+        location = str(dist.locate_file(''))
+    except AttributeError:
+        location = dist.location
     # Normalize case for Windows systems
-    dist_loc = os.path.normcase(_dist.location)
+    dist_loc = os.path.normcase(location)
     here = os.path.normcase(__file__)
     if not here.startswith(os.path.join(dist_loc, 'simcity')):
         # not installed, but there is another version that *is*
-        raise DistributionNotFound
-except DistributionNotFound:
-    __version__ = '(not installed)'
-else:
-    __version__ = _dist.version
+        return None
+    return dist.version
+
+
+__version__ = _installed_version() or '(not installed)'
 
 __version_info__ = []
 for v in __version__.split('.'):
@@ -0,0 +1,262 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Live progress of tasks and jobs, following the database changes feeds.
+"""
+
+from __future__ import print_function
+from .integration import overview_total
+from .management import get_task_database, get_job_database
+from collections import deque
+import sys
+import threading
+import time
+
+TASK_STATUSES = ('pending', 'in_progress', 'done', 'error')
+
+
+def task_status(doc):
+    """ Status of a task document, as named in the overview_total view. """
+    if doc.get('lock') == -1:
+        return 'error'
+    elif doc.get('lock', 0) == 0:
+        return 'pending'
+    elif doc.get('done', 0) > 0:
+        return 'done'
+    else:
+        return 'in_progress'
+
+
+def duration_str(seconds):
+    """ Format a number of seconds as H:MM:SS. """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+
+def _previous_status(status, doc):
+    """ Most likely status of a task before a change to status, if the
+    task was not seen before. """
+    if doc.get('_rev', '').startswith('1-'):
+        return None
+    elif status == 'in_progress':
+        return 'pending'
+    elif status == 'pending':
+        return None
+    else:
+        return 'in_progress'
+
+
+class ProgressMonitor(object):
+    """
+    Counts of tasks and running jobs, kept up to date incrementally from
+    database changes.
+
+    The initial counts are read once from the overview_total view. After
+    that, each changed document moves one task between statuses. Tasks that
+    changed before the monitor started have an unknown previous status,
+    which is inferred from the usual task life cycle. Tasks are forgotten
+    once they are done or failed, so changes to finished tasks, such as
+    deleting or resetting them, are inferred in the same way; call seed
+    again to correct any drift.
+    """
+    def __init__(self, window=60):
+        """
+        @param window: number of seconds over which the throughput and
+            error rate are computed
+        """
+        self.window = window
+        self.counts = dict((status, 0) for status in TASK_STATUSES)
+        self.tasks = {}
+        self.jobs = {}
+        self.finished = deque()
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def seed(self, overview, running_jobs=()):
+        """
+        Set the task counts and running jobs.
+        @param overview: dict as returned by overview_total
+        @param running_jobs: job documents that are currently running
+        """
+        with self.lock:
+            for status in TASK_STATUSES:
+                self.counts[status] = overview.get(status, 0)
+            self.tasks = {}
+            self.jobs = dict((job['_id'], job.get('hostname') or 'unknown')
+                             for job in running_jobs)
+
+    def update(self, change, now=None):
+        """ Process a single change from the changes feed. """
+        doc = change.get('doc')
+        if doc is None:
+            return
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            if change.get('deleted'):
+                status = self.tasks.pop(change['id'], None)
+                if status is not None:
+                    self.counts[status] -= 1
+                self.jobs.pop(change['id'], None)
+            elif doc.get('type') == 'task':
+                self._update_task(doc, now)
+            elif doc.get('type') == 'job':
+                self._update_job(doc)
+
+    def _update_task(self, doc, now):
+        status = task_status(doc)
+        try:
+            previous = self.tasks[doc['_id']]
+        except KeyError:
+            previous = _previous_status(status, doc)
+        if status in ('done', 'error'):
+            self.tasks.pop(doc['_id'], None)
+        else:
+            self.tasks[doc['_id']] = status
+
+        if previous == status:
+            return
+        if previous is not None:
+            self.counts[previous] = max(0, self.counts[previous] - 1)
+        self.counts[status] += 1
+        if status in ('done', 'error'):
+            self.finished.append((now, status))
+
+    def _update_job(self, doc):
+        if doc.get('start', 0) > 0 and not doc.get('done') and \
+                not doc.get('archive'):
+            self.jobs[doc['_id']] = doc.get('hostname') or 'unknown'
+        else:
+            self.jobs.pop(doc['_id'], None)
+
+    def _expire(self, now):
+        while self.finished and self.finished[0][0] < now - self.window:
+            self.finished.popleft()
+
+    def throughput(self, now=None):
+        """ Finished tasks per second over the window. """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._expire(now)
+            elapsed = min(self.window, max(now - self.started, 1e-3))
+            return len(self.finished) / elapsed
+
+    def error_rate(self, now=None):
+        """ Fraction of tasks finished over the window that failed. """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._expire(now)
+            if not self.finished:
+                return 0.0
+            errors = sum(1 for _, status in self.finished
+                         if status == 'error')
+            return errors / float(len(self.finished))
+
+    def eta(self, now=None):
+        """ Estimated seconds until all tasks are finished, or None if no
+        tasks are finishing. """
+        rate = self.throughput(now)
+        if rate <= 0:
+            return None
+        with self.lock:
+            remaining = self.counts['pending'] + self.counts['in_progress']
+        return remaining / rate
+
+    def hosts(self):
+        """ Number of running jobs per host. """
+        result = {}
+        with self.lock:
+            for host in self.jobs.values():
+                result[host] = result.get(host, 0) + 1
+        return result
+
+    def format(self, now=None):
+        """ Multi-line text summary of the current progress. """
+        eta = self.eta(now)
+        lines = [
+            '  '.join('{0}: {1}'.format(status, self.counts[status])
+                      for status in TASK_STATUSES),
+            'throughput: {0:.2f} tasks/s  error rate: {1:.1%}  ETA: {2}'
+            .format(self.throughput(now), self.error_rate(now),
+                    'unknown' if eta is None else duration_str(eta)),
+        ]
+        for host, count in sorted(self.hosts().items()):
+            lines.append('  {0:<30} {1} jobs'.format(host, count))
+        return '\n'.join(lines)
+
+
+def follow(database, monitor, since='now', retry_delay=1,
+           max_retry_delay=60):
+    """
+    Update monitor with the changes of a database, in a daemon thread.
+
+    If the changes feed ends or fails, it is followed again from the last
+    processed update sequence, after retry_delay seconds. The delay doubles
+    with each consecutive failure, up to max_retry_delay seconds.
+    @param since: update sequence to start from
+    """
+    def run():
+        seq = since
+        delay = retry_delay
+        while True:
+            try:
+                for change in database.changes(since=seq):
+                    monitor.update(change)
+                    seq = change.get('seq', seq)
+                    delay = retry_delay
+            except Exception as ex:
+                print('WARNING: changes feed of {0} failed, reconnecting: '
+                      '{1}'.format(database.url, ex), file=sys.stderr)
+            time.sleep(delay)
+            delay = min(2 * delay, max_retry_delay)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def watch(callback, interval=2, window=60, task_db=None, job_db=None):
+    """
+    Follow the task and job databases and call callback with a
+    ProgressMonitor every interval seconds, until callback returns False.
+
+    The databases are queried once for the initial counts; after that only
+    the changes feeds are read, starting from the update sequences at which
+    the counts were read.
+    """
+    if task_db is None:
+        task_db = get_task_database()
+    if job_db is None:
+        job_db = get_job_database()
+
+    monitor = ProgressMonitor(window=window)
+    task_seq = task_db.changes_since()[1]
+    job_seq = task_seq if job_db is task_db else job_db.changes_since()[1]
+    monitor.seed(overview_total(task_db, job_db),
+                 job_db.get_from_view('running_jobs'))
+    follow(task_db, monitor, since=task_seq)
+    if job_db is not task_db:
+        follow(job_db, monitor, since=job_seq)
+
+    while callback(monitor) is not False:
+        time.sleep(interval)
+    return monitor
@@ -16,10 +16,16 @@
 
 """ Workers to execute a single process in a job. """
 
-from .util import listfiles, expandfilename
+from __future__ import print_function
+from .metrics import Metrics, task_command
+from .util import listfiles, expandfilename, Timer
 from .task import upload_attachment, download_attachment
+from contextlib import contextmanager
+import importlib
 import json
 import os
+import sys
+import time
 from subprocess import call
 from multiprocessing import Process
 
@@ -31,10 +37,20 @@ class Worker(Process):
     @param number: worker number
     @param task_q: (incoming) task queue, with None as sentinel value
     @param result_q: (outgoing) result queue
-    @param config: config object
+    @param queued_semaphore: semaphore with a slot per parallel process, or a
+        ResourcePool, to release when a task is finished
+    @param active_tasks: optional keyword argument with a shared dict in which
+        the task that the worker is processing is stored under its number, so
+        that it can be recovered if the worker process crashes.
+    @param metrics: optional keyword argument with the Metrics to record the
+        duration of task phases in.
     """
     def __init__(self, number, config, task_q, result_q, queued_semaphore,
                  *args, **kwargs):
+        self.active_tasks = kwargs.pop('active_tasks', None)
+        self.metrics = kwargs.pop('metrics', None)
+        if self.metrics is None:
+            self.metrics = Metrics(enabled=False)
         super(Worker, self).__init__(*args, **kwargs)
         self.number = number
         self.config = config
@@ -50,6 +66,28 @@ class Worker(Process):
         """
         raise NotImplementedError
 
+    @contextmanager
+    def phase(self, task, name):
+        """ Record the duration of a processing phase of a task in the task
+        timing and in the metrics. """
+        timer = Timer()
+        try:
+            yield
+        finally:
+            elapsed = timer.elapsed()
+            task.record_timing(name, elapsed)
+            self.metrics.observe('simcity_phase_seconds', elapsed,
+                                 phase=name, command=task_command(task))
+
+    def release_resources(self, task):
+        """ Release the resources that were reserved for a task. """
+        release_task = getattr(self.queued_semaphore, 'release_task', None)
+        if release_task is not None:
+            release_task(task)
+        else:
+            for _ in range(task['parallelism']):
+                self.queued_semaphore.release()
+
     def run(self):
         """
         Start a new worker instance
@@ -57,6 +95,9 @@ class Worker(Process):
         print('Starting worker {0}'.format(self.number))
         try:
             for task in iter(self.task_q.get, None):
+                timer = Timer()
+                if self.active_tasks is not None:
+                    self.active_tasks[self.number] = task
                 try:
                     self.process_task(task)
                 except Exception as ex:
@@ -65,10 +106,12 @@ class Worker(Process):
                     task.error(msg, exception=ex)
                     print(msg)
                 finally:
-                    for _ in range(task['parallelism']):
-                        self.queued_semaphore.release()
-
+                    task['runtime'] = round(timer.elapsed(), 3)
+                    self.release_resources(task)
+                    task['finished_at'] = time.time()
                     self.result_q.put(task)
+                    if self.active_tasks is not None:
+                        self.active_tasks.pop(self.number, None)
             print('Ending worker {0}'.format(self.number))
         except Exception as ex:
             print("Worker {0} failed: {1}".format(self.number, ex))
@@ -106,16 +149,52 @@ class ExecuteWorker(Worker):
         print("-----------------------")
         print("Working on task: {0}".format(task.id))
 
-        dirs = self.create_dirs(task)
-        params_file = os.path.join(dirs['SIMCITY_IN'], 'input.json')
-        dirs['SIMCITY_PARAMS'] = params_file
+        with self.phase(task, 'setup'):
+            dirs = self.create_dirs(task)
+            params_file = os.path.join(dirs['SIMCITY_IN'], 'input.json')
+            dirs['SIMCITY_PARAMS'] = params_file
+
+            with open(params_file, 'w') as f:
+                json.dump(task.input, f)
+
+        with self.phase(task, 'stage_in'):
+            for attachment in task.input.get('uploads', []):
+                download_attachment(task, dirs['SIMCITY_IN'], attachment)
+
+        task.output = {}
+
+        out_file = os.path.join(dirs['SIMCITY_OUT'], 'stdout.txt')
+        err_file = os.path.join(dirs['SIMCITY_OUT'], 'stderr.txt')
+        with self.phase(task, 'execute'):
+            try:
+                if self.execute_task(task, dirs, out_file, err_file) != 0:
+                    task.error("Command failed")
+            except Exception as ex:
+                task.error("Command raised exception", ex)
 
-        with open(params_file, 'w') as f:
-            json.dump(task.input, f)
+        # Read all files in as attachments
+        with self.phase(task, 'upload'):
+            uploaded = 0
+            for filename in listfiles(dirs['SIMCITY_OUT']):
+                try:
+                    upload_attachment(task, dirs['SIMCITY_OUT'], filename)
+                    uploaded += os.path.getsize(
+                        os.path.join(dirs['SIMCITY_OUT'], filename))
+                except IOError as ex:
+                    task.error("Output file {0} could not be stored: {1}"
+                               .format(filename, ex))
+        self.metrics.inc('simcity_upload_bytes', uploaded,
+                         command=task_command(task))
 
-        for attachment in task.input.get('uploads', []):
-            download_attachment(task, dirs['SIMCITY_IN'], attachment)
+        if not task.has_error():  # don't override error status
+            task.done()
+        print("-----------------------")
 
+    def execute_task(self, task, dirs, out_file, err_file):
+        """ Execute the command of a task with its arguments, in an
+        environment that includes the task directories.
+        @return: exit code of the command
+        """
         command = expandfilename(task['command'])
 
         if 'arguments' in task and len(task['arguments']) > 0:
@@ -128,27 +207,11 @@ class ExecuteWorker(Worker):
                 else:
                     command.append(arg)
 
-        dirs.update(os.environ)
-        task['execute_properties'] = {'env': dirs}
-
-        out_file = os.path.join(dirs['SIMCITY_OUT'], 'stdout.txt')
-        err_file = os.path.join(dirs['SIMCITY_OUT'], 'stderr.txt')
-        try:
-            if self.execute(command, out_file, err_file, dirs) != 0:
-                task.error("Command failed")
-        except Exception as ex:
-            task.error("Command raised exception", ex)
+        env = dict(dirs)
+        env.update(os.environ)
+        task['execute_properties'] = {'env': env}
 
-        task.output = {}
-
-        # Read all files in as attachments
-        out_files = listfiles(dirs['SIMCITY_OUT'])
-        for filename in out_files:
-            upload_attachment(task, dirs['SIMCITY_OUT'], filename)
-
-        if not task.has_error():  # don't override error status
-            task.done()
-        print("-----------------------")
+        return self.execute(command, out_file, err_file, env)
 
     @staticmethod
     def execute(command, out_file, err_file, env):
@@ -179,3 +242,108 @@ class ExecuteWorker(Worker):
             os.mkdir(dirs[d])
 
         return dirs
+
+
+class PythonWorker(ExecuteWorker):
+    """
+    Executes tasks that name a Python function inside the worker process.
+
+    A task with an entry_point property of the form 'module:function' is
+    executed by calling function(input, dirs), where input is the task input
+    and dirs the dict with the task directories (SIMCITY_IN, SIMCITY_OUT,
+    SIMCITY_TMP and SIMCITY_PARAMS). The module is imported only once per
+    worker process, so interpreter startup and imports are not repeated for
+    each task. If the function returns a dict, it is added to the task
+    output. During the call, the working directory is SIMCITY_TMP, the
+    directories are set as environment variables and stdout and stderr are
+    written to the output directory.
+
+    Tasks without an entry_point are executed as a command, like the
+    ExecuteWorker does.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PythonWorker, self).__init__(*args, **kwargs)
+        self.functions = {}
+
+    def load_function(self, entry_point):
+        """ Import the function of a 'module:function' entry point. """
+        try:
+            return self.functions[entry_point]
+        except KeyError:
+            module_name, _, function_name = entry_point.partition(':')
+            if len(function_name) == 0:
+                raise ValueError("Entry point {0} is not of the form "
+                                 "module:function".format(entry_point))
+            module = importlib.import_module(module_name)
+            function = module
+            for attr in function_name.split('.'):
+                function = getattr(function, attr)
+            self.functions[entry_point] = function
+            return function
+
+    def execute_task(self, task, dirs, out_file, err_file):
+        """ Call the entry point of a task, or execute its command if it has
+        no entry point.
+        @return: 0 on success, the exit code if the function calls sys.exit.
+        """
+        if 'entry_point' not in task:
+            return super(PythonWorker, self).execute_task(
+                task, dirs, out_file, err_file)
+
+        function = self.load_function(task['entry_point'])
+        task['execute_properties'] = {'entry_point': task['entry_point']}
+
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        os.environ.update(dirs)
+        os.chdir(dirs['SIMCITY_TMP'])
+        try:
+            with _redirect_output(out_file, err_file):
+                try:
+                    result = function(task.input, dict(dirs))
+                except SystemExit as ex:
+                    return _exit_status(ex.code)
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+
+        if isinstance(result, dict):
+            task.output.update(result)
+        return 0
+
+
+def _exit_status(code):
+    """ Exit status of a SystemExit code, like that of the Python
+    interpreter: None is success, and other codes that are not integers are
+    printed to stderr and mean failure. """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return int(code)
+    print(code, file=sys.stderr)
+    return 1
+
+
+@contextmanager
+def _redirect_output(out_file, err_file):
+    """ Redirect stdout and stderr, also of subprocesses and C extensions, to
+    files. """
+    with open(out_file, 'w') as out, open(err_file, 'w') as err:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = os.dup(1), os.dup(2)
+        saved_streams = sys.stdout, sys.stderr
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        sys.stdout, sys.stderr = out, err
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            sys.stdout, sys.stderr = saved_streams
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
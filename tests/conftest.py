@@ -42,7 +42,7 @@ class MockDAV(object):
         self.removed = []
 
     def put(self, path, fp, content_type=None, content_length=None):
-        self.files[path] = fp.read()
+        self.files[path] = fp.read() if hasattr(fp, 'read') else fp
 
     def delete(self, path, ignore_not_existing=False):
         try:
@@ -55,10 +55,21 @@ class MockDAV(object):
 
         self.removed.append(path)
 
+    def exists(self, path):
+        return path in self.files
+
+    def validator(self, path):
+        if path not in self.files:
+            return None
+        return str(hash(self.files[path]))
+
     def mkdir(self, path, ignore_existing=False):
         self.files[path] = 'DIR'
 
-    def download(self, path, file_path):
+    def get(self, path):
+        return self.files[path]
+
+    def download(self, path, file_path, **kwargs):
         with open(file_path, 'wb') as f:
             f.write(self.files[path])
 
@@ -111,6 +122,11 @@ class MockDB(object):
     def copy(self):
         return self
 
+    def all_ids(self):
+        for docs in (self.tasks, self.jobs, self.saved):
+            for doc_id in list(docs.keys()):
+                yield doc_id
+
     def get_single_from_view(self, view, **view_params):
         idx = random.choice(list(self.tasks.keys()))
         return simcity.Document(self.tasks[idx])
@@ -155,6 +171,9 @@ class MockDB(object):
     def view(self, name, **view_options):
         return self.viewList
 
+    def changes_since(self, since=None):
+        return set(), 0
+
     def set_users(self, admins=None, members=None, admin_roles=None,
                   member_roles=None):
         pass
@@ -167,6 +186,20 @@ class MockDB(object):
             'design': design_doc
         }
 
+    def update_design_document(self, design_doc, views, remove=(),
+                               language='javascript'):
+        self.design_updates = getattr(self, 'design_updates', 0) + 1
+        for view in remove:
+            if self.views.get(view, {}).get('design') == design_doc:
+                del self.views[view]
+        for view, definition in views.items():
+            self.add_view(view, definition['map'], definition.get('reduce'),
+                          design_doc)
+        return True
+
+    def indexing_progress(self, design_doc):
+        return None
+
 
 @pytest.fixture
 def job_db():
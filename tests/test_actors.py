@@ -17,6 +17,8 @@
 from __future__ import print_function
 
 import simcity
+from simcity.memorydb import MemoryDB
+import multiprocessing
 import pytest
 import os
 import time
@@ -39,11 +41,39 @@ def test_actor(mock_directories, db):
     actor.run()
     assert db.saved['myjob']['done'] > 0
     assert db.saved['mytask']['done'] > 0
+    assert 'claim' in db.saved['mytask']['timing']
+    assert 'collect' in db.saved['mytask']['timing']
+    assert 'finished_at' not in db.saved['mytask']
     assert os.path.exists(exec_config['tmp_dir'])
     assert os.path.exists(exec_config['output_dir'])
     assert os.path.exists(exec_config['input_dir'])
 
 
+@pytest.mark.usefixtures("dav")
+def test_actor_metrics(mock_directories, db, tmpdir):
+    cfg = simcity.Config()
+    exec_config = {'parallelism': 1,
+                   'metrics_file': str(tmpdir.join('simcity.prom'))}
+    exec_config.update(mock_directories)
+    cfg.add_section('Execution', exec_config)
+    cfg.add_section('webdav', {
+        'url': 'https://my.example.com'
+    })
+    db.tasks = {'mytask': {'_id': 'mytask', 'command': 'echo'}}
+    pytest.raises(KeyError, simcity.management.set_config, cfg)
+    simcity.management.set_current_job_id('myjob')
+    iterator = simcity.TaskViewIterator('myid', db, 'pending')
+    actor = simcity.JobActor(iterator, simcity.ExecuteWorker)
+    actor.run()
+
+    with open(exec_config['metrics_file']) as f:
+        text = f.read()
+    assert 'job="myjob"' in text
+    assert 'simcity_tasks_total{' in text
+    for phase in ('claim', 'stage_in', 'execute', 'upload', 'save'):
+        assert 'phase="{0}"'.format(phase) in text
+
+
 @pytest.mark.usefixtures("dav")
 def test_actor_maximize_parallelism(mock_directories, db):
     cfg = simcity.Config()
@@ -98,3 +128,178 @@ def test_actor_parallelism(mock_directories, db):
     assert os.path.exists(exec_config['tmp_dir'])
     assert os.path.exists(exec_config['output_dir'])
     assert os.path.exists(exec_config['input_dir'])
+
+
+def test_lease_renewer(db):
+    task = simcity.Task({'_id': 'a'}).lock('myjob', lease=10)
+    db.tasks['a'] = db.manager.dict(task)
+    renewer = simcity.actors.LeaseRenewer(db, {'a': task['lock']}, 100)
+    renewer.renew()
+    assert db.saved['a']['lease_until'] >= task['lock'] + 99
+
+    # do not renew tasks that were claimed by another job
+    renewer = simcity.actors.LeaseRenewer(db, {'a': task['lock'] - 1}, 1000)
+    renewer.renew()
+    assert db.saved['a']['lease_until'] < task['lock'] + 999
+
+
+def test_backlog_lease_renewed(mock_directories):
+    db = MemoryDB()
+    db.save(simcity.Task({'_id': 'a', 'command': 'echo'}))
+    cfg = simcity.Config()
+    cfg.add_section('Execution', mock_directories)
+    iterator = simcity.TaskViewIterator('myjob', db, 'pending', lease=1)
+    actor = simcity.JobActor(iterator, simcity.ExecuteWorker, task_db=db,
+                             job_db=db, parallelism=1, config=cfg)
+    actor.lease_renewer.interval = 0.2
+    try:
+        # claim a task, but hold it in the backlog for longer than its lease
+        task = next(actor.claim_tasks())
+        actor.lease_renewer.start()
+        time.sleep(2.5)
+        other = simcity.TaskViewIterator('otherjob', db, 'pending', lease=1)
+        assert [] == list(other)
+        assert 'myjob' == db.get('a')['job']
+
+        actor.release_tasks([task])
+        assert 0 == len(actor.claimed_tasks)
+    finally:
+        actor.lease_renewer.stop()
+        actor.manager.shutdown()
+
+
+def test_release_tasks(db):
+    task = simcity.Task({'_id': 'a'}).lock('myjob', lease=10)
+    db.tasks['a'] = db.manager.dict(task)
+    actor = simcity.JobActor.__new__(simcity.JobActor)
+    actor.task_db = db
+    actor.claimed_tasks = {'a': task['lock']}
+    actor.release_tasks([task])
+    released = db.saved['a']
+    assert 0 == released['lock']
+    assert 0 == released['scrub_count']
+    assert 'job' not in released
+    assert 'lease_until' not in released
+    assert {} == actor.claimed_tasks
+
+
+def test_resource_pool():
+    manager = multiprocessing.Manager()
+    pool = simcity.actors.ResourcePool(manager,
+                                       {'cpus': 2, 'memory_mb': 100})
+    assert pool.fits({'cpus': 2, 'memory_mb': 100, 'scratch_mb': 10})
+    assert not pool.fits({'cpus': 1, 'memory_mb': 101})
+    assert pool.try_acquire({'cpus': 1, 'memory_mb': 60})
+    assert not pool.try_acquire({'cpus': 1, 'memory_mb': 60})
+    assert pool.try_acquire({'cpus': 1, 'memory_mb': 40})
+    assert not pool.try_acquire({'cpus': 1})
+    releases = pool.releases()
+    pool.release({'cpus': 1, 'memory_mb': 60})
+    assert pool.releases() == releases + 1
+    pool.wait(releases)  # returns immediately
+    assert not pool.is_idle()
+    pool.release_task({'resources': {'cpus': 1, 'memory_mb': 40}})
+    assert pool.is_idle()
+
+
+@pytest.mark.usefixtures("dav")
+def test_actor_task_too_large(mock_directories, db):
+    cfg = simcity.Config()
+    exec_config = {'parallelism': 1, 'memory_mb': 100}
+    exec_config.update(mock_directories)
+    cfg.add_section('Execution', exec_config)
+    cfg.add_section('webdav', {
+        'url': 'https://my.example.com'
+    })
+    db.tasks = {'mytask': {'_id': 'mytask', 'command': 'echo',
+                           'memory_mb': 200},
+                'mytask2': {'_id': 'mytask2', 'command': 'echo',
+                            'memory_mb': 50}}
+    pytest.raises(KeyError, simcity.management.set_config, cfg)
+    simcity.management.set_current_job_id('myjob')
+    iterator = simcity.TaskViewIterator('myjob', db, 'pending')
+    actor = simcity.JobActor(iterator, simcity.ExecuteWorker)
+    assert {'cpus': 1, 'memory_mb': 100} == actor.resources.capacity
+    actor.run()
+    assert db.saved['mytask']['lock'] == -1
+    assert db.saved['mytask2']['done'] > 0
+    assert {'cpus': 1, 'memory_mb': 50, 'scratch_mb': 0} == \
+        db.saved['mytask2']['resources']
+
+
+@pytest.mark.usefixtures("dav")
+def test_actor_has_time(mock_directories, db):
+    cfg = simcity.Config()
+    exec_config = {'parallelism': 1}
+    exec_config.update(mock_directories)
+    cfg.add_section('Execution', exec_config)
+    pytest.raises(KeyError, simcity.management.set_config, cfg)
+    iterator = simcity.TaskViewIterator('myjob', db, 'pending')
+    actor = simcity.JobActor(iterator, simcity.ExecuteWorker)
+    timer = simcity.util.Timer()
+    short = simcity.Task({'command': 'echo'})
+    long = simcity.Task({'command': 'sleep'})
+    assert actor.has_time(long, None, 1.5, timer)
+    assert actor.has_time(long, 100, 1.5, timer)
+    actor.durations.add(short, 1)
+    actor.durations.add(long, 100)
+    assert actor.has_time(short, 100, 1.5, timer)
+    assert actor.has_time(long, 100, 1.5, timer) is False
+
+
+@pytest.mark.usefixtures("dav")
+def test_actor_rejections(mock_directories, db):
+    cfg = simcity.Config()
+    exec_config = {'parallelism': 1, 'max_rejections': 3}
+    exec_config.update(mock_directories)
+    cfg.add_section('Execution', exec_config)
+    pytest.raises(KeyError, simcity.management.set_config, cfg)
+    iterator = simcity.TaskViewIterator('myjob', db, 'pending')
+    actor = simcity.JobActor(iterator, simcity.ExecuteWorker)
+    actor.release_tasks = lambda tasks: None
+    timer = simcity.util.Timer()
+    long = simcity.Task({'_id': 'long', 'command': 'sleep'})
+    other = simcity.Task({'_id': 'other', 'command': 'sleep'})
+    actor.durations.add(long, 100)
+    try:
+        # a task that is claimed again only counts once
+        for task in (long, other, long, other, long):
+            assert actor.dispatch([task], 100, 1.5, timer)
+        assert not actor.dispatch([simcity.Task({'_id': 'third',
+                                                 'command': 'sleep'})],
+                                  100, 1.5, timer)
+
+        # unless no other task is handed out
+        actor._rejected.clear()
+        assert actor.dispatch([long], 100, 1.5, timer)
+        assert actor.dispatch([long], 100, 1.5, timer)
+        assert not actor.dispatch([long], 100, 1.5, timer)
+    finally:
+        actor.manager.shutdown()
+
+
+def crash_task(params, dirs):
+    os._exit(3)
+
+
+@pytest.mark.usefixtures("dav")
+def test_actor_worker_crash(mock_directories, db):
+    cfg = simcity.Config()
+    exec_config = {'parallelism': 1}
+    exec_config.update(mock_directories)
+    cfg.add_section('Execution', exec_config)
+    cfg.add_section('webdav', {
+        'url': 'https://my.example.com'
+    })
+    db.tasks = {'mytask': {'_id': 'mytask',
+                           'entry_point': 'test_actors:crash_task'},
+                'mytask2': {'_id': 'mytask2', 'command': 'echo'}}
+    pytest.raises(KeyError, simcity.management.set_config, cfg)
+    simcity.management.set_current_job_id('myjob')
+    iterator = simcity.TaskViewIterator('myjob', db, 'pending')
+    actor = simcity.JobActor(iterator, simcity.PythonWorker)
+    actor.run()
+    assert db.saved['mytask']['lock'] == -1
+    assert 'crashed' in db.saved['mytask']['error'][0]['message']
+    assert db.saved['mytask2']['done'] > 0
+    assert db.saved['myjob']['tasks_processed'] == 2
@@ -0,0 +1,210 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from aiohttp import web  # noqa: E402
+from aiohttp import test_utils  # noqa: E402
+from couchdb.http import ResourceConflict  # noqa: E402
+import asyncio  # noqa: E402
+import simcity.aio as aio  # noqa: E402
+from simcity.memorydb import mango_match  # noqa: E402
+
+
+class MockCouchServer(object):
+    """ Minimal CouchDB and WebDAV server. """
+    def __init__(self):
+        self.docs = {}
+        self.files = {}
+        self.view_requests = 0
+        self.app = web.Application()
+        self.app.router.add_route('GET', '/db/{id}', self.get)
+        self.app.router.add_route('PUT', '/db/{id}', self.put)
+        self.app.router.add_route('DELETE', '/db/{id}', self.delete)
+        self.app.router.add_route('POST', '/db/_bulk_docs', self.bulk_docs)
+        self.app.router.add_route('POST', '/db/_find', self.find)
+        self.app.router.add_route(
+            'GET', '/db/_design/Monitor/_view/{view}', self.view)
+        self.app.router.add_route('*', '/dav/{path:.*}', self.dav)
+
+    def _store(self, doc):
+        current = self.docs.get(doc['_id'])
+        if current is not None and current['_rev'] != doc.get('_rev'):
+            return {'error': 'conflict', 'reason': 'Document update conflict'}
+        rev = 1 if current is None else int(current['_rev']) + 1
+        doc['_rev'] = str(rev)
+        self.docs[doc['_id']] = doc
+        return {'ok': True, 'id': doc['_id'], 'rev': doc['_rev']}
+
+    async def get(self, request):
+        try:
+            return web.json_response(self.docs[request.match_info['id']])
+        except KeyError:
+            return web.json_response({'error': 'not_found'}, status=404)
+
+    async def put(self, request):
+        doc = await request.json()
+        result = self._store(doc)
+        return web.json_response(result, status=409 if 'error' in result
+                                 else 201)
+
+    async def delete(self, request):
+        doc = self.docs.get(request.match_info['id'])
+        if doc is None or doc['_rev'] != request.query['rev']:
+            return web.json_response({'error': 'conflict'}, status=409)
+        del self.docs[doc['_id']]
+        return web.json_response({'ok': True})
+
+    async def bulk_docs(self, request):
+        docs = (await request.json())['docs']
+        return web.json_response([self._store(doc) for doc in docs],
+                                 status=201)
+
+    async def find(self, request):
+        query = await request.json()
+        docs = [doc for doc in self.docs.values()
+                if mango_match(doc, query['selector'])]
+        skip = int(query.get('bookmark') or 0)
+        docs = docs[skip:skip + query['limit']]
+        if 'fields' in query:
+            docs = [dict((field, doc[field]) for field in query['fields']
+                         if field in doc) for doc in docs]
+        return web.json_response({'docs': docs,
+                                  'bookmark': str(skip + len(docs))})
+
+    async def view(self, request):
+        self.view_requests += 1
+        rows = [{'id': doc['_id'], 'key': doc['_id'],
+                 'value': {'lock': doc['lock']}}
+                for doc in self.docs.values()
+                if doc.get('lock', 0) > 0 and doc.get('done', 0) == 0]
+        return web.json_response({'rows': rows})
+
+    async def dav(self, request):
+        path = request.match_info['path']
+        if request.method == 'PUT':
+            self.files[path] = await request.read()
+            return web.Response(status=201)
+        if request.method == 'DELETE':
+            found = self.files.pop(path, None) is not None
+            return web.Response(status=204 if found else 404)
+        if path not in self.files:
+            return web.Response(status=404)
+        return web.Response(body=self.files[path])
+
+
+def run(coroutine_function):
+    async def main():
+        mock = MockCouchServer()
+        server = test_utils.TestServer(mock.app)
+        await server.start_server()
+        try:
+            await coroutine_function(mock, str(server.make_url('')))
+        finally:
+            await server.close()
+    asyncio.run(main())
+
+
+def test_async_couchdb():
+    async def check(mock, url):
+        async with aio.AsyncCouchDB(url=url, db='db', limit=4) as db:
+            doc = await db.save({'_id': 'a', 'value': 1})
+            assert '1' == doc['_rev']
+            assert 1 == (await db.get('a'))['value']
+            with pytest.raises(ValueError):
+                await db.get('b')
+            with pytest.raises(ResourceConflict):
+                await db.save({'_id': 'a', 'value': 2})
+            assert [True, False] == await db.save_documents(
+                [doc, {'_id': 'a'}])
+            assert [True] == await db.delete_documents([doc])
+            assert {} == mock.docs
+    run(check)
+
+
+def test_async_scrub():
+    async def check(mock, url):
+        for i in range(20):
+            mock.docs['t{0}'.format(i)] = {
+                '_id': 't{0}'.format(i), '_rev': '1', 'type': 'task',
+                'lock': 1, 'done': 0, 'scrub_count': 0}
+        async with aio.AsyncCouchDB(url=url, db='db') as db:
+            assert (20, 20) == await aio.scrub('in_progress', db)
+        assert all(doc['lock'] == 0 for doc in mock.docs.values())
+    run(check)
+
+
+def test_async_mango():
+    async def check(mock, url):
+        for i in range(5):
+            mock.docs['t{0}'.format(i)] = {
+                '_id': 't{0}'.format(i), '_rev': '1', 'type': 'task',
+                'lock': i, 'done': 0, 'scrub_count': 0, 'job': 'j'}
+        mock.docs['j'] = {'_id': 'j', '_rev': '1', 'type': 'job',
+                          'start': 1, 'done': 2, 'archive': 0}
+        async with aio.AsyncCouchDB(url=url, db='db',
+                                    query_backend='mango') as db:
+            rows = await db._find_rows('in_progress', batch_size=2)
+            assert ['t1', 't2', 't3', 't4'] == sorted(row.id for row in rows)
+            assert {'lock': 1, 'done': 0} == [
+                row.value for row in rows if row.id == 't1'][0]
+            assert 4 == len(await aio.check_task_status(db, dry_run=True))
+            assert (4, 4) == await aio.scrub('in_progress', db, age=0)
+        assert 0 == mock.view_requests
+    run(check)
+
+
+def test_async_webdav(tmpdir):
+    async def check(mock, url):
+        async with aio.AsyncRestRequests(url + '/dav') as dav:
+            await dav.put('my/file.txt', b'ab')
+            assert await dav.exists('my/file.txt')
+            assert b'ab' == await dav.get('my/file.txt')
+            path = str(tmpdir.join('file.txt'))
+            await dav.download('my/file.txt', path)
+            assert b'ab' == tmpdir.join('file.txt').read_binary()
+            await dav.delete('my/file.txt')
+            await dav.delete('my/file.txt', ignore_not_existing=True)
+            assert not await dav.exists('my/file.txt')
+    run(check)
+
+
+def test_async_delete_tasks_blob_references():
+    async def check(mock, url):
+        shared, single = 'ab' + '0' * 62, 'cd' + '0' * 62
+        mock.docs['blob_' + shared] = {
+            '_id': 'blob_' + shared, '_rev': '1', 'type': 'blob', 'refs': 2}
+        mock.docs['blob_' + single] = {
+            '_id': 'blob_' + single, '_rev': '1', 'type': 'blob', 'refs': 1}
+        mock.files['cas/ab/' + shared] = b'shared'
+        mock.files['cas/cd/' + single] = b'single'
+        tasks = []
+        for task_id, digest in (('task_a', shared), ('task_b', single)):
+            mock.docs[task_id] = {
+                '_id': task_id, '_rev': '1', 'type': 'task',
+                'files': {'out.txt': {'sha256': digest}}}
+            tasks.append(aio.Task(mock.docs[task_id]))
+
+        async with aio.AsyncCouchDB(url=url, db='db') as db:
+            async with aio.AsyncRestRequests(url + '/dav') as dav:
+                assert [True, True] == await aio.delete_tasks(db, dav, tasks)
+
+        assert ['blob_' + shared] == list(mock.docs)
+        assert 1 == mock.docs['blob_' + shared]['refs']
+        assert ['cas/ab/' + shared] == list(mock.files)
+    run(check)
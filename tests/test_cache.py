@@ -0,0 +1,95 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import simcity
+from simcity.cache import AttachmentCache, get_attachment_cache
+import os
+import pytest
+
+
+def _downloader(data, calls):
+    def download(path):
+        calls.append(path)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return download
+
+
+def test_cache_fetch(tmpdir):
+    cache = AttachmentCache(str(tmpdir.join('cache')))
+    calls = []
+    key = cache.key('https://example.com/file', 2)
+    for name in ('a', 'b'):
+        target = str(tmpdir.join(name))
+        cache.fetch(key, target, _downloader(b'ab', calls))
+        with open(target, 'rb') as f:
+            assert b'ab' == f.read()
+
+    assert 1 == len(calls)
+    assert b'ab' == cache.read(key, _downloader(b'cd', calls))
+    assert 1 == len(calls)
+
+
+def test_cache_failed_download(tmpdir):
+    cache = AttachmentCache(str(tmpdir.join('cache')))
+
+    def fail(path):
+        raise IOError('no connection')
+
+    pytest.raises(IOError, cache.fetch, 'x', str(tmpdir.join('a')), fail)
+    assert 0 == cache.size()
+
+
+def test_cache_evict(tmpdir):
+    cache = AttachmentCache(str(tmpdir.join('cache')), max_size_mb=2e-6)
+    calls = []
+    cache.read('first', _downloader(b'ab', calls))
+    os.utime(cache.path('first'), (0, 0))
+    cache.read('second', _downloader(b'cd', calls))
+    assert not os.path.exists(cache.path('first'))
+    assert os.path.exists(cache.path('second'))
+    assert 2 == cache.size()
+    assert ['second'] == os.listdir(str(tmpdir.join('cache', 'locks')))
+
+
+@pytest.mark.usefixtures('task_db')
+def test_download_attachment_cached(dav, tmpdir):
+    cfg = simcity.Config()
+    cfg.add_section('Execution', {'cache_dir': str(tmpdir.join('cache'))})
+    simcity.management._config = cfg
+    assert get_attachment_cache() is not None
+
+    task = simcity.get_task('a')
+    dav.files['my/file.txt'] = b'ab'
+    task.files['file.txt'] = {'url': dav.base_url + '/my/file.txt',
+                              'length': 2}
+    simcity.download_attachment(task, str(tmpdir), 'file.txt')
+    downloads = []
+    download = dav.download
+    dav.download = lambda path, file_path, **kwargs: (
+        downloads.append(path), download(path, file_path))
+
+    other = tmpdir.mkdir('other')
+    simcity.download_attachment(task, str(other), 'file.txt')
+    assert b'ab' == other.join('file.txt').read_binary()
+    assert b'ab' == simcity.task.read_attachment(task, 'file.txt')
+    assert [] == downloads
+
+    # uploaded again with the same length
+    dav.files['my/file.txt'] = b'cd'
+    assert b'cd' == simcity.task.read_attachment(task, 'file.txt')
+    assert ['my/file.txt'] == downloads
+    simcity.management._config = None
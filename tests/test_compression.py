@@ -0,0 +1,57 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from simcity.compression import (compress_file, decompress_data,
+                                 decompress_file, is_compressible,
+                                 check_encoding)
+import io
+import pytest
+
+DATA = b'time,link,vehicle\n' * 1000
+
+
+def test_is_compressible():
+    assert is_compressible('text/plain')
+    assert is_compressible('text/csv; charset=utf-8')
+    assert is_compressible('application/vnd.geo+json')
+    assert is_compressible('application/atom+xml')
+    assert not is_compressible('image/png')
+    assert not is_compressible(None)
+
+
+def test_gzip(tmpdir):
+    compressed, length = compress_file(io.BytesIO(DATA), 'gzip')
+    data = compressed.read()
+    assert length == len(data) < len(DATA)
+    assert DATA == decompress_data(data, 'gzip')
+
+    # deterministic output
+    assert data == compress_file(io.BytesIO(DATA), 'gzip')[0].read()
+
+    source = tmpdir.join('data.gz')
+    source.write_binary(data)
+    decompress_file(str(source), str(tmpdir.join('data')), 'gzip')
+    assert DATA == tmpdir.join('data').read_binary()
+
+
+def test_zstd():
+    pytest.importorskip('zstandard')
+    compressed, length = compress_file(io.BytesIO(DATA), 'zstd')
+    assert DATA == decompress_data(compressed.read(), 'zstd')
+
+
+def test_unknown_encoding():
+    pytest.raises(ValueError, check_encoding, 'lzma')
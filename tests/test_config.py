@@ -17,6 +17,7 @@
 from __future__ import print_function
 
 from simcity.config import Config, FileConfig, CouchDBConfig
+import os
 import pytest
 
 
@@ -77,3 +78,100 @@ def test_couchconfig(db):
     config.add_section('task-db', {'name': 'new-tasks'})
     assert ({'url': 'http://task.example', 'name': 'new-tasks'} ==
             config.section('task-db'))
+
+
+class CountingConfig(object):
+    def __init__(self, sections):
+        self.values = sections
+        self.reads = 0
+        self.changed = False
+
+    def section(self, name):
+        self.reads += 1
+        return dict(self.values[name])
+
+    def sections(self):
+        return frozenset(self.values)
+
+    def poll_changes(self):
+        changed, self.changed = self.changed, False
+        return changed
+
+
+def test_config_cache():
+    counting = CountingConfig({'a': {'x': '1'}})
+    cfg = Config([counting])
+    assert {'x': '1'} == cfg.section('a')
+    cfg.section('a')['x'] = '2'
+    assert {'x': '1'} == cfg.section('a')
+    pytest.raises(KeyError, cfg.section, 'b')
+    pytest.raises(KeyError, cfg.section, 'b')
+    assert 2 == counting.reads
+
+    counting.values['a'] = {'x': '3'}
+    assert '1' == cfg.section('a')['x']
+    counting.changed = True
+    assert '3' == cfg.section('a')['x']
+
+    cfg.add_section('a', {'y': '4'})
+    assert {'x': '3', 'y': '4'} == cfg.section('a')
+    cfg.add_configurator(CountingConfig({'a': {'x': '5'}, 'b': {}}))
+    assert {'x': '5', 'y': '4'} == cfg.section('a')
+    assert frozenset(['a', 'b']) == cfg.sections()
+
+
+def test_couchconfig_refresh(db):
+    changes = []
+
+    def changes_since(since=None):
+        if since is None:
+            return set(), 1
+        changed = set(changes)
+        del changes[:]
+        return changed, since + len(changed)
+
+    db.changes_since = changes_since
+    db.tasks = {'task-db': {'settings': {'url': 'a'}}}
+    dbconfig = CouchDBConfig(db, refresh_interval=0)
+    config = Config([dbconfig])
+    assert 'a' == config.section('task-db')['url']
+    db.tasks = {'task-db': {'settings': {'url': 'b'}}}
+    assert 'a' == config.section('task-db')['url']
+    changes.append('task-db')
+    assert 'b' == config.section('task-db')['url']
+
+    dbconfig.refresh_interval = 3600
+    db.tasks = {'task-db': {'settings': {'url': 'c'}}}
+    changes.append('task-db')
+    assert 'b' == config.section('task-db')['url']
+
+
+def test_config_write(tmpdir):
+    cfg = Config()
+    cfg.add_section('task-db', {'url': 'http://x', 'port': 5984})
+    cfg.add_section('config-db', {'url': 'http://y'})
+    path = str(tmpdir.join('snapshot.ini'))
+    cfg.write(path)
+
+    written = Config([FileConfig(path)])
+    assert {'url': 'http://x', 'port': '5984'} == written.section('task-db')
+    pytest.raises(KeyError, written.section, 'config-db')
+
+
+def test_config_write_unexpanded(tmpdir, monkeypatch):
+    monkeypatch.setenv('SIMCITY_TEST_DIR', '/scratch')
+    f = tmpdir.join('config.ini')
+    f.write('[Execution]\ntmp_dir = $SIMCITY_TEST_DIR/tmp\n')
+    cfg = Config([FileConfig(str(f))])
+    cfg.add_section('task-db', {'url': '$SIMCITY_TEST_DIR/db'})
+    assert '/scratch/tmp' == cfg.section('Execution')['tmp_dir']
+    path = str(tmpdir.join('snapshot.ini'))
+    cfg.write(path)
+
+    assert '$SIMCITY_TEST_DIR/tmp' in tmpdir.join('snapshot.ini').read()
+    if os.name == 'posix':
+        assert 0o600 == os.stat(path).st_mode & 0o777
+    monkeypatch.setenv('SIMCITY_TEST_DIR', '/home')
+    written = Config([FileConfig(path)])
+    assert '/home/tmp' == written.section('Execution')['tmp_dir']
+    assert '/home/db' == written.section('task-db')['url']
@@ -0,0 +1,174 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from simcity import CouchDB
+from simcity.database import design_document, MANGO_INDEXES
+import pytest
+
+
+class DocumentStore(object):
+    """ Stand-in for a couchdb.Database that stores documents. """
+    def __init__(self):
+        self.docs = {}
+        self.saves = 0
+        self.name = 'tasks'
+
+    def get(self, doc_id):
+        return self.docs.get(doc_id)
+
+    def save(self, doc):
+        self.saves += 1
+        self.docs[doc['_id']] = dict(doc)
+
+    def view(self, name, **options):
+        return name
+
+
+class FindResource(object):
+    """ Stand-in for the resource of a couchdb.Database that answers _find
+    requests. """
+    def __init__(self, docs):
+        self.docs = docs
+        self.requests = []
+
+    def post_json(self, path=None, body=None, headers=None, **params):
+        self.requests.append((path, body))
+        if path == '_index':
+            return 200, {}, {'result': 'created'}
+        start = int(body.get('bookmark', body.get('skip', 0)))
+        docs = self.docs[start:start + body.get('limit', 25)]
+        return 200, {}, {'docs': docs, 'bookmark': str(start + len(docs))}
+
+
+class TaskServer(object):
+    def __init__(self, tasks):
+        self._tasks = tasks
+
+    def tasks(self):
+        return self._tasks
+
+
+def couchdb(server=None, query_backend='view'):
+    database = CouchDB.__new__(CouchDB)
+    database.db = DocumentStore()
+    database.server = server
+    database.query_backend = query_backend
+    return database
+
+
+def test_update_design_document():
+    database = couchdb()
+    views = {
+        'pending': {'map': '\n    function(doc) {\n      emit(1);\n    }'},
+        'overview': {'map': 'function(doc) {}', 'reduce': '_count'},
+    }
+    assert database.update_design_document('Monitor', views)
+    stored = database.db.docs['_design/Monitor']
+    pending = stored['views']['pending']
+    assert 'function(doc) {\n  emit(1);\n}' == pending['map']
+    assert '_count' == stored['views']['overview']['reduce']
+
+    assert not database.update_design_document('Monitor', views)
+    assert 1 == database.db.saves
+
+    stored['views']['other'] = {'map': 'function(doc) {}'}
+    views['overview']['reduce'] = '_sum'
+    assert database.update_design_document('Monitor', views)
+    assert 2 == database.db.saves
+    stored = database.db.docs['_design/Monitor']
+    assert ['other', 'overview', 'pending'] == sorted(stored['views'])
+    assert '_sum' == stored['views']['overview']['reduce']
+
+    assert database.update_design_document('Monitor', {}, remove=['other'])
+    stored = database.db.docs['_design/Monitor']
+    assert ['overview', 'pending'] == sorted(stored['views'])
+
+
+def test_design_document():
+    assert 'Claim' == design_document('pending')
+    assert 'Jobs' == design_document('running_jobs', 'Monitor')
+    assert 'Monitor' == design_document('done')
+    assert 'mysim_0.1' == design_document('pending', 'mysim_0.1')
+
+    database = couchdb()
+    assert 'Claim/pending_priority' == database.view('pending_priority')
+    assert 'Monitor/overview_total' == database.view('overview_total')
+    assert 'Stats/pending' == database.view('pending', design_doc='Stats')
+
+
+def test_indexing_progress():
+    database = couchdb(TaskServer([
+        {'type': 'indexer', 'database': 'shards/00-7f/tasks.1234',
+         'design_document': '_design/Monitor', 'progress': 20},
+        {'type': 'indexer', 'database': 'shards/80-ff/tasks.1234',
+         'design_document': '_design/Monitor', 'progress': 60},
+        {'type': 'indexer', 'database': 'shards/00-ff/jobs.1234',
+         'design_document': '_design/Monitor', 'progress': 0},
+        {'type': 'replication', 'progress': 0},
+    ]))
+    assert 40 == database.indexing_progress('Monitor')
+    assert database.indexing_progress('Other') is None
+
+
+def test_query_backend():
+    pytest.raises(ValueError, CouchDB, query_backend='sql')
+
+
+def test_find():
+    database = couchdb()
+    database.db.resource = FindResource([{'_id': 'a'}, {'_id': 'b'}])
+    docs, bookmark = database.find({'type': 'task'}, fields=['_id'],
+                                   limit=10, bookmark='1')
+    assert [{'_id': 'b'}] == docs
+    assert '2' == bookmark
+    assert ('_find', {'selector': {'type': 'task'}, 'fields': ['_id'],
+                      'limit': 10, 'bookmark': '1'}) == \
+        database.db.resource.requests[0]
+
+
+def test_create_indexes():
+    database = couchdb()
+    database.db.resource = FindResource([])
+    assert sorted(MANGO_INDEXES) == database.create_indexes()
+    path, body = database.db.resource.requests[0]
+    assert '_index' == path
+    assert 'simcity-job-archive' == body['ddoc']
+    assert {'fields': ['type', 'archive']} == body['index']
+
+
+def test_mango_view():
+    database = couchdb(query_backend='mango')
+    database.db.resource = FindResource([
+        {'_id': 'a', 'lock': 0, 'done': 0},
+        {'_id': 'b', 'lock': 0, 'done': 0},
+        {'_id': 'c', 'lock': 0, 'done': 0},
+    ])
+    rows = database.view('pending', batch_size=2)
+    assert ['a', 'b', 'c'] == [row.id for row in rows.rows]
+    assert {'lock': 0, 'done': 0} == rows[0].value
+    requests = database.db.resource.requests
+    assert 2 == len(requests)
+    assert {'type': 'task', 'lock': 0} == requests[0][1]['selector']
+    assert '2' == requests[1][1]['bookmark']
+
+    rows = database.view('pending', limit=1, skip=1,
+                         selector={'ensemble': 'e'})
+    assert ['b'] == [row.id for row in rows]
+    assert {'type': 'task', 'lock': 0, 'ensemble': 'e'} == \
+        requests[-1][1]['selector']
+
+    pytest.raises(ValueError, database.view, 'pending', key='a')
+    assert 'Claim/pending_priority' == database.view('pending_priority')
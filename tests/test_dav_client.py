@@ -0,0 +1,269 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from simcity.dav import RestRequests
+import io
+import json
+import pytest
+import re
+import requests
+
+DATA = bytes(bytearray(range(256))) * 40
+
+PROPFIND_RESPONSE = b"""<?xml version="1.0" encoding="utf-8"?>
+<D:multistatus xmlns:D="DAV:">
+  <D:response>
+    <D:href>/dav/ab/</D:href>
+    <D:propstat>
+      <D:prop><D:resourcetype><D:collection/></D:resourcetype></D:prop>
+      <D:status>HTTP/1.1 200 OK</D:status>
+    </D:propstat>
+  </D:response>
+  <D:response>
+    <D:href>https://example.com/dav/ab/my%20task/</D:href>
+    <D:propstat>
+      <D:prop><D:resourcetype><D:collection/></D:resourcetype></D:prop>
+      <D:status>HTTP/1.1 200 OK</D:status>
+    </D:propstat>
+  </D:response>
+  <D:response>
+    <D:href>/dav/ab/my%20task/out.txt</D:href>
+    <D:propstat>
+      <D:prop>
+        <D:resourcetype/>
+        <D:getcontentlength>10240</D:getcontentlength>
+        <D:getetag>"abc"</D:getetag>
+      </D:prop>
+      <D:status>HTTP/1.1 200 OK</D:status>
+    </D:propstat>
+    <D:propstat>
+      <D:prop><D:getlastmodified/></D:prop>
+      <D:status>HTTP/1.1 404 Not Found</D:status>
+    </D:propstat>
+  </D:response>
+</D:multistatus>
+"""
+
+
+class MockResponse(object):
+    def __init__(self, status_code, data, fail_after=None):
+        self.status_code = status_code
+        self.data = data
+        self.fail_after = fail_after
+        self.headers = requests.structures.CaseInsensitiveDict()
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.data), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise requests.ConnectionError('connection dropped')
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class MockServer(object):
+    def __init__(self, data, fail_after=None, ranges=True):
+        self.data = data
+        self.fail_after = fail_after
+        self.ranges = ranges
+        self.depth_infinity = True
+        self.requests = []
+        self.files = {}
+
+    def put(self, url, data=None, headers=None, **kwargs):
+        self.requests.append(url)
+        self.files[url] = data.read() if hasattr(data, 'read') else data
+        if self.fail_after is not None:
+            self.fail_after = None
+            raise requests.ConnectionError('connection dropped')
+        return MockResponse(201, b'')
+
+    def request(self, method, url, headers=None, **kwargs):
+        if method != 'PROPFIND':
+            return MockResponse(201, b'')
+        self.requests.append(('PROPFIND', headers['Depth']))
+        if headers['Depth'] == 'infinity':
+            if not self.depth_infinity:
+                return MockResponse(403, b'')
+            body = PROPFIND_RESPONSE
+        else:
+            # the directory itself and its direct children
+            start = 1 if url.rstrip('/').endswith('task') else 0
+            header, rest = PROPFIND_RESPONSE.split(b'<D:response>', 1)
+            responses = rest.split(b'<D:response>')[start:start + 2]
+            body = header + b''.join(b'<D:response>' + r for r in responses)
+            if not body.rstrip().endswith(b'</D:multistatus>'):
+                body += b'</D:multistatus>'
+        response = MockResponse(207, body)
+        response.raw = io.BytesIO(body)
+        return response
+
+    def head(self, url, **kwargs):
+        response = MockResponse(200, b'')
+        response.headers['etag'] = '"abc"'
+        return response
+
+    def get(self, url, headers=None, **kwargs):
+        byte_range = (headers or {}).get('Range')
+        self.requests.append(byte_range)
+        fail_after, self.fail_after = self.fail_after, None
+        data = self.files.get(url, self.data)
+        if byte_range is None or not self.ranges:
+            return MockResponse(200, data, fail_after)
+        start, end = re.match(r'bytes=(\d+)-(\d*)', byte_range).groups()
+        end = len(data) if end == '' else int(end) + 1
+        return MockResponse(206, data[int(start):end], fail_after)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    mock_server = MockServer(DATA)
+    monkeypatch.setattr(requests, 'get', mock_server.get)
+    monkeypatch.setattr(requests, 'put', mock_server.put)
+    monkeypatch.setattr(requests, 'request', mock_server.request)
+    monkeypatch.setattr(requests, 'head', mock_server.head)
+    return mock_server
+
+
+def test_download(server, tmpdir):
+    path = str(tmpdir.join('file'))
+    RestRequests('https://example.com').download(
+        'file', path, chunk_size=1000, length=len(DATA))
+    assert DATA == tmpdir.join('file').read_binary()
+
+
+def test_download_retry(server, tmpdir):
+    path = str(tmpdir.join('file'))
+    server.fail_after = 3000
+    RestRequests('https://example.com').download(
+        'file', path, chunk_size=1000, length=len(DATA))
+    assert DATA == tmpdir.join('file').read_binary()
+    assert [None, 'bytes=3000-'] == server.requests
+
+
+def test_download_resume(server, tmpdir):
+    f = tmpdir.join('file')
+    f.write_binary(DATA[:5000])
+    RestRequests('https://example.com').download(
+        'file', str(f), resume=True)
+    assert DATA == f.read_binary()
+    assert ['bytes=5000-'] == server.requests
+
+
+def test_download_resume_unsupported(server, tmpdir):
+    server.ranges = False
+    f = tmpdir.join('file')
+    f.write_binary(DATA[:5000])
+    RestRequests('https://example.com').download(
+        'file', str(f), resume=True)
+    assert DATA == f.read_binary()
+
+
+def test_download_parallel(server, tmpdir):
+    path = str(tmpdir.join('file'))
+    server.fail_after = 1000
+    RestRequests('https://example.com').download(
+        'file', path, chunk_size=500, length=len(DATA), parallelism=4,
+        min_part_size=1000)
+    assert DATA == tmpdir.join('file').read_binary()
+    assert 5 == len(server.requests)
+
+
+def test_download_parallel_unsupported(server, tmpdir):
+    server.ranges = False
+    path = str(tmpdir.join('file'))
+    RestRequests('https://example.com').download(
+        'file', path, chunk_size=500, length=len(DATA), parallelism=4,
+        min_part_size=1000)
+    assert DATA == tmpdir.join('file').read_binary()
+    assert ['bytes=0-{0}'.format(len(DATA) // 4 - 1), None] == \
+        server.requests
+
+
+def test_download_wrong_length(server, tmpdir):
+    path = str(tmpdir.join('file'))
+    pytest.raises(IOError, RestRequests('https://example.com').download,
+                  'file', path, length=len(DATA) + 1)
+
+
+def test_put_segments(server, tmpdir):
+    dav = RestRequests('https://example.com')
+    server.fail_after = 0
+    segments = dav.put_segments('file', io.BytesIO(DATA), len(DATA), 4000)
+    assert 3 == segments
+    assert 5 == len(server.requests)
+    assert DATA[4000:8000] == server.files[
+        'https://example.com/file.segments/00001']
+    manifest = json.loads(
+        server.files['https://example.com/file'].decode('utf-8'))
+    assert len(DATA) == manifest['length']
+
+    path = str(tmpdir.join('file'))
+    dav.download_segments('file', path, segments, length=len(DATA))
+    assert DATA == tmpdir.join('file').read_binary()
+
+
+def test_list(server):
+    dav = RestRequests('https://example.com/dav/')
+    items = list(dav.list('ab', depth='infinity'))
+    assert [('PROPFIND', 'infinity')] == server.requests
+    assert [{'path': 'ab/my task', 'is_dir': True, 'length': None,
+             'etag': None, 'modified': None},
+            {'path': 'ab/my task/out.txt', 'is_dir': False, 'length': 10240,
+             'etag': '"abc"', 'modified': None}] == items
+
+
+def test_sync_download(server, tmpdir):
+    dav = RestRequests('https://example.com/dav')
+    assert ['ab/my task/out.txt'] == dav.sync(str(tmpdir), 'ab')
+    assert DATA == tmpdir.join('my task', 'out.txt').read_binary()
+    assert [] == dav.sync(str(tmpdir), 'ab')
+
+    tmpdir.join('my task', 'out.txt').write_binary(b'changed')
+    assert ['ab/my task/out.txt'] == dav.sync(str(tmpdir), 'ab')
+
+
+def test_sync_download_depth_one(server, tmpdir):
+    server.depth_infinity = False
+    dav = RestRequests('https://example.com/dav')
+    assert ['ab/my task/out.txt'] == dav.sync(str(tmpdir), 'ab')
+    assert DATA == tmpdir.join('my task', 'out.txt').read_binary()
+    assert [('PROPFIND', 'infinity'), ('PROPFIND', '1'),
+            ('PROPFIND', '1'), None] == server.requests
+
+
+def test_sync_upload(server, tmpdir):
+    dav = RestRequests('https://example.com/dav')
+    tmpdir.mkdir('my task').join('out.txt').write_binary(DATA)
+    assert ['ab/my task/out.txt'] == dav.sync(str(tmpdir), 'ab', upload=True)
+    assert DATA == server.files['https://example.com/dav/ab/my task/out.txt']
+    assert [] == dav.sync(str(tmpdir), 'ab', upload=True)
+
+
+def test_validator(server, monkeypatch):
+    dav = RestRequests('https://example.com')
+    assert '"abc"' == dav.validator('file')
+
+    def head(url, **kwargs):
+        response = MockResponse(200, b'')
+        response.headers['last-modified'] = 'Mon, 1 Jan 2024 00:00:00 GMT'
+        return response
+    monkeypatch.setattr(requests, 'head', head)
+    assert 'Mon, 1 Jan 2024 00:00:00 GMT' == dav.validator('file')
+    monkeypatch.setattr(requests, 'head',
+                        lambda url, **kwargs: MockResponse(404, b''))
+    assert dav.validator('file') is None
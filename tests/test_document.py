@@ -100,3 +100,26 @@ class TestTask:
         assert self.task['lock'] == 0
         assert self.task['done'] == 0
         assert len(self.task['error']) == 1
+
+
+def test_task_lease():
+    task = Task({'_id': test_id})
+    task.lock('myid', lease=60)
+    assert task['lease_until'] == task['lock'] + 60
+    assert not task.lease_expired()
+    task['lease_until'] = seconds() - 1
+    assert task.lease_expired()
+    task.renew_lease(60)
+    assert task['lease_until'] >= seconds() + 59
+    assert not task.lease_expired()
+    task.scrub()
+    assert 'lease_until' not in task
+    assert not task.lease_expired()
+
+
+def test_task_timing():
+    task = Task({'_id': test_id})
+    task.record_timing('execute', 1.2345)
+    assert {'execute': 1234} == task['timing']
+    task.scrub()
+    assert 'timing' not in task
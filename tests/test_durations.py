@@ -0,0 +1,54 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from simcity import Task
+from simcity.durations import TaskDurations
+import pytest
+
+
+def test_task_class():
+    task = Task({'command': 'matsim', 'ensemble': 'a'})
+    assert 'matsim|a' == TaskDurations.task_class(task)
+    task = Task({'command': 'matsim', 'input': {'ensemble': 'b'}})
+    assert 'matsim|b' == TaskDurations.task_class(task)
+    assert '|' == TaskDurations.task_class(Task())
+
+
+def test_predict():
+    durations = TaskDurations()
+    short = Task({'command': 'echo'})
+    long = Task({'command': 'sleep'})
+    assert durations.predict(short) is None
+    durations.add(short, 1)
+    assert 1 == durations.predict(short)
+    durations.add(short, 3)
+    assert pytest.approx(2 + 2 ** 0.5) == durations.predict(short)
+    assert durations.predict(long) is None
+
+
+def test_save_load(db):
+    durations = TaskDurations.load(db)
+    task = Task({'command': 'echo'})
+    durations.add(task, 1)
+    durations.save(db)
+
+    other = TaskDurations.load(db)
+    assert 1 == other.predict(task)
+    other.add(task, 3)
+    other.save(db)
+
+    merged = TaskDurations.load(db)
+    assert [2, 2, 2] == merged.stored['echo|']
@@ -9,18 +9,53 @@ def test_create_ensemble_view(db):
 
     result = simcity.ensemble_view(db, 'mysim', '0.1')
 
-    assert 1 == len(db.views)
+    assert 3 == len(db.views)
     assert 'all_docs' in db.views
     assert 'mysim_0.1' == result
     assert 'mysim_0.1' == db.views['all_docs']['design']
     assert len(db.views['all_docs']['map']) > 0
     assert url in db.views['all_docs']['map']
+    assert 'mysim_0.1' == db.views['list']['design']
+    assert 'mysim_0.1' == db.views['status']['design']
+    assert '_count' == db.views['status']['reduce']
 
 
 def test_existing_ensemble_view(db):
-    db.save(simcity.Document({'_id': '_design/mysim_0.1'}))
+    db.save(simcity.Document({
+        '_id': '_design/mysim_0.1',
+        'views': {'all_docs': {}, 'list': {}, 'status': {}}}))
 
     result = simcity.ensemble_view(db, 'mysim', '0.1')
 
     assert 'mysim_0.1' == result
     assert 0 == len(db.views)
+
+
+def test_outdated_ensemble_view(db):
+    db.url = 'http://fun.host/mydb'
+    db.save(simcity.Document({'_id': '_design/mysim_0.1',
+                              'views': {'all_docs': {}}}))
+
+    simcity.ensemble_view(db, 'mysim', '0.1')
+
+    assert ['list', 'status'] == sorted(db.views.keys())
+
+
+def test_ensemble_status(db):
+    db.set_view([('done', 3), ('error', 1)])
+
+    counts = simcity.ensemble_status(db, 'mysim_0.1')
+
+    assert {'pending': 0, 'running': 0, 'done': 3, 'error': 1} == counts
+
+
+def test_ensemble_page(db):
+    db.set_view([('a', 'done'), ('b', 'pending'), ('c', 'running')])
+
+    page, next_key = simcity.ensemble_page(db, 'mysim_0.1', limit=2)
+    assert [('a', 'done'), ('b', 'pending')] == page
+    assert 'c' == next_key
+
+    page, next_key = simcity.ensemble_page(db, 'mysim_0.1', limit=3)
+    assert 3 == len(page)
+    assert next_key is None
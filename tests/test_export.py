@@ -0,0 +1,176 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from simcity.export import (ColumnarWriter, export_ensemble, flatten,
+                            iter_view_docs, task_row, union_schema)
+from simcity import Task
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+
+class Row(object):
+    def __init__(self, doc):
+        self.id = self.key = doc['_id']
+        self.doc = doc
+
+
+class PagedDB(object):
+    """ Database with a single view that supports paging. """
+    url = 'http://localhost/db'
+
+    def __init__(self, docs):
+        self.docs = sorted(docs, key=lambda doc: doc['_id'])
+        self.requests = 0
+
+    def get(self, doc_id):
+        raise ValueError(doc_id)
+
+    def update_design_document(self, design_doc, views):
+        self.design_doc = design_doc
+
+    def view(self, view, design_doc=None, include_docs=False, limit=None,
+             startkey=None):
+        self.requests += 1
+        rows = [Row(doc) for doc in self.docs
+                if startkey is None or doc['_id'] >= startkey]
+        return rows[:limit]
+
+
+def make_docs(n):
+    return [{'_id': 't{0:03d}'.format(i), 'type': 'task', 'lock': 1,
+             'done': 2, 'runtime': 0.5, 'input': {'x': i, 'p': {'q': 'a'}},
+             'output': {'y': float(i) / 2}}
+            for i in range(n)]
+
+
+def test_flatten():
+    row = flatten({'a': 1, 'b': {'c': [1, 2], 'd': None}}, 'input', {})
+    assert row == {'input.a': 1, 'input.b.c': '[1, 2]', 'input.b.d': None}
+
+
+def test_task_row():
+    task = Task({'_id': 'a', 'lock': 1, 'done': 0, 'input': {'x': 1},
+                 'error': [{'message': 'failed'}]})
+    row = task_row(task)
+    assert row['id'] == 'a'
+    assert row['errors'] == 1
+    assert row['input.x'] == 1
+    assert row['runtime'] is None
+
+
+def test_iter_view_docs():
+    db = PagedDB(make_docs(25))
+    docs = list(iter_view_docs(db, 'all_docs', 'design', page_size=10))
+    assert [doc['_id'] for doc in docs] == [d['_id'] for d in make_docs(25)]
+    assert db.requests == 3
+
+
+def test_columnar_writer(tmpdir):
+    path = str(tmpdir.join('out.parquet'))
+    with ColumnarWriter(path) as writer:
+        writer.write([{'a': 1, 'b': None}, {'a': 2, 'b': None}])
+        writer.write([{'a': 'three', 'b': 4}])
+        with pytest.raises(ValueError):
+            writer.write([{'a': 5, 'c': 5}])
+    table = pyarrow.parquet.read_table(path)
+    assert table.column_names == ['a', 'b']
+    assert table.column('a').to_pylist() == [1, 2, None]
+    assert table.column('b').to_pylist() == [None, None, '4']
+
+
+def test_union_schema():
+    schema = union_schema([
+        [{'a': 1, 'b': None}, {'a': 2, 'c': 'x'}],
+        [],
+        [{'a': 1.5, 'b': True, 'c': 3, 'd': [1]}],
+    ])
+    assert schema.names == ['a', 'b', 'c', 'd']
+    assert schema.field('a').type == pyarrow.float64()
+    assert schema.field('b').type == pyarrow.bool_()
+    assert schema.field('c').type == pyarrow.string()
+
+
+def test_columnar_writer_format(tmpdir):
+    with pytest.raises(ValueError):
+        ColumnarWriter(str(tmpdir.join('out.csv')), 'csv')
+
+
+def test_export_parquet(tmpdir):
+    db = PagedDB(make_docs(25))
+    path = str(tmpdir.join('out.parquet'))
+    count = export_ensemble(path, 'sim', '1', database=db, page_size=10,
+                            row_group_size=7)
+    assert count == 25
+    assert db.design_doc == 'sim_1'
+    assert db.requests == 3
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    assert parquet_file.num_row_groups == 4
+    table = parquet_file.read()
+    assert table.column('input.x').to_pylist() == list(range(25))
+    assert table.column('input.p.q').to_pylist() == ['a'] * 25
+    assert table.column('output.y').to_pylist()[3] == 1.5
+
+
+def test_export_late_columns(tmpdir):
+    docs = make_docs(10)
+    docs[8]['output']['z'] = 'late'
+    db = PagedDB(docs)
+    path = str(tmpdir.join('out.parquet'))
+    export_ensemble(path, 'sim', '1', database=db, row_group_size=4)
+    table = pyarrow.parquet.read_table(path)
+    assert table.column('output.z').to_pylist() == [None] * 8 + ['late', None]
+
+
+def test_export_uncached(tmpdir):
+    db = PagedDB(make_docs(10))
+    path = str(tmpdir.join('out.parquet'))
+    view = db.view
+
+    def changing_view(*args, **kwargs):
+        if db.requests == 1:
+            # a task gets a new output while the export runs
+            db.docs[5]['output']['z'] = 'new'
+        return view(*args, **kwargs)
+
+    db.view = changing_view
+    assert 10 == export_ensemble(path, 'sim', '1', database=db,
+                                 cache_size=5)
+    assert db.requests == 2
+    table = pyarrow.parquet.read_table(path)
+    assert 'output.z' not in table.column_names
+    assert ['out.parquet'] == [f.basename for f in tmpdir.listdir()]
+
+
+def test_columnar_writer_abort(tmpdir):
+    path = str(tmpdir.join('out.parquet'))
+    with pytest.raises(KeyError):
+        with ColumnarWriter(path) as writer:
+            writer.write([{'a': 1}])
+            raise KeyError('a')
+    assert [] == tmpdir.listdir()
+
+
+def test_export_arrow(tmpdir):
+    import pyarrow.ipc
+    db = PagedDB(make_docs(5))
+    path = str(tmpdir.join('out.arrow'))
+    export_ensemble(path, 'sim', '1', ensemble='e', file_format='arrow',
+                    database=db)
+    table = pyarrow.ipc.open_file(path).read_all()
+    assert table.num_rows == 5
+    assert db.design_doc == 'sim_1_e'
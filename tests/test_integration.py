@@ -30,6 +30,19 @@ def test_overview(db):
     assert overview['pending_jobs'] == 0
 
 
+def test_timing_profile(db):
+    db.set_view([
+        (['ens', 'execute'], {'sum': 3000, 'count': 2, 'min': 1000,
+                              'max': 2000, 'sumsqr': 5000000}),
+        (['ens', 'claim'], {'sum': 10, 'count': 2, 'min': 5, 'max': 5,
+                            'sumsqr': 50}),
+    ])
+    profile = simcity.timing_profile()
+    assert ['ens'] == list(profile.keys())
+    assert 1500 == profile['ens']['execute']['mean']
+    assert 5 == profile['ens']['claim']['min']
+
+
 def test_run(task_db, job_db):
     job_db.set_view([('running_jobs', 1)])
 
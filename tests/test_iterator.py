@@ -14,7 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from simcity.iterator import TaskViewIterator
+from simcity.iterator import (TaskViewIterator, PriorityViewIterator,
+                              PrioritizedViewIterator, _claim_expired_task)
+from simcity.memorydb import MemoryDB
+from simcity.util import seconds
+import simcity
+import pytest
 
 
 def test_iterator(db):
@@ -26,3 +31,63 @@ def test_iterator(db):
         break  # process one task only
 
     assert len(db.saved) == 1
+
+
+def test_iterator_mango_selector():
+    db = MemoryDB(query_backend='mango')
+    db.save(simcity.Task({'_id': 'a', 'ensemble': 'first'}))
+    db.save(simcity.Task({'_id': 'b', 'ensemble': 'second'}))
+    iterator = TaskViewIterator('myjob', db, 'pending',
+                                selector={'ensemble': 'second'})
+    assert ['b'] == [task.id for task in iterator]
+    assert 0 == db.get('a')['lock']
+
+
+def test_priority_iterator(db):
+    db.tasks['c'] = db.manager.dict({'_id': 'c', 'lock': 0})
+    db.set_view([{'id': 'b', 'key': [-2, 10]},
+                 {'id': 'c', 'key': [-2, 12]},
+                 {'id': 'a', 'key': [-1, 5]}])
+    task = PriorityViewIterator('myjob', db).next()
+    assert task.id in ('b', 'c')
+    assert 'myjob' == task['job']
+    assert 'a' not in db.saved
+
+
+def test_priority_iterator_empty(db):
+    db.set_view([])
+    pytest.raises(StopIteration, PriorityViewIterator('myjob', db).next)
+
+
+def test_prioritized_iterator(db):
+    iterator = PrioritizedViewIterator('myjob', db, 'pending_priority',
+                                       'pending')
+    task = iterator.next()
+    assert 'myjob' == task['job']
+
+
+def test_prioritized_iterator_high_first():
+    db = MemoryDB()
+    db.save(simcity.Task({'_id': 'a', 'priority': 5}))
+    db.save(simcity.Task({'_id': 'b', 'priority': 'high'}))
+    iterator = PrioritizedViewIterator('myjob', db, 'pending_priority',
+                                       'pending')
+    assert ['b'] == [row.id for row in db.view('pending_priority')]
+    assert ['b', 'a'] == [task.id for task in iterator]
+
+
+def test_claim_expired_lease(db):
+    db.tasks = {'c': db.manager.dict({
+        '_id': 'c', 'lock': 1, 'done': 0, 'job': 'crashedjob',
+        'lease_until': 2})}
+    task = _claim_expired_task('myjob', db, 60)
+    assert 'myjob' == task['job']
+    assert task['lease_until'] == task['lock'] + 60
+    assert 1 == task['scrub_count']
+
+
+def test_claim_unexpired_lease(db):
+    db.tasks = {'c': db.manager.dict({
+        '_id': 'c', 'lock': 1, 'done': 0, 'job': 'otherjob',
+        'lease_until': seconds() + 60})}
+    pytest.raises(EnvironmentError, _claim_expired_task, 'myjob', db, 60)
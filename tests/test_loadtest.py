@@ -0,0 +1,79 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import random
+from couchdb.http import ResourceConflict
+from simcity import Task
+from simcity.loadtest import (ConflictCounter, create_tasks, format_results,
+                              loadtest, parse_distribution, percentile)
+from simcity.memorydb import MemoryDB, shared_memory_db
+
+
+def test_parse_distribution():
+    rnd = random.Random(1)
+    assert 2.5 == parse_distribution('constant:2.5')(rnd)
+    assert 1 <= parse_distribution('uniform:1,2')(rnd) <= 2
+    assert parse_distribution('exponential:1')(rnd) >= 0
+    assert parse_distribution('lognormal:0,1')(rnd) > 0
+    for spec in ('constant', 'uniform:1', 'normal:1,2', 'constant:a'):
+        with pytest.raises(ValueError):
+            parse_distribution(spec)
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert 51 == percentile(list(range(1, 101)), 0.5)
+    assert 100 == percentile(list(range(1, 101)), 0.99)
+
+
+def test_create_tasks():
+    db = MemoryDB()
+    ids = create_tasks(db, 5, 'load', input_size=10, runtime='constant:1',
+                       output_files=2, output_size=3, batch_size=2)
+    assert 5 == len(ids)
+    assert 5 == len(db.get_from_view('pending'))
+    task = Task(db.get(ids[0]))
+    assert 'load' == task['ensemble']
+    assert 10 == len(task.input['padding'])
+    assert 1.0 == task.input['runtime']
+    assert 2 == task.input['output_files']
+
+
+def test_conflict_counter():
+    counter = ConflictCounter(MemoryDB())
+    doc = counter.save(Task({'_id': 'a'}))
+    copy = counter.copy()
+    copy.save(Task(counter.get('a')))
+    with pytest.raises(ResourceConflict):
+        copy.save(doc)
+    assert 1 == counter.conflicts.value
+
+
+def test_loadtest():
+    manager, db = shared_memory_db()
+    try:
+        results = loadtest(db, tasks=6, jobs=2, workers=1, output_files=1,
+                           output_size=10, seed=1)
+        assert 6 == results['done']
+        assert 0 == results['errors']
+        assert results['throughput'] > 0
+        assert results['latency_ms']['p99'] is not None
+        assert not any(doc_id.startswith('loadtest')
+                       for doc_id in db.all_ids())
+        assert 'throughput' in format_results(results)
+    finally:
+        manager.shutdown()
@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import simcity.__main__ as main
 import pytest
 
@@ -23,3 +24,15 @@ import pytest
 def test_main_parser_init(request, argument_parser):
     main.fill_argument_parser(argument_parser)
     assert 'func' in argument_parser.parse_args([request.param])
+
+
+@pytest.mark.parametrize('argv,standalone', [
+    (['create', '-m', '4096', 'cmd'], False),
+    (['loadtest'], False),
+    (['loadtest', '--memory'], True),
+    (['loadtest', '--url', 'http://localhost:5984'], True),
+])
+def test_standalone(argv, standalone):
+    parser = argparse.ArgumentParser()
+    main.fill_argument_parser(parser)
+    assert standalone == main._standalone(parser.parse_args(argv))
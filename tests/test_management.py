@@ -17,6 +17,8 @@
 from __future__ import print_function
 
 import simcity
+from simcity.database import MANGO_VIEWS
+from simcity.memorydb import MemoryDB
 import pytest
 
 
@@ -59,3 +61,59 @@ def test_views(job_db, task_db):
     assert 'pending' in task_db.views
     assert 'overview_total' in task_db.views
     assert 'running_jobs' not in task_db.views
+    assert '_stats' == task_db.views['timing']['reduce']
+    assert 'Claim' == task_db.views['pending']['design']
+    assert 'Claim' == task_db.views['leases']['design']
+    high_priority = task_db.views['pending_priority']['map']
+    assert 'doc.priority === "high"' in high_priority
+    assert 'Claim' == task_db.views['pending_by_priority']['design']
+    assert 'Monitor' == task_db.views['done']['design']
+    assert 'Jobs' == job_db.views['running_jobs']['design']
+    assert 'Monitor' == job_db.views['overview_total']['design']
+    assert 2 == task_db.design_updates
+    assert 2 == job_db.design_updates
+
+
+def test_views_mango():
+    db = MemoryDB(query_backend='mango')
+    simcity.management.set_task_database(db)
+    simcity.management.set_job_database(db)
+    simcity.create_views()
+    views = {}
+    for doc_id in db.all_ids():
+        if doc_id.startswith('_design/'):
+            views.update(db.get(doc_id).get('views', {}))
+    assert 'pending_by_priority' in views
+    assert 'overview_total' in views
+    assert set() == set(MANGO_VIEWS) & set(views)
+    db.save(simcity.Task({'_id': 'a'}))
+    assert ['a'] == [row.id for row in db.view('pending')]
+
+
+def test_views_single_database(db, capsys):
+    simcity.create_views(warm=True)
+    assert 3 == db.design_updates
+    assert 'running_jobs' in db.views
+    assert 'pending' in db.views
+    assert 'Building index of view Claim/pending' in capsys.readouterr()[0]
+
+
+def test_views_migration(capsys):
+    db = MemoryDB()
+    db.update_design_document('Monitor', {
+        'pending': {'map': 'function(doc) {}'},
+        'running_jobs': {'map': 'function(doc) {}'},
+        'done': {'map': 'function(doc) {}'},
+    })
+    simcity.management.set_task_database(db)
+    simcity.management.set_job_database(db)
+    simcity.create_views()
+    monitor = db.get('_design/Monitor')['views']
+    assert 'pending' not in monitor
+    assert 'running_jobs' not in monitor
+    assert 'function(doc) {}' != monitor['done']['map']
+    assert 'pending' in db.get('_design/Claim')['views']
+    assert 'running_jobs' in db.get('_design/Jobs')['views']
+    assert 'Updated the Monitor views' in capsys.readouterr()[0]
+    simcity.create_views()
+    assert '' == capsys.readouterr()[0]
@@ -0,0 +1,210 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import simcity
+from couchdb.http import ResourceConflict
+from simcity.database import MANGO_VIEWS
+from simcity.memorydb import MemoryDB, collation_key, mango_match
+
+
+def test_save_get():
+    db = MemoryDB()
+    doc = db.save(simcity.Document({'_id': 'a', 'value': 1}))
+    assert doc.rev.startswith('1-')
+    stored = db.get('a')
+    assert 1 == stored['value']
+    stored['value'] = 2
+    assert 1 == db.get('a')['value']
+
+    db.save(stored)
+    assert stored.rev.startswith('2-')
+    with pytest.raises(ResourceConflict):
+        db.save(doc)
+    with pytest.raises(ValueError):
+        db.get('b')
+
+    assert [False] == db.delete_documents([doc])
+    db.delete(stored)
+    assert 0 == len(db)
+
+
+def test_task_views():
+    db = MemoryDB()
+    db.save_documents([simcity.Task({'_id': 'a'}),
+                       simcity.Task({'_id': 'b'}),
+                       simcity.Task({'_id': 'c', 'lock': 1, 'done': 2}),
+                       simcity.Task({'_id': 'd', 'lock': -1, 'done': -1})])
+
+    assert ['a', 'b'] == [row.id for row in db.view('pending')]
+    assert ['b'] == [row.id for row in db.view('pending', startkey='b')]
+    assert ['a'] == [row.id for row in db.view('pending', limit=1)]
+    assert ['b'] == [row.id for row in db.view('pending', descending=True,
+                                               limit=1)]
+    rows = db.view('pending', include_docs=True)
+    assert 'task' == rows[0].doc['type']
+
+    overview = dict((row.key, row.value)
+                    for row in db.view('overview_total', group=True))
+    assert {'pending': 2, 'done': 1, 'error': 1} == overview
+    assert 4 == db.view('overview_total')[0].value
+
+    task = simcity.Task(db.get_single_from_view('pending', window_size=2))
+    assert task.id in ('a', 'b')
+    db.save(task.lock('myjob'))
+    assert 1 == len(db.view('pending'))
+
+
+def test_python_view():
+    db = MemoryDB()
+    db.add_python_view('phases', lambda doc: [
+        ([doc['ensemble'], phase], ms)
+        for phase, ms in doc.get('timing', {}).items()], '_stats',
+        design_doc='Stats')
+    db.save_documents([
+        simcity.Document({'ensemble': 'e', 'timing': {'execute': 10}}),
+        simcity.Document({'ensemble': 'e', 'timing': {'execute': 30}}),
+    ])
+
+    rows = db.view('phases', design_doc='Stats', group_level=2)
+    assert ['e', 'execute'] == rows[0].key
+    assert 20 == rows[0].value['sum'] / rows[0].value['count']
+    with pytest.raises(ValueError):
+        db.view('phases')
+
+
+def test_add_view():
+    db = MemoryDB()
+    db.url = 'http://fun.host/mydb'
+    assert 'mysim_0.1' == simcity.ensemble_view(db, 'mysim', '0.1')
+    views = db.get('_design/mysim_0.1')['views']
+    assert ['all_docs', 'list', 'status'] == sorted(views)
+
+
+def test_update_design_document():
+    db = MemoryDB()
+    views = {'a': {'map': 'function(doc) {}', 'reduce': None},
+             'b': {'map': 'function(doc) {}', 'reduce': '_count'}}
+    assert db.update_design_document('Test', views)
+    assert not db.update_design_document('Test', views)
+    assert {'map': 'function(doc) {}'} == db.get('_design/Test')['views']['a']
+    views['b']['reduce'] = '_sum'
+    assert db.update_design_document('Test', views)
+    assert db.update_design_document('Test', {}, remove=['a'])
+    assert ['b'] == list(db.get('_design/Test')['views'])
+    assert not db.update_design_document('Test', {}, remove=['a'])
+
+
+def test_view_design_documents():
+    db = MemoryDB()
+    db.save(simcity.Task({'_id': 'a'}))
+    assert ['a'] == [row.id for row in db.view('pending')]
+    assert ['a'] == [row.id for row in db.view('pending', design_doc='Claim')]
+    pytest.raises(ValueError, db.view, 'pending', design_doc='Jobs')
+
+
+def test_create_views_implemented():
+    db = MemoryDB()
+    simcity.management.set_task_database(db)
+    simcity.management.set_job_database(db)
+    simcity.create_views()
+    installed = set()
+    for doc_id in db.all_ids():
+        if doc_id.startswith('_design/'):
+            installed.update(db.get(doc_id)['views'])
+    assert 'timing' in installed
+    assert installed == set(db.views)
+
+
+def test_timing_view():
+    db = MemoryDB()
+    simcity.management.set_task_database(db)
+    for ms in (1000, 2000):
+        task = simcity.Task({'ensemble': 'e'}).lock('job').done()
+        task.record_timing('execute', ms / 1000.0)
+        db.save(task)
+    db.save(simcity.Task().record_timing('claim', 1))
+    profile = simcity.timing_profile()
+    assert ['execute'] == list(profile['e'])
+    assert 1500 == profile['e']['execute']['mean']
+
+
+def test_changes():
+    db = MemoryDB()
+    _, seq = db.changes_since()
+    doc = db.save(simcity.Document({'_id': 'a'}))
+    db.save(simcity.Document({'_id': 'b'}))
+    db.delete(doc)
+    assert ({'a', 'b'}, 3) == db.changes_since(seq)
+    changes = db.changes(since=seq)
+    assert ['b', 'a'] == [next(changes)['id'] for _ in range(2)]
+    feed = db.changes(heartbeat=10)
+    db.save(simcity.Document({'_id': 'c'}))
+    change = next(feed)
+    assert ('c', 4) == (change['id'], change['seq'])
+
+
+def test_collation():
+    values = [{'a': 1}, ['a'], 'b', 'a', 2, 1, True, False, None]
+    assert list(reversed(values)) == sorted(values, key=collation_key)
+
+
+def test_mango_match():
+    doc = {'type': 'task', 'lock': 5, 'input': {'x': 1}}
+    assert mango_match(doc, {'type': 'task', 'lock': {'$gt': 0}})
+    assert not mango_match(doc, {'lock': {'$gt': 0, '$lt': 5}})
+    assert mango_match(doc, {'input.x': 1, 'done': {'$exists': False}})
+    assert not mango_match(doc, {'done': {'$ne': 1}})
+    assert mango_match(doc, {'$or': [{'lock': 0}, {'lock': {'$in': [5]}}]})
+    assert mango_match(doc, {'$not': {'lock': 0}})
+    pytest.raises(ValueError, mango_match, doc, {'lock': {'$regex': '5'}})
+
+
+def test_find_bookmark():
+    db = MemoryDB()
+    for i in range(5):
+        db.save(simcity.Task({'_id': 'task{0}'.format(i), 'priority': i}))
+    docs, bookmark = db.find({'type': 'task'}, fields=['_id'], limit=2)
+    assert [{'_id': 'task0'}, {'_id': 'task1'}] == docs
+    docs, bookmark = db.find({'type': 'task'}, limit=2, bookmark=bookmark)
+    assert ['task2', 'task3'] == [doc['_id'] for doc in docs]
+    docs, _ = db.find({'type': 'task'}, sort=[{'priority': 'desc'}],
+                      limit=1)
+    assert 'task4' == docs[0]['_id']
+
+
+def test_mango_views():
+    view_db = MemoryDB()
+    mango_db = MemoryDB(query_backend='mango')
+    docs = [
+        simcity.Task({'_id': 'pending', 'ensemble': 'e'}),
+        simcity.Task({'_id': 'other', 'ensemble': 'f'}),
+        simcity.Task({'_id': 'running'}).lock('job'),
+        simcity.Task({'_id': 'done'}).lock('job').done(),
+        simcity.Task({'_id': 'error'}).error('failed'),
+        simcity.Job({'_id': 'queued'}).queue('host'),
+        simcity.Job({'_id': 'started'}).start(),
+        simcity.Job({'_id': 'archived'}).start().archive(),
+    ]
+    for doc in docs:
+        view_db.save(dict(doc))
+        mango_db.save(dict(doc))
+    for view in MANGO_VIEWS:
+        expected = [(row.id, row.value) for row in view_db.view(view)]
+        assert expected == [(row.id, row.value)
+                            for row in mango_db.view(view, batch_size=1)]
+    assert ['pending'] == [row.id for row in mango_db.view(
+        'pending', selector={'ensemble': 'e'})]
@@ -0,0 +1,100 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from simcity.metrics import Metrics, MetricsExporter, job_metrics
+import multiprocessing
+import requests
+
+
+def test_counter_and_gauge():
+    metrics = Metrics(labels={'host': 'node1'})
+    metrics.inc('simcity_tasks', command='run.sh', status='done')
+    metrics.inc('simcity_tasks', 2, command='run.sh', status='done')
+    metrics.set('simcity_backlog_tasks', 4)
+
+    assert 3 == metrics.get('simcity_tasks', command='run.sh',
+                            status='done')
+    text = metrics.render()
+    assert '# TYPE simcity_tasks counter' in text
+    assert ('simcity_tasks_total{host="node1",command="run.sh",'
+            'status="done"} 3') in text
+    assert 'simcity_backlog_tasks{host="node1"} 4' in text
+    assert text.endswith('# EOF\n')
+
+
+def test_histogram():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.observe('simcity_phase_seconds', 0.05, phase='claim')
+    metrics.observe('simcity_phase_seconds', 0.5, phase='claim')
+    metrics.observe('simcity_phase_seconds', 5, phase='claim')
+    with metrics.time('simcity_phase_seconds', phase='save'):
+        pass
+
+    text = metrics.render()
+    assert 'simcity_phase_seconds_bucket{phase="claim",le="0.1"} 1' in text
+    assert 'simcity_phase_seconds_bucket{phase="claim",le="1.0"} 2' in text
+    assert 'simcity_phase_seconds_bucket{phase="claim",le="+Inf"} 3' in text
+    assert 'simcity_phase_seconds_sum{phase="claim"} 5.55' in text
+    assert 'simcity_phase_seconds_count{phase="save"} 1' in text
+
+
+def test_disabled():
+    metrics = Metrics(enabled=False)
+    metrics.inc('simcity_tasks')
+    metrics.observe('simcity_phase_seconds', 1)
+    assert '# EOF\n' == metrics.render()
+
+
+def test_shared_metrics():
+    manager = multiprocessing.Manager()
+    metrics = Metrics(manager)
+    process = multiprocessing.Process(
+        target=metrics.inc, args=('simcity_tasks', 5))
+    process.start()
+    process.join()
+    assert 5 == metrics.get('simcity_tasks')
+
+
+def test_exporter(tmpdir):
+    metrics = Metrics()
+    metrics.inc('simcity_tasks')
+    path = str(tmpdir.join('simcity.prom'))
+    exporter = MetricsExporter(metrics, path=path, port=0, interval=60)
+    exporter.start()
+    try:
+        port = exporter.server.server_address[1]
+        response = requests.get('http://localhost:{0}/metrics'.format(port))
+        assert 'simcity_tasks_total 1' in response.text
+        assert 404 == requests.get(
+            'http://localhost:{0}/other'.format(port)).status_code
+    finally:
+        metrics.inc('simcity_tasks')
+        exporter.stop()
+
+    with open(path) as f:
+        assert 'simcity_tasks_total 2' in f.read()
+    assert ['simcity.prom'] == [p.basename for p in tmpdir.listdir()]
+
+
+def test_job_metrics():
+    metrics, exporter = job_metrics({}, None)
+    assert not metrics.enabled
+    assert exporter is None
+
+    metrics, exporter = job_metrics({'metrics_file': 'metrics.prom'}, None)
+    assert metrics.enabled
+    assert 'metrics.prom' == exporter.path
+    assert 'host' in metrics.labels
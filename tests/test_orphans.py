@@ -0,0 +1,88 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from simcity.orphans import BloomFilter, find_orphans, delete_orphans
+
+
+class ListingDAV(object):
+    base_url = 'https://dav.example.com'
+
+    def __init__(self, paths):
+        self.paths = set(paths)
+        self.removed = []
+
+    def list(self, path, depth=1):
+        prefix = path + '/' if path else ''
+        children = set()
+        for p in self.paths:
+            if p.startswith(prefix):
+                children.add(prefix + p[len(prefix):].split('/')[0])
+        for child in sorted(children):
+            is_dir = any(p.startswith(child + '/') for p in self.paths)
+            yield {'path': child, 'is_dir': is_dir}
+
+    def url_to_path(self, url):
+        return url[len(self.base_url):].lstrip('/')
+
+    def delete(self, path, ignore_not_existing=False):
+        self.removed.append(path)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    items = ['task_{0}'.format(i) for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    false_positives = sum('other_{0}'.format(i) in bloom
+                          for i in range(1000))
+    assert false_positives < 50
+
+
+def test_find_orphans(db):
+    blob = '0a' + 'f' * 62
+    dav = ListingDAV([
+        'a/a/out.txt',
+        'a/a/failed.txt',
+        'b/b/uploading.txt',
+        'or/task_orphan1/out.txt',
+        'or/task_orphan2/out.txt',
+        'or/not_a_task/out.txt',
+        'backups/old/out.txt',
+        'cas/0a/' + blob,
+        'cas/0b/0b' + 'e' * 62,
+        'cas/0b/0b' + 'e' * 62 + '.segments/00000',
+    ])
+    db.tasks['a']['files'] = {
+        'out.txt': {'url': dav.base_url + '/a/a/out.txt'}}
+    db.tasks['b'].update({'lock': 1, 'done': 0})
+    db.tasks['blob_' + blob] = {'_id': 'blob_' + blob, 'refs': 1}
+
+    orphans = sorted(find_orphans(database=db, dav=dav, capacity=100))
+    assert ['a/a/failed.txt',
+            'cas/0b/0b' + 'e' * 62,
+            'cas/0b/0b' + 'e' * 62 + '.segments',
+            'or/task_orphan1', 'or/task_orphan2'] == orphans
+
+    assert 5 == delete_orphans(orphans, dav=dav, parallelism=2,
+                               batch_size=3)
+    assert sorted(dav.removed) == orphans
+
+
+def test_find_orphans_without_files(db):
+    dav = ListingDAV(['a/a/failed.txt', 'or/task_orphan/out.txt'])
+    assert ['or/task_orphan'] == list(find_orphans(
+        database=db, dav=dav, capacity=100, check_files=False))
@@ -0,0 +1,59 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pytest
+import simcity
+import subprocess
+import sys
+
+lazy = pytest.mark.skipif(sys.version_info < (3, 5),
+                          reason="modules are loaded eagerly")
+
+
+def test_exports():
+    for name in simcity.__all__:
+        assert getattr(simcity, name) is not None
+    assert set(simcity.__all__) <= set(dir(simcity))
+    with pytest.raises(AttributeError):
+        simcity.does_not_exist
+
+
+def test_submit_function():
+    import simcity.submit  # noqa: F401
+    assert callable(simcity.submit)
+    assert simcity.submit.__module__ == 'simcity.submit'
+
+
+def test_submodule_attributes():
+    code = ('import simcity\n'
+            'print(simcity.management.__name__, simcity.util.__name__)\n')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    assert b'simcity.management simcity.util' == output.strip()
+
+
+@lazy
+def test_lazy_import():
+    code = ('import sys, simcity, simcity.__main__\n'
+            'heavy = ["couchdb", "requests", "jsonschema", "pystache", '
+            '"yaml", "tqdm", "pkg_resources"]\n'
+            'print(",".join(m for m in heavy if m in sys.modules))\n')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    assert b'' == output.strip()
@@ -133,3 +133,60 @@ def test_delete_attachment_couchdb(task_id, tmpdir):
     assert filename in task['_attachments']
     simcity.delete_attachment(task, filename)
     assert filename not in task['_attachments']
+
+
+@pytest.mark.usefixtures('task_db')
+def test_content_addressed_attachment(dav, tmpdir):
+    cfg = simcity.Config()
+    cfg.add_section('webdav', {'url': dav.base_url,
+                               'content_addressed': 'true'})
+    simcity.management._config = cfg
+    db = simcity.get_task_database()
+
+    task, dirname, filename = _upload_attachment('a', tmpdir)
+    other, dirname, filename = _upload_attachment('b', tmpdir)
+
+    digest = task.files[filename]['sha256']
+    path = 'cas/' + digest[:2] + '/' + digest
+    assert digest == other.files[filename]['sha256']
+    assert dav.base_url + '/' + path == task.files[filename]['url']
+    assert b'ab' == dav.files[path]
+    assert 2 == db.get('blob_' + digest)['refs']
+
+    simcity.download_attachment(other, dirname, filename)
+    with open(os.path.join(dirname, filename), 'rb') as f:
+        assert b'ab' == f.read()
+
+    simcity.delete_attachment(task, filename)
+    assert path in dav.files
+    assert 1 == db.get('blob_' + digest)['refs']
+    simcity.delete_attachment(other, filename)
+    assert path not in dav.files
+    pytest.raises(ValueError, db.get, 'blob_' + digest)
+
+
+@pytest.mark.usefixtures('task_db')
+def test_upload_attachment_too_large(task_id, tmpdir, monkeypatch):
+    monkeypatch.setattr(simcity.task, 'MAX_DATABASE_ATTACHMENT_SIZE', 1)
+    pytest.raises(IOError, _upload_attachment, task_id, tmpdir)
+
+
+@pytest.mark.usefixtures('task_db')
+def test_compressed_attachment(task_id, dav, tmpdir):
+    cfg = simcity.Config()
+    cfg.add_section('webdav', {'url': dav.base_url, 'compression': 'gzip',
+                               'compression_min_size_kb': 0})
+    simcity.management._config = cfg
+
+    task, dirname, filename, dav_path = _upload_attachment(task_id, tmpdir,
+                                                           dav)
+    assert 'gzip' == task.files[filename]['encoding']
+    assert 2 == task.files[filename]['uncompressed_length']
+    assert dav_path + '.gz' in dav.files
+    assert b'ab' == simcity.task.read_attachment(task, filename)
+
+    simcity.download_attachment(task, dirname, filename)
+    with open(os.path.join(dirname, filename), 'rb') as f:
+        assert b'ab' == f.read()
+    assert not os.path.exists(os.path.join(dirname, filename + '.gz'))
+    simcity.management._config = None
@@ -17,7 +17,8 @@
 from simcity.util import (expandfilenames, issequence, Timer, parse_parameters,
                           expandfilename, get_truthy, seconds_to_str, seconds,
                           sizeof_fmt, copyglob, is_geojson, data_content_type,
-                          file_content_type, listfiles, listdirs)
+                          file_content_type, listfiles, listdirs,
+                          node_memory_mb)
 import os
 import pytest
 import time
@@ -313,3 +314,10 @@ def test_listfiles(tmpdir):
     assert sorted(listdirs(str(tmpdir))) == ['dir1', 'dir2']
     pytest.raises(OSError, listfiles, 'non_existant_dir')
     pytest.raises(OSError, listdirs, 'non_existant_dir')
+
+
+def test_node_memory_mb(tmpdir):
+    meminfo = tmpdir.join('meminfo')
+    meminfo.write('MemTotal:       16305500 kB\nMemFree:  1000 kB\n')
+    assert 15923 == node_memory_mb(str(meminfo))
+    assert node_memory_mb(str(tmpdir.join('nonexistant'))) is None
@@ -0,0 +1,132 @@
+# SIM-CITY client
+#
+# Copyright 2015 Netherlands eScience Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import simcity
+from simcity.memorydb import MemoryDB
+from simcity.watch import (ProgressMonitor, duration_str, follow,
+                           task_status, watch)
+import threading
+
+
+def task_change(task_id, rev, lock, done=0):
+    return {'id': task_id, 'doc': {'_id': task_id, '_rev': rev,
+                                   'type': 'task', 'lock': lock,
+                                   'done': done}}
+
+
+def test_task_status():
+    assert 'pending' == task_status({'lock': 0, 'done': 0})
+    assert 'in_progress' == task_status({'lock': 1, 'done': 0})
+    assert 'done' == task_status({'lock': 1, 'done': 2})
+    assert 'error' == task_status({'lock': -1, 'done': 0})
+
+
+def test_duration_str():
+    assert '1:01:05' == duration_str(3665)
+
+
+def test_monitor_counts():
+    monitor = ProgressMonitor(window=10)
+    monitor.started = 0
+    monitor.seed({'pending': 3, 'in_progress': 1, 'done': 0, 'error': 0})
+
+    monitor.update(task_change('new', '1-a', 0), now=1)
+    # claimed before the monitor saw it
+    monitor.update(task_change('a', '2-a', 1), now=2)
+    monitor.update(task_change('a', '3-a', 1, 5), now=3)
+    # lease renewal must not be counted twice
+    monitor.update(task_change('b', '3-b', 1), now=3)
+    monitor.update(task_change('b', '4-b', 1), now=4)
+    monitor.update(task_change('c', '4-c', -1), now=5)
+    monitor.update({'id': 'b', 'deleted': True, 'doc': {'_id': 'b'}}, now=6)
+
+    assert {'pending': 2, 'in_progress': 0, 'done': 1,
+            'error': 1} == monitor.counts
+    # finished tasks are forgotten
+    assert {'new': 'pending'} == monitor.tasks
+    assert 0.2 == monitor.throughput(now=10)
+    assert 0.5 == monitor.error_rate(now=10)
+    assert 10 == monitor.eta(now=10)
+    assert 0 == monitor.throughput(now=16)
+    assert monitor.eta(now=16) is None
+
+
+def test_monitor_jobs():
+    monitor = ProgressMonitor()
+    monitor.seed({}, [{'_id': 'j1', 'hostname': 'node1'}])
+
+    monitor.update({'id': 'j2', 'doc': {'_id': 'j2', 'type': 'job',
+                                        'hostname': 'node1', 'start': 1,
+                                        'done': 0, 'archive': 0}})
+    monitor.update({'id': 'j3', 'doc': {'_id': 'j3', 'type': 'job',
+                                        'hostname': 'node2', 'start': 1,
+                                        'done': 0, 'archive': 0}})
+    monitor.update({'id': 'j1', 'doc': {'_id': 'j1', 'type': 'job',
+                                        'hostname': 'node1', 'start': 1,
+                                        'done': 2, 'archive': 0}})
+
+    assert {'node1': 1, 'node2': 1} == monitor.hosts()
+    assert 'node2' in monitor.format()
+
+
+def test_watch_seed():
+    task_db = MemoryDB()
+    task_db.save(simcity.Task({'_id': 'a', 'command': 'echo'}))
+    task_db.save(simcity.Task({'_id': 'b', 'command': 'echo', 'lock': -1}))
+    job_db = MemoryDB()
+    job_db.save(simcity.Job({'_id': 'j1', 'hostname': 'node1', 'start': 1}))
+
+    monitor = watch(lambda monitor: False, task_db=task_db, job_db=job_db)
+    assert {'pending': 1, 'in_progress': 0, 'done': 0,
+            'error': 1} == monitor.counts
+    assert {'node1': 1} == monitor.hosts()
+
+
+class FlakyChangesDB(object):
+    """ Database whose changes feed fails after the first change. """
+    url = 'http://localhost/db'
+
+    def __init__(self, changes):
+        self.changes_list = changes
+        self.since = []
+        self.done = threading.Event()
+
+    def changes(self, since='now'):
+        self.since.append(since)
+        if len(self.since) == 3:
+            self.done.set()
+        remaining = [change for change in self.changes_list
+                     if since == 'now' or change['seq'] > since]
+        if len(remaining) == 0:
+            self.done.wait()
+            return
+        yield remaining[0]
+        raise IOError('connection reset')
+
+
+def test_follow_reconnects():
+    changes = [task_change('a', '2-a', 1), task_change('b', '2-b', 1)]
+    for seq, change in enumerate(changes):
+        change['seq'] = seq + 1
+    db = FlakyChangesDB(changes)
+    monitor = ProgressMonitor()
+    monitor.seed({'pending': 2})
+
+    follow(db, monitor, since=0, retry_delay=0.01)
+    assert db.done.wait(5)
+    assert [0, 1, 2] == db.since
+    assert {'pending': 0, 'in_progress': 2, 'done': 0,
+            'error': 0} == monitor.counts
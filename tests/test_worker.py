@@ -15,7 +15,10 @@
 # limitations under the License.
 
 from simcity import Task
-from simcity.worker import Worker, ExecuteWorker
+import os
+import pytest
+import sys
+from simcity.worker import Worker, ExecuteWorker, PythonWorker
 from multiprocessing import Queue, Semaphore
 
 
@@ -123,3 +126,65 @@ def test_execute_worker(mock_directories):
     result = result_q.get()
     data = result.get_attachment('stdout.txt')['data']
     assert 'hello' == data.decode('utf-8')
+    assert (['execute', 'setup', 'stage_in', 'upload'] ==
+            sorted(result.timing.keys()))
+    assert 'finished_at' in result
+
+
+def python_task(params, dirs):
+    print(params['greeting'])
+    with open(os.path.join(dirs['SIMCITY_OUT'], 'result.txt'), 'w') as f:
+        f.write(os.environ['SIMCITY_TMP'])
+    return {'cwd': os.getcwd()}
+
+
+def test_python_worker(mock_directories):
+    task_q = Queue()
+    result_q = Queue()
+    semaphore = Semaphore(value=1)
+    task = Task({
+        'entry_point': 'test_worker:python_task',
+        'input': {'greeting': 'hello'},
+        'parallelism': 1,
+    })
+
+    cwd = os.getcwd()
+    worker = PythonWorker(1, mock_directories, task_q, result_q, semaphore)
+    task_q.put(task)
+    task_q.put(None)
+    worker.run()
+    result = result_q.get()
+    assert not result.has_error()
+    assert os.getcwd() == cwd
+    assert 'SIMCITY_TMP' not in os.environ
+    data = result.get_attachment('stdout.txt')['data']
+    assert 'hello' == data.decode('utf-8').strip()
+    tmp_dir = result.get_attachment('result.txt')['data'].decode('utf-8')
+    assert os.path.realpath(tmp_dir) == os.path.realpath(result.output['cwd'])
+    assert 'test_worker:python_task' in worker.functions
+
+
+def exit_task(params, dirs):
+    sys.exit(params['code'])
+
+
+@pytest.mark.parametrize('code,error', [(None, False), (0, False),
+                                        (3, True), ('failed', True)])
+def test_python_worker_exit(mock_directories, code, error):
+    task_q = Queue()
+    result_q = Queue()
+    task = Task({
+        'entry_point': 'test_worker:exit_task',
+        'input': {'code': code},
+        'parallelism': 1,
+    })
+    worker = PythonWorker(1, mock_directories, task_q, result_q,
+                          Semaphore(value=1))
+    task_q.put(task)
+    task_q.put(None)
+    worker.run()
+    result = result_q.get()
+    assert error == result.has_error()
+    if code == 'failed':
+        data = result.get_attachment('stderr.txt')['data']
+        assert 'failed' == data.decode('utf-8').strip()